@@ -0,0 +1,210 @@
+""" Time and memory-profile the verispy pipeline stages on synthetic incidents.
+
+Incidents are generated from the bundled schema (see `verispy.utils.synthetic`) once per size and seed, and kept in
+`--data-dir` for the following runs. Every run appends one record per size to `--results` (a JSONL file), so runs can be
+compared with each other:
+
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --label nightly
+    python benchmarks/run_benchmarks.py --sizes 10000 --compare last --fail-on-regression
+
+Peak memory is measured with `tracemalloc` in a separate pass (it slows down the code it traces), and is the peak of
+the memory allocated during each stage, on top of what was allocated before it.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # benchmark this working tree rather than an installed verispy
+
+from verispy import VERIS, __version__  # noqa: E402
+from verispy.utils.schema import BUNDLED_SCHEMA_PATH  # noqa: E402
+from verispy.utils.synthetic import write_incidents  # noqa: E402
+
+
+DEFAULT_RESULTS = os.path.join(HERE, 'results.jsonl')
+DEFAULT_DATA_DIR = os.path.join(HERE, 'data')
+SUMMARIES = [('action', None), ('action.hacking.variety', None), ('action', 'actor'),
+             ('asset.assets.variety', 'victim.orgsize'), ('attribute.confidentiality.data.variety', 'action')]
+
+
+def _rawjson_to_df(v, data):
+    data['raw'] = v._drop_duplicates(v._rawjson_to_df(data['filenames'], workers=data['workers']))
+
+
+def _combine_enums_raw_df(v, data):
+    data['df'] = v._combine_enums_raw_df(v.enumerations, v.nonenum_vars, data.pop('raw'))
+
+
+def _aggregate_a4s(v, data):
+    data['df'] = v._aggregate_a4s(data['df'])
+
+
+def _victim_postproc(v, data):
+    data['df'] = v._victim_postproc(data['df'])
+
+
+def enum_summary(v, data):
+    for enum, by in SUMMARIES:
+        v.enum_summary(data['df'], enum, by=by)
+
+
+def df_to_matrix(v, data):
+    v.df_to_matrix(data['df'], sparse=True)  # a dense matrix of a million incidents does not fit in memory
+
+
+STAGES = [_rawjson_to_df, _combine_enums_raw_df, _aggregate_a4s, _victim_postproc, enum_summary, df_to_matrix]
+
+
+def run_pipeline(filenames, workers=1, trace_memory=False):
+    """ Run every stage once. Returns {stage: seconds} or, with `trace_memory`, {stage: peak MB}. """
+    v = VERIS(verbose=False)
+    v.load_schema(BUNDLED_SCHEMA_PATH)  # no network access while benchmarking
+    v._build_enumerations()
+    data = {'filenames': filenames, 'workers': workers}
+    results = {}
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        for stage in STAGES:
+            gc.collect()
+            if trace_memory:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                stage(v, data)
+                results[stage.__name__] = (tracemalloc.get_traced_memory()[1] - before) / 1e6
+            else:
+                start = time.perf_counter()
+                stage(v, data)
+                results[stage.__name__] = time.perf_counter() - start
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return results
+
+
+def synthetic_files(data_dir, n, seed, fmt):
+    """ Filenames of `n` synthetic incidents, generating them if they are not in `data_dir` yet. """
+    if fmt == 'jsonl':
+        path = os.path.join(data_dir, 'synthetic_{}_{}.jsonl.gz'.format(n, seed))
+        if not os.path.exists(path):
+            print('Generating {} incidents in {}'.format(n, path))
+            write_incidents(path + '.tmp.jsonl.gz', n, seed=seed)
+            os.replace(path + '.tmp.jsonl.gz', path)
+        return [path]
+    path = os.path.join(data_dir, 'synthetic_{}_{}'.format(n, seed))
+    if not os.path.isdir(path) or len(os.listdir(path)) != n:
+        print('Generating {} incidents in {}'.format(n, path))
+        return write_incidents(path, n, seed=seed)
+    return sorted(os.path.join(path, name) for name in os.listdir(path))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(records, record, compare):
+    """ The record to compare `record` with: the latest earlier one of the same size and format, or run `compare`. """
+    matches = [old for old in records if old['n'] == record['n'] and old['format'] == record['format']]
+    if compare != 'last':
+        matches = [old for old in matches if old['run_id'] == compare or old.get('label') == compare]
+    return matches[-1] if matches else None
+
+
+def compare_records(baseline, record, tolerance):
+    """ Table of the stages of two records. Returns (DataFrame, list of regressed stages). """
+    rows = []
+    regressions = []
+    for stage, new in record['stages'].items():
+        old = baseline['stages'].get(stage, {})
+        row = {'stage': stage}
+        for metric in ('seconds', 'peak_mb'):
+            if new.get(metric) is None or old.get(metric) is None:
+                continue
+            row['old ' + metric] = old[metric]
+            row['new ' + metric] = new[metric]
+            row[metric + ' ratio'] = new[metric] / old[metric] if old[metric] > 0 else np.nan
+            if row[metric + ' ratio'] > 1 + tolerance:
+                regressions.append('{} ({})'.format(stage, metric))
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('stage'), regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help='Numbers of incidents (default: 10000)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic incidents (default: 0)')
+    parser.add_argument('--format', choices=['jsonl', 'json'], default='jsonl',
+                        help='Store the incidents as a gzipped JSONL file, or a directory of JSON files like VCDB')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per size; the fastest time of each stage is kept')
+    parser.add_argument('--workers', type=int, default=1, help='`workers` of `_rawjson_to_df`')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the (slower) memory profiling pass')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where to keep the synthetic incidents')
+    parser.add_argument('--results', default=DEFAULT_RESULTS, help='JSONL file the results are appended to')
+    parser.add_argument('--label', default=None, help='Name of this run, to compare with it later')
+    parser.add_argument('--compare', default=None, metavar='RUN',
+                        help="Compare with a previous run: 'last', a run_id or a label")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Slow-down (or memory growth) ratio above which a stage is a regression (default: 0.1)')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 if a stage regressed')
+    args = parser.parse_args(argv)
+
+    previous = load_results(args.results)
+    run_id = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    environment = {'verispy': __version__, 'commit': git_commit(), 'python': platform.python_version(),
+                   'pandas': pd.__version__, 'numpy': np.__version__, 'platform': platform.platform()}
+    regressed = False
+    for n in args.sizes:
+        filenames = synthetic_files(args.data_dir, n, args.seed, args.format)
+        seconds = {}
+        for _ in range(args.repeat):
+            for stage, elapsed in run_pipeline(filenames, args.workers).items():
+                seconds[stage] = min(elapsed, seconds.get(stage, elapsed))
+        peak_mb = {} if args.no_memory else run_pipeline(filenames, args.workers, trace_memory=True)
+        record = dict(run_id=run_id, label=args.label, n=n, seed=args.seed, format=args.format, workers=args.workers,
+                      stages={stage: {'seconds': seconds[stage], 'peak_mb': peak_mb.get(stage)} for stage in seconds},
+                      **environment)
+
+        print('\n{} incidents'.format(n))
+        print(pd.DataFrame(record['stages']).T.round(3).to_string())
+        if args.compare:
+            baseline = find_baseline(previous, record, args.compare)
+            if baseline is None:
+                print('No previous run to compare with.')
+            else:
+                table, regressions = compare_records(baseline, record, args.tolerance)
+                print('\nCompared with run {} ({}, commit {}):'.format(baseline['run_id'], baseline.get('label'),
+                                                                        baseline.get('commit')))
+                print(table.round(3).to_string())
+                if regressions:
+                    regressed = True
+                    print('Regressions: {}'.format(', '.join(regressions)))
+
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    return 1 if regressed and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
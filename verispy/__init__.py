@@ -3,6 +3,6 @@
 # Spokane, WA USA
 # Copyright 2018-2021 RiskLens, Inc.
 
-from .veris import VERIS
+__version__ = '0.1.13'  # defined before importing VERIS, which uses it in its cache keys
 
-__version__ = '0.1.13'
\ No newline at end of file
+from .veris import VERIS
\ No newline at end of file
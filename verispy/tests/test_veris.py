@@ -1,19 +1,169 @@
 import pytest
 import os
 import glob
+import shutil
+import gzip
+import json
+import pickle
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import numpy as np
 import pandas as pd
+from scipy.spatial.distance import pdist, squareform
 from ..veris import VERIS
 from ..utils import industry as industry_const
 from ..utils import constants as veris_const
+from ..utils import cache as veris_cache
+from ..utils import loaders
+from ..utils import plan as veris_plan
+from ..utils.bitpack import BitPackedFrame
+from ..utils.colindex import column_index
+from ..utils.minhash import MinHashIndex
+from ..utils.synthetic import IncidentGenerator, write_incidents
+from ..utils.where import IncidentFilter
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'schema', 'verisc-merged.json')
+LAZY_MODULES = ('matplotlib', 'statsmodels', 'requests', 'tqdm', 'scipy')  # imported when first needed
+IMPORT_TIME_BUDGET = 1.0  # seconds to import verispy, on top of pandas and numpy
+IMPORT_MODULE_BUDGET = 100  # modules imported by verispy, on top of pandas and numpy
+
+
+class SchemaServer(object):
+    """ Local HTTP stand-in for the schema host. Serves the test schema with an ETag and honors If-None-Match. """
+
+    def __init__(self):
+        with open(SCHEMA_PATH, 'rb') as f:
+            self.body = f.read()
+        self.etag = '"v1"'
+        self.requests = []  # (path, If-None-Match header) of every request
+        self.delay = 0
+        self.status = 200
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, self.headers.get('If-None-Match')))
+                time.sleep(server.delay)
+                if server.status != 200:
+                    self.send_response(server.status)
+                    self.end_headers()
+                elif self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                else:
+                    self.send_response(200)
+                    self.send_header('ETag', server.etag)
+                    self.send_header('Content-Length', str(len(server.body)))
+                    self.end_headers()
+                    self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/verisc-merged.json'.format(self.httpd.server_port)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def schema_server():
+    server = SchemaServer()
+    yield server
+    server.close()
 
 
 class Test_VERIS(object):
 
+    def test_import_time(self):
+        # in a fresh interpreter, as these tests have imported everything already
+        code = '\n'.join([
+            'import json, sys, time',
+            'import numpy, pandas',
+            'before = set(sys.modules)',
+            'start = time.perf_counter()',
+            'import verispy',
+            'seconds = time.perf_counter() - start',
+            'print(json.dumps({"seconds": seconds, "modules": sorted(set(sys.modules) - before)}))',
+        ])
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+        result = json.loads(subprocess.check_output([sys.executable, '-c', code], env=env).decode().splitlines()[-1])
+        imported = set(module.split('.')[0] for module in result['modules'])
+        assert not imported & set(LAZY_MODULES)
+        assert len(result['modules']) < IMPORT_MODULE_BUDGET
+        assert result['seconds'] < IMPORT_TIME_BUDGET
+
     def test_load_schema(self):
         v = VERIS()
         v.load_schema(schema_path=os.path.join(os.path.dirname(__file__), 'data', 'schema', 'verisc-merged.json'))
         assert type(v.vschema) is dict
 
+    def test_load_schema_cache(self, tmp_path, schema_server):
+        cache_dir = str(tmp_path / 'schema')
+        v = VERIS(verbose=False, schema_url=schema_server.url, schema_cache_dir=cache_dir)
+        v.load_schema()
+        assert v.schema_source == 'network'
+        assert 'action' in v.vschema['properties']
+
+        # within the ttl, no request is made at all
+        VERIS(verbose=False, schema_url=schema_server.url, schema_cache_dir=cache_dir).load_schema()
+        assert len(schema_server.requests) == 1
+
+        # past the ttl, the schema is revalidated with its ETag
+        v = VERIS(verbose=False, schema_url=schema_server.url, schema_cache_dir=cache_dir, schema_ttl=0)
+        v.load_schema()
+        assert v.schema_source == 'revalidated'
+        assert schema_server.requests[-1][1] == schema_server.etag
+
+        # server errors and timeouts fall back to the cached copy ...
+        schema_server.status = 500
+        with pytest.warns(UserWarning, match=r'cached copy'):
+            v.load_schema()
+        assert v.schema_source == 'stale-cache'
+        schema_server.status = 200
+        schema_server.delay = 0.5
+        v = VERIS(verbose=False, schema_url=schema_server.url, schema_cache_dir=cache_dir, schema_ttl=0, schema_timeout=0.1)
+        with pytest.warns(UserWarning, match=r'cached copy'):
+            v.load_schema()
+        assert v.schema_source == 'stale-cache'
+
+        # ... or to the bundled schema if nothing has been cached
+        v = VERIS(verbose=False, schema_url=schema_server.url, schema_cache_dir=None, schema_timeout=0.1)
+        with pytest.warns(UserWarning, match=r'bundled'):
+            v.load_schema()
+        assert v.schema_source == 'bundled'
+        assert 'action' in v.vschema['properties']
+
+    def test_load_schema_unwritable_cache(self, tmp_path, schema_server):
+        # the schema cache is best-effort: a cache directory that cannot be created only warns
+        not_a_dir = tmp_path / 'cache'
+        not_a_dir.write_text('not a directory')
+        v = VERIS(verbose=False, schema_url=schema_server.url, schema_cache_dir=str(not_a_dir))
+        with pytest.warns(UserWarning, match=r'Could not write'):
+            v.load_schema()
+        assert v.schema_source == 'network'
+        assert 'action' in v.vschema['properties']
+        assert not_a_dir.read_text() == 'not a directory'
+
+    def test_default_cache_dirs(self, tmp_path, monkeypatch):
+        # the default cache directories follow the environment at the time the caches are created
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        assert VERIS(verbose=False).schema_cache.cache_dir == str(tmp_path / 'verispy')
+        assert veris_cache.DataFrameCache().cache_dir == str(tmp_path / 'verispy' / 'dataframes')
+        assert os.path.isdir(str(tmp_path / 'verispy' / 'dataframes'))
+        assert VERIS(verbose=False, schema_cache_dir=None).schema_cache.cache_dir is None
+
     def test_load_raw_data(self):
         v = VERIS()
         fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
@@ -22,6 +172,54 @@ class Test_VERIS(object):
         assert type(raw_df) is pd.DataFrame
         assert raw_df.shape == (num_files, 85)
 
+    def test_load_raw_data_parallel(self):
+        v = VERIS(verbose=False)
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        serial_df = v._rawjson_to_df(fnames)
+
+        # same frame (including row order) no matter how the files are split up and parsed
+        threads_df = v._rawjson_to_df(fnames, workers=4, chunksize=7)
+        pd.testing.assert_frame_equal(serial_df, threads_df)
+        procs_df = v._rawjson_to_df(fnames, workers=2, chunksize=30, use_processes=True)
+        pd.testing.assert_frame_equal(serial_df, procs_df)
+        fast_df = v._rawjson_to_df(fnames, workers=3, fast_json=True)
+        pd.testing.assert_frame_equal(serial_df, fast_df)
+
+        with pytest.raises(ValueError, match=r'workers'):
+            v._rawjson_to_df(fnames, workers=0)
+
+    def test_load_raw_data_archives(self, tmp_path):
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        v = VERIS(verbose=False)
+        serial_df = v._rawjson_to_df(fnames)
+
+        # split the files into a zip archive, a tar.gz archive, JSONL files and plain files
+        zip_path, tar_path = str(tmp_path / 'a.zip'), str(tmp_path / 'b.tar.gz')
+        jsonl_path, jsonl_gz_path = str(tmp_path / 'c.jsonl'), str(tmp_path / 'd.jsonl.gz')
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            for fname in fnames[:30]:
+                archive.write(fname, 'incidents/' + os.path.basename(fname))
+            archive.writestr('README.txt', 'not an incident')
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            for fname in fnames[30:60]:
+                archive.add(fname, os.path.basename(fname))
+        for path, opener, part in [(jsonl_path, open, fnames[60:80]), (jsonl_gz_path, gzip.open, fnames[80:90])]:
+            with opener(path, 'wt') as f:
+                for fname in part:
+                    with open(fname) as incident:
+                        f.write(json.dumps(json.load(incident)) + '\n\n')
+        sources = [zip_path, tar_path, jsonl_path, jsonl_gz_path] + fnames[90:]
+
+        pd.testing.assert_frame_equal(v._rawjson_to_df(sources), serial_df)
+        pd.testing.assert_frame_equal(v._rawjson_to_df(sources, workers=3, chunksize=4), serial_df)
+        assert VERIS(json_dir=zip_path, verbose=False).filenames == [zip_path]
+
+        # streamed in chunks that cross the archive boundaries
+        chunks = list(v.iter_json_to_df(sources, chunk_size=25, schema_path=SCHEMA_PATH))
+        assert [chunk.shape[0] for chunk in chunks] == [25, 25, 25, 25]
+        pd.testing.assert_frame_equal(pd.concat(chunks), v.json_to_df(fnames, schema_path=SCHEMA_PATH)[v.plan.columns],
+                                      check_dtype=False)
+
     def test_schema_enumerations(self):
         v = VERIS()
         v.load_schema(schema_path=os.path.join(os.path.dirname(__file__), 'data', 'schema', 'verisc-merged.json'))
@@ -36,6 +234,36 @@ class Test_VERIS(object):
         assert type(enumerations['action.error.variety']) is list
         assert len(enumerations['action.error.variety']) >= 15
 
+    def test_schema_plan(self):
+        v = VERIS(verbose=False)
+        v.load_schema(schema_path=SCHEMA_PATH)
+        plan = v._get_plan()
+        assert plan.enumerations['action.error.variety'] == v.enumerations['action.error.variety']
+
+        # compiled once per schema and shared between objects
+        v2 = VERIS(verbose=False)
+        v2.load_schema(schema_path=SCHEMA_PATH)
+        assert v2._get_plan() is plan
+
+        a4_groups = {name: (columns, negate) for name, columns, negate in plan.a4_groups}
+        assert 'action.hacking.variety.SQLi' in a4_groups['action.Hacking'][0]
+        assert a4_groups['actor.Unknown'][1]
+        assert 'attribute.confidentiality.data_disclosure.Yes' in a4_groups['attribute.Confidentiality'][0]
+        assert 'attribute.confidentiality.data_disclosure.No' not in a4_groups['attribute.Confidentiality'][0]
+        assert plan.columns == sorted(plan.columns)
+
+        # plans survive pickling, e.g. to be sent to other processes
+        unpickled = pickle.loads(pickle.dumps(plan))
+        assert unpickled.columns == plan.columns
+        assert unpickled.a4_groups == plan.a4_groups
+        veris_plan.register_plan(unpickled)
+        assert veris_plan.get_plan(v.vschema, v._enums_from_schema) is unpickled
+
+        # every schema-determined column is in the DataFrame, in the same order
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        df = v.json_to_df(fnames[:10], schema_path=SCHEMA_PATH)
+        assert [col for col in df.columns if col in plan.column_index] == plan.columns
+
     def test_combine_enums_raw_df(self):
         v = VERIS()
         fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
@@ -72,6 +300,28 @@ class Test_VERIS(object):
                 assert comb_df[itemname].dtype in ['float', 'int']
 
 
+    def test_combine_enums_values(self):
+        v = VERIS(verbose=False)
+        enums = {'action.error.variety': ['Loss', 'Misdelivery', 'Unknown'],
+                 'asset.assets.variety': ['S - Database', 'U - Laptop'], 'asset.assets.amount': ['S - Database', 'U - Laptop']}
+        non_enums = [{'name': 'summary', 'type': 'string'}, {'name': 'timeline.incident.year', 'type': 'integer'}]
+        raw_df = pd.DataFrame({
+            'action.error.variety': [['Loss', 'Unknown'], 'Misdelivery', float('nan'), []],
+            'asset.assets': [[{'variety': 'S - Database', 'amount': 3}], ['U - Laptop'],
+                             [{'variety': 'U - Laptop'}, {'variety': 'U - Laptop', 'amount': 2}], float('nan')]},
+            index=[0, 2, 5, 7])
+
+        comb_df = v._combine_enums_raw_df(enums, non_enums, raw_df)
+        assert list(comb_df.index) == [0, 2, 5, 7]
+        assert list(comb_df['action.error.variety.Loss']) == [True, False, False, False]
+        assert list(comb_df['action.error.variety.Misdelivery']) == [False, True, False, False]
+        assert list(comb_df['action.error.variety.Unknown']) == [True, False, False, False]
+        assert list(comb_df['asset.assets.variety.U - Laptop']) == [False, True, True, False]
+        assert list(comb_df['asset.assets.amount.U - Laptop']) == [None, True, 2, None]
+        assert comb_df['asset.assets.amount.S - Database'].dtype == float
+        assert comb_df['summary'].isnull().all()
+        assert comb_df['timeline.incident.year'].isnull().all()
+
     def test_aggregate_a4s(self):
         # from here out, just going to run the json_to_df procedure and then test individual func results
         v = VERIS()
@@ -108,6 +358,29 @@ class Test_VERIS(object):
         action_a4s_sum = action_a4s_sum.apply(lambda x: True if x >= 1 else False)
         assert comb_df['action.Unknown'].all() == (~action_a4s_sum).all()
 
+    def test_aggregate_a4s_exclusions(self):
+        v = VERIS(verbose=False)
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        comb_df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+
+        # confidentiality: any confidentiality enumeration, except data_disclosure No/Unknown on their own
+        conf_cols = [col for col in comb_df.columns if col.startswith('attribute.confidentiality.')
+                     and comb_df[col].dtype == bool and col not in veris_const.CONFIDENTIALITY_EXCLUDE]
+        assert (comb_df['attribute.Confidentiality'] == comb_df[conf_cols].any(axis=1)).all()
+        disclosure_no = comb_df['attribute.confidentiality.data_disclosure.No']
+        assert not comb_df.loc[disclosure_no & ~comb_df[conf_cols].any(axis=1), 'attribute.Confidentiality'].any()
+
+        # unknown actor/action is the complement of the other A4 names
+        for name in ['actor', 'action']:
+            known = ['.'.join((name, suffix)) for suffix in veris_const.A4NAMES[name] if suffix != 'Unknown']
+            assert (comb_df['.'.join((name, 'Unknown'))] == ~comb_df[known].any(axis=1)).all()
+
+        # asset varieties
+        server_cols = [col for col in comb_df.columns if col.startswith('asset.assets.variety.S ')]
+        assert (comb_df['asset.variety.Server'] == comb_df[server_cols].any(axis=1)).all()
+        for name, _, _ in v.plan.a4_groups:
+            assert comb_df[name].dtype == bool
+
     def test_victim_industries(self):
         v = VERIS()
         fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
@@ -130,6 +403,32 @@ class Test_VERIS(object):
         assert comb_df['victim.industry3'].all() == \
                comb_df['victim.industry'].apply(lambda x: str(x)[:3] if not pd.isnull(x) else None).all()
 
+    def test_industry_index(self):
+        index = industry_const.IndustryIndex()
+        values = ['5221', 522110, None, '99', '92', 5221]
+        levels = index.levels(values, levels=(2, 3, 4))
+        assert list(levels[2]) == ['52', '52', None, '99', '92', '52']
+        assert list(levels[4]) == ['5221', '5221', None, '99', '92', '5221']
+        assert list(index.names(levels[2])) == ['Finance', 'Finance', 'Unknown', 'Unknown', 'Public', 'Finance']
+        assert index.names(['52'], field='title')[0] == 'Finance and Insurances'
+        one_hot = index.one_hot(levels[2], ['52', '92'])
+        assert one_hot.tolist() == [[True, False], [True, False], [False, False], [False, False], [False, True],
+                                    [True, False]]
+        categorical = index.categorical(values, 3)
+        assert list(categorical.categories) == ['522', '92', '99'] and categorical.isna().sum() == 1
+
+        # deeper levels on request, the default output is unchanged
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        df = VERIS(verbose=False).json_to_df(fnames)
+        deep_df = VERIS(verbose=False, industry_depth=5).json_to_df(fnames)
+        assert 'victim.industry4' not in df.columns
+        pd.testing.assert_frame_equal(deep_df.drop(columns=['victim.industry4', 'victim.industry5']), df)
+        for level in (4, 5):
+            expected = deep_df['victim.industry'].apply(lambda x: str(x)[:level] if not pd.isnull(x) else None)
+            assert deep_df['victim.industry{}'.format(level)].tolist() == expected.tolist()
+        with pytest.raises(ValueError):
+            VERIS(industry_depth=7)
+
     def test_enum_summary(self):
 
         v = VERIS(json_dir=os.path.join(os.path.dirname(__file__), 'data'))
@@ -169,6 +468,63 @@ class Test_VERIS(object):
         with pytest.raises(NotImplementedError, match=r'donuts'):
             v.enum_summary(comb_df, 'action', 'actor', ci_method='donuts')
 
+    def test_enum_summary_by_counts(self):
+
+        v = VERIS(json_dir=os.path.join(os.path.dirname(__file__), 'data'))
+        comb_df = v.json_to_df()
+        packed = BitPackedFrame.from_df(comb_df)
+
+        # x and n of each `by` value are the counts within the incidents having that value
+        for use_unk in [False, True]:
+            by_ci = v.enum_summary(comb_df, 'action', 'actor', use_unk=use_unk)
+            pd.testing.assert_frame_equal(v.enum_summary(packed, 'action', 'actor', use_unk=use_unk), by_ci)
+            for row in by_ci.itertuples():
+                sub_df = comb_df[comb_df[row.by]]
+                assert row.x == sub_df['action.' + row.enum].sum()
+                count_cols = ['action.' + enum for enum in veris_const.A4NAMES['action'] if use_unk or enum != 'Unknown']
+                if use_unk or row.enum != 'Unknown':
+                    assert row.n == sub_df[count_cols].any(axis=1).sum()
+                else:
+                    assert row.n != row.n
+
+    def test_enum_summary_many(self):
+
+        v = VERIS(json_dir=os.path.join(os.path.dirname(__file__), 'data'))
+        comb_df = v.json_to_df()
+
+        enums = ['action', 'actor.external.variety', 'timeline.incident.year', 'mmm_donuts']
+        for by in [None, 'actor']:
+            many = v.enum_summary_many(comb_df, enums, by=by, ci_method='wilson')
+            assert list(many.columns[:2]) == (['variable', 'by'] if by else ['variable', 'enum'])
+            assert list(many['variable'].unique()) == enums[:3]
+            # each enumeration's rows are exactly what enum_summary gives for it
+            for enum in enums:
+                one = v.enum_summary(comb_df, enum, by=by, ci_method='wilson')
+                got = many[many['variable'] == enum].drop(columns='variable').reset_index(drop=True)
+                pd.testing.assert_frame_equal(got, one, check_dtype=False, check_index_type=False)
+
+        with pytest.raises(ValueError):
+            v.enum_summary_many(comb_df, [])
+
+    def test_enum_summary_compact(self):
+        v = VERIS(verbose=False)
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        compact = v.json_to_df(fnames, schema_path=SCHEMA_PATH, compact=True)
+        assert compact['timeline.incident.year'].dtype == 'Int16'
+        assert compact['asset.total_amount'].isna().any()  # nullable numerical column with missing values
+
+        # numerical columns of a compact frame (nullable Int, float32) are summarized like those of the default frame
+        for enum, by in [('timeline.incident.year', None), ('timeline.incident.year', 'actor'), ('asset.total_amount', None),
+                         ('action', 'timeline.incident.year')]:
+            one = v.enum_summary(compact, enum, by=by)
+            assert len(one) > 0
+            pd.testing.assert_frame_equal(one, v.enum_summary(df, enum, by=by), check_dtype=False)
+        enums = ['action', 'timeline.incident.year', 'asset.total_amount']
+        many = v.enum_summary_many(compact, enums, by='actor')
+        assert list(many['variable'].unique()) == enums
+        pd.testing.assert_frame_equal(many, v.enum_summary_many(df, enums, by='actor'), check_dtype=False)
+
     def test_plot_barchart(self):
 
         v = VERIS(json_dir=os.path.join(os.path.dirname(__file__), 'data'))
@@ -193,3 +549,513 @@ class Test_VERIS(object):
             v.plot_barchart(action_ci, abe_simpson='yelling_at_clouds')
 
 
+
+    def test_json_to_df_cache(self, tmp_path):
+        schema_path = os.path.join(os.path.dirname(__file__), 'data', 'schema', 'verisc-merged.json')
+        fnames = []
+        for fname in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))[:20]:
+            fnames.append(str(tmp_path / os.path.basename(fname)))
+            shutil.copy(fname, fnames[-1])
+        cache_dir = str(tmp_path / 'cache')
+
+        v = VERIS(verbose=False, cache_dir=cache_dir)
+        df = v.json_to_df(fnames[:20], schema_path=schema_path)
+        assert (v.cache.hits, v.cache.misses) == (0, 1)
+        assert len(v.cache.entries()) == 1
+
+        # a new object pointed at the same directory gets the same DataFrame back
+        v2 = VERIS(verbose=False, cache_dir=cache_dir)
+        cached_df = v2.json_to_df(fnames[:20], schema_path=schema_path)
+        assert (v2.cache.hits, v2.cache.misses) == (1, 0)
+        pd.testing.assert_frame_equal(df, cached_df)
+        assert 'action.error.variety' in v2.enumerations
+
+        # different files, or a modified file, are misses
+        v2.json_to_df(fnames[:10], schema_path=schema_path)
+        assert v2.cache.misses == 1
+        stat = os.stat(fnames[0])
+        os.utime(fnames[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        v2.json_to_df(fnames[:20], schema_path=schema_path)
+        assert v2.cache.misses == 2
+
+        # use_cache=False neither reads nor writes
+        v2.json_to_df(fnames[:5], schema_path=schema_path, use_cache=False)
+        assert (v2.cache.hits, v2.cache.misses) == (1, 2)
+
+        # corrupted entries are discarded and rebuilt
+        for path, _, _ in v2.cache.entries():
+            with open(path, 'wb') as f:
+                f.write(b'not a pickle')
+        with pytest.warns(UserWarning, match=r'unreadable'):
+            rebuilt_df = v2.json_to_df(fnames[:20], schema_path=schema_path)
+        pd.testing.assert_frame_equal(df, rebuilt_df)
+
+        # only the most recent entry survives a tiny size cap
+        v3 = VERIS(verbose=False, cache_dir=cache_dir, cache_max_size=1)
+        v3.json_to_df(fnames[:3], schema_path=schema_path)
+        assert len(v3.cache.entries()) == 1
+
+    def test_json_to_df_stats(self, tmp_path):
+        records = []
+        v = VERIS(verbose=False, stats_observer=records.append, cache_dir=str(tmp_path / 'cache'))
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        df = v.json_to_df(fnames + fnames[:2], schema_path=SCHEMA_PATH)  # two duplicated incidents
+        stages = [record['stage'] for record in v.stats.stages]
+        assert stages == ['load_schema', 'cache_load', 'load_raw', 'drop_duplicates', 'enumerations', 'a4_aggregation',
+                          'victim_postproc', 'patterns', 'sort_columns', 'cache_store']
+        assert records == v.stats.stages  # the observer saw every stage as it finished
+        by_stage = {record['stage']: record for record in v.stats.stages}
+        assert by_stage['load_raw']['files'] == len(fnames) + 2 and by_stage['load_raw']['rows'] == len(fnames) + 2
+        assert by_stage['drop_duplicates']['dropped_duplicates'] == 2
+        assert (by_stage['sort_columns']['rows'], by_stage['sort_columns']['columns']) == df.shape
+        assert not by_stage['cache_load']['hit']
+        for record in v.stats.stages:
+            assert record['wall_s'] >= 0 and record['cpu_s'] >= 0
+
+        exported = json.loads(v.stats.to_json(str(tmp_path / 'stats.json')))
+        assert exported['stages'] == v.stats.stages and exported['wall_s'] == pytest.approx(v.stats.total())
+        with open(str(tmp_path / 'stats.json'), 'r') as f:
+            assert json.load(f) == exported
+        assert list(v.stats.to_df()['stage']) == stages
+
+        v.json_to_df(fnames + fnames[:2], schema_path=SCHEMA_PATH)
+        assert [record['stage'] for record in v.stats.stages] == ['load_schema', 'cache_load']
+        assert v.stats.stages[-1]['hit'] and v.stats.stages[-1]['rows'] == df.shape[0]
+
+        list(v.iter_json_to_df(fnames, chunk_size=40, schema_path=SCHEMA_PATH))
+        stages = [record['stage'] for record in v.stats.stages]
+        assert stages.count('read_json') == 3 and stages.count('victim_postproc') == 3
+
+    def test_patterns(self):
+        v = VERIS(verbose=False)
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        pattern_cols = ['.'.join(('pattern', name)) for name in veris_const.PATTERNS]
+        for col in pattern_cols:
+            assert df[col].dtype == bool
+        assert list(df['pattern'].cat.categories) == veris_const.PATTERNS
+
+        # the pattern of an incident is the first one it matches, "Everything Else" if it matches no other
+        first = df[pattern_cols].values.argmax(axis=1)
+        assert (df['pattern'].astype(str).values == np.array(veris_const.PATTERNS)[first]).all()
+        assert (df['pattern.Everything Else'] == ~df[pattern_cols[:-1]].any(axis=1)).all()
+
+        # a few of the rules
+        skimmer = df['action.physical.variety.Skimmer'] | \
+                  (df['action.physical.variety.Tampering'] & df['attribute.confidentiality.data.variety.Payment'])
+        assert (df['pattern.Payment Card Skimmers'] == skimmer).all()
+        assert (df['pattern.Privilege Misuse'] == df['action.Misuse']).all()
+        assert not (df['pattern.Web Applications'] & df['action.hacking.variety.DoS']).any()
+        assert not (df['pattern.Miscellaneous Errors'] & df['pattern.Lost and Stolen Assets']).any()
+
+        summary = v.enum_summary(df, 'pattern').set_index('enum')
+        for name, col in zip(veris_const.PATTERNS, pattern_cols):
+            assert summary.loc[name, 'x'] == df[col].sum()
+
+    def test_update_df(self, tmp_path):
+        schema_path = os.path.join(os.path.dirname(__file__), 'data', 'schema', 'verisc-merged.json')
+        fnames = []
+        for fname in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))[:30]:
+            fnames.append(str(tmp_path / os.path.basename(fname)))
+            shutil.copy(fname, fnames[-1])
+
+        v = VERIS(verbose=False)
+        full_df = v.json_to_df(fnames, schema_path=schema_path)
+
+        # adding files one batch at a time gives the same DataFrame as building it all at once
+        df = v.json_to_df(fnames[:12], schema_path=schema_path)
+        df = v.update_df(df, fnames[12:20])
+        df = v.update_df(df, fnames[20:])
+        pd.testing.assert_frame_equal(full_df, df)
+
+        # a modified file replaces its row in place
+        with open(fnames[5], 'r') as f:
+            incident = json.load(f)
+        incident['summary'] = 'Updated summary'
+        incident['action'] = {'error': {'variety': ['Loss'], 'vector': ['Carelessness']}}
+        with open(fnames[5], 'w') as f:
+            json.dump(incident, f)
+        updated_df = v.update_df(df, [fnames[5]])
+        pd.testing.assert_frame_equal(v.json_to_df(fnames, schema_path=schema_path), updated_df)
+        assert updated_df.shape == df.shape
+        row = updated_df[updated_df['incident_id'] == incident['incident_id']].iloc[0]
+        assert row['summary'] == 'Updated summary'
+        assert row['action.Error'] and not row['action.Hacking']
+        assert df.loc[row.name, 'summary'] != 'Updated summary'  # original DataFrame untouched
+
+        # a batch mixing replaced and appended incidents gives the appended rows consecutive labels, as a rebuild does
+        df = v.json_to_df(fnames[:20], schema_path=schema_path)
+        with open(fnames[2], 'r') as f:
+            incident = json.load(f)
+        incident['summary'] = 'Updated again'
+        with open(fnames[2], 'w') as f:
+            json.dump(incident, f)
+        mixed_df = v.update_df(df, fnames[20:24] + [fnames[2]] + fnames[24:])
+        pd.testing.assert_frame_equal(v.json_to_df(fnames, schema_path=schema_path), mixed_df)
+        assert list(mixed_df.index) == list(range(len(fnames)))
+
+    def test_json_to_df_compact(self):
+        v = VERIS(verbose=False)
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        compact_df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, compact=True)
+        assert list(compact_df.columns) == list(df.columns)
+        assert compact_df['timeline.incident.year'].dtype == 'Int16'
+        assert compact_df['timeline.incident.month'].dtype == 'Int8'
+        assert compact_df['impact.overall_amount'].dtype == np.float32
+        assert isinstance(compact_df['victim.industry2'].dtype, pd.CategoricalDtype)
+        assert compact_df['incident_id'].dtype == object  # one value per row: not worth a categorical
+        assert compact_df.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+
+        # same values, and the same summaries and matrices
+        for col in df.columns:
+            if df[col].dtype != compact_df[col].dtype:
+                assert df[col].astype(object).where(df[col].notna(), None).tolist() == \
+                       compact_df[col].astype(object).where(compact_df[col].notna(), None).tolist()
+        pd.testing.assert_frame_equal(v.enum_summary(df, 'action', by='timeline.incident.year'),
+                                      v.enum_summary(compact_df, 'action', by='timeline.incident.year'), check_dtype=False)
+        pd.testing.assert_frame_equal(v.enum_summary(df, 'asset.assets.amount'),
+                                      v.enum_summary(compact_df, 'asset.assets.amount'))
+        assert np.array_equal(v.df_to_matrix(df, bools_only=False), v.df_to_matrix(compact_df, bools_only=False))
+
+        updated_df = v.update_df(v.json_to_df(fnames[:60], schema_path=SCHEMA_PATH, compact=True), fnames[60:], compact=True)
+        pd.testing.assert_frame_equal(updated_df, compact_df, check_categorical=False)
+
+    def test_json_to_df_where(self, tmp_path):
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        v = VERIS(verbose=False, cache_dir=str(tmp_path / 'cache'))
+        full_df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, use_cache=False)
+
+        # the same as loading only the matching files
+        where = {'timeline.incident.year': ('>=', 2014), 'victim.industry': ('startswith', '6')}
+        matching = full_df[(full_df['timeline.incident.year'] >= 2014) &
+                           full_df['victim.industry'].astype(str).str.startswith('6')]
+        keep = [fname for fname, incident_id in zip(fnames, full_df['incident_id'])
+                if incident_id in set(matching['incident_id'])]
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, where=where)
+        assert 0 < df.shape[0] < full_df.shape[0]
+        load_raw = [record for record in v.stats.stages if record['stage'] == 'load_raw'][0]
+        assert load_raw['files'] == len(fnames) and load_raw['rows'] == df.shape[0]  # discarded before normalization
+        pd.testing.assert_frame_equal(df, v.json_to_df(keep, schema_path=SCHEMA_PATH, use_cache=False))
+        assert v.json_to_df(fnames, schema_path=SCHEMA_PATH, where=where).equals(df)
+        assert v.cache.hits == 1
+
+        # with several processes, and a function of the incident with threads
+        pd.testing.assert_frame_equal(df, v.json_to_df(fnames, schema_path=SCHEMA_PATH, where=where, workers=2,
+                                                       chunksize=7, use_processes=True, use_cache=False))
+        sqli = v.json_to_df(fnames, schema_path=SCHEMA_PATH, workers=2, chunksize=7,
+                            where=lambda incident: 'SQLi' in incident['action'].get('hacking', {}).get('variety', []))
+        assert list(sqli['incident_id']) == list(full_df.loc[full_df['action.hacking.variety.SQLi'], 'incident_id'])
+        assert len(v.cache.entries()) == 1  # results of a function are not cached
+
+        # conditions on fields inside arrays, and when the field is missing
+        assets = v.json_to_df(fnames, schema_path=SCHEMA_PATH, where={'asset.assets.variety': ['S - Web application',
+                                                                                               'S - Database']})
+        assert (assets['asset.assets.variety.S - Web application'] | assets['asset.assets.variety.S - Database']).all()
+        not_sqli = v.json_to_df(fnames, schema_path=SCHEMA_PATH, where={'action.hacking.variety': ('not in', ['SQLi'])})
+        assert not_sqli.shape[0] == (~full_df['action.hacking.variety.SQLi']).sum()
+        incident = {'victim': [{'industry': '611310'}], 'timeline': {'incident': {'year': '2015'}}}
+        assert IncidentFilter({'victim.industry': 611310})(incident) is False
+        assert IncidentFilter({'victim.industry': '611310', 'plus.analyst': ('exists', False)})(incident)
+        assert not IncidentFilter({'timeline.incident.year': ('>=', 2014)})(incident)  # a string is not a number
+        with pytest.raises(ValueError):
+            IncidentFilter({'timeline.incident.year': ('=>', 2014)})
+
+        # the cache key of a set of values depends neither on their order nor on string hashing
+        varieties = ['SQLi', 'Brute force', 'Backdoor or C2', 'Use of stolen creds']
+        key = IncidentFilter({'action.hacking.variety': set(varieties)}).key()
+        assert key == IncidentFilter({'action.hacking.variety': varieties[::-1]}).key()
+        assert key == IncidentFilter({'action.hacking.variety': ('in', varieties[1:] + varieties[:1])}).key()
+        assert IncidentFilter({'summary': ('in', 'ab')}).key() != IncidentFilter({'summary': ('in', 'ba')}).key()
+
+        # the streaming loader fills its chunks with matching incidents, also from JSONL files
+        jsonl = str(tmp_path / 'incidents.jsonl.gz')
+        with gzip.open(jsonl, 'wt') as f:
+            for fname in fnames:
+                with open(fname, 'r') as incident_file:
+                    f.write(json.dumps(json.load(incident_file)) + '\n')
+        chunks = list(v.iter_json_to_df([jsonl], chunk_size=2, schema_path=SCHEMA_PATH, where=where))
+        assert [chunk.shape[0] for chunk in chunks[:-1]] == [2] * (len(chunks) - 1)
+        assert list(pd.concat(chunks)['incident_id']) == list(df['incident_id'])
+
+    def test_json_to_df_projection(self, tmp_path):
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        v = VERIS(verbose=False)
+        full_df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        full_enum_columns = v.stats.stages[3]['columns']
+
+        # the selected columns are the same as in the full DataFrame, and only what they need is built
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, include=['action', 'actor.*', 'asset.assets'])
+        assert all(col == 'incident_id' or col.split('.')[0] in ('action', 'actor') or col.startswith('asset.assets.')
+                   for col in df.columns)
+        assert 'action.Hacking' in df.columns and 'actor.partner.industry2' in df.columns
+        pd.testing.assert_frame_equal(df, full_df[df.columns])
+        assert [record for record in v.stats.stages if record['stage'] == 'enumerations'][0]['columns'] < full_enum_columns
+
+        # derived columns bring in the columns they are computed from, which are then left out
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, include=['action.Hacking', 'victim.orgsize', 'pattern',
+                                                                    'victim.industry2'])
+        assert not any(col.startswith(('action.hacking.', 'victim.employee_count')) for col in df.columns)
+        assert 'victim.industry2.52' in df.columns and 'victim.industry' not in df.columns
+        pd.testing.assert_frame_equal(df, full_df[df.columns])
+        assert sorted(df.columns) == sorted(['incident_id', 'action.Hacking', 'victim.orgsize.Large', 'victim.orgsize.Small',
+                                             'pattern', 'victim.industry2'] +
+                                            [col for col in full_df.columns if col.startswith(('pattern.', 'victim.industry2.'))])
+
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, exclude=['plus', 'action.hacking'])
+        assert not any(col.startswith(('plus.', 'action.hacking.')) for col in df.columns)
+        pd.testing.assert_frame_equal(df, full_df[df.columns])
+        assert df.shape[1] == full_df.shape[1] - sum(col.startswith(('plus.', 'action.hacking.')) for col in full_df.columns)
+
+        # with the streaming loader, and when updating a DataFrame
+        include = ['action', 'victim.orgsize', 'timeline.incident.year']
+        chunks = list(v.iter_json_to_df(fnames, chunk_size=40, schema_path=SCHEMA_PATH, include=include))
+        columns = [col for col in v.plan.columns if col == 'incident_id' or col.startswith(('action.', 'victim.orgsize.'))
+                   or col == 'timeline.incident.year']
+        assert list(chunks[0].columns) == columns
+        pd.testing.assert_frame_equal(pd.concat(chunks), full_df[columns], check_dtype=False)
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH, include=include)
+        pd.testing.assert_frame_equal(v.update_df(v.json_to_df(fnames[:50], include=include), fnames[50:],
+                                                  include=include), df)
+
+        # requested columns that the projection does not build are filled in with their nominal dtype
+        for compact in [False, True]:
+            chunk = next(v.iter_json_to_df(fnames, chunk_size=40, schema_path=SCHEMA_PATH, include=['action'], compact=compact,
+                                           columns=['incident_id', 'action.Hacking', 'pattern', 'timeline.incident.year']))
+            assert isinstance(chunk['pattern'].dtype, pd.CategoricalDtype) and chunk['pattern'].isna().all()
+            assert chunk['timeline.incident.year'].isna().all()
+
+        with pytest.raises(TypeError):
+            v.json_to_df(fnames, schema_path=SCHEMA_PATH, include='action')
+
+    def test_iter_json_to_df(self, monkeypatch):
+
+        v = VERIS(json_dir=os.path.join(os.path.dirname(__file__), 'data'), verbose=False)
+        filenames = sorted(v.filenames)
+        full_df = v.json_to_df(filenames, schema_path=SCHEMA_PATH)
+
+        # a duplicated file in a later chunk is dropped, as in json_to_df
+        chunks = list(v.iter_json_to_df(filenames + filenames[:3], chunk_size=30, schema_path=SCHEMA_PATH))
+        assert [chunk.shape[0] for chunk in chunks] == [30, 30, 30, 10]
+        for chunk in chunks:
+            assert list(chunk.columns) == v.plan.columns
+            assert list(chunk.dtypes.astype(str)) == [v.plan.dtypes[col] for col in v.plan.columns]
+        pd.testing.assert_frame_equal(pd.concat(chunks), full_df[v.plan.columns], check_dtype=False)
+
+        # extra raw columns can be asked for
+        columns = v.plan.columns + ['plus.analyst']
+        chunk = next(v.iter_json_to_df(filenames, chunk_size=10, columns=columns, schema_path=SCHEMA_PATH))
+        assert list(chunk.columns) == columns
+        assert chunk['plus.analyst'].equals(full_df['plus.analyst'].iloc[:10])
+
+        # a single worker pool loads every chunk, and is shut down with the generator
+        pools = []
+
+        def make_executor(workers, use_processes, make=loaders._make_executor):
+            pools.append(make(workers, use_processes))
+            return pools[-1]
+
+        monkeypatch.setattr(loaders, '_make_executor', make_executor)
+        parallel = list(v.iter_json_to_df(filenames, chunk_size=10, schema_path=SCHEMA_PATH, workers=2, use_processes=True))
+        assert len(pools) == 1
+        pd.testing.assert_frame_equal(pd.concat(parallel), full_df[v.plan.columns], check_dtype=False)
+        stream = v.iter_json_to_df(filenames, chunk_size=10, schema_path=SCHEMA_PATH, workers=2)
+        next(stream)
+        stream.close()
+        assert len(pools) == 2
+        for pool in pools:
+            with pytest.raises(RuntimeError):
+                pool.submit(int)
+
+        with pytest.raises(ValueError):
+            next(v.iter_json_to_df(filenames, chunk_size=0))
+
+    def test_df_to_matrix(self):
+        v = VERIS(verbose=False)
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+
+        dense = v.df_to_matrix(df)
+        assert dense.shape == (100, len(v.matrix_columns))
+        assert list(v.matrix_incident_ids) == list(df['incident_id'])
+        assert all(df[col].dtype == bool for col in v.matrix_columns)
+        assert (dense == df[list(v.matrix_columns)].to_numpy(dtype=int)).all()
+
+        sparse = v.df_to_matrix(df, sparse=True)
+        assert sparse.format == 'csr' and sparse.dtype == np.int8
+        assert (sparse.toarray() == dense).all()
+
+        # numerical columns are scaled into [-1, 1], and the scaling is reused for other DataFrames
+        scaled = v.df_to_matrix(df, bools_only=False)
+        columns, scaling = v.matrix_columns, v.matrix_scaling
+        assert len(columns) > dense.shape[1] and len(scaling) > 0
+        assert np.abs(scaled).max() <= 1
+        amount_col = 'asset.assets.amount.S - Database'
+        pos = list(columns).index(amount_col)
+        assert np.allclose(scaled[:, pos], df[amount_col].fillna(0).to_numpy(dtype=float) / scaling[amount_col])
+        assert np.allclose(v.df_to_matrix(df.iloc[:10], columns=columns, scaling=scaling), scaled[:10])
+        assert np.allclose(v.df_to_matrix(df, bools_only=False, sparse=True).toarray(), scaled)
+
+    def test_similarity(self, tmp_path):
+        v = VERIS(verbose=False)
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        matrix = v.df_to_matrix(df)
+
+        # same distances as scipy, whatever the block size and number of workers
+        for metric in ['jaccard', 'hamming', 'cosine']:
+            expected = pdist(matrix.astype(bool) if metric != 'cosine' else matrix, metric)
+            got = v.pairwise_distances(df, metric, block_size=7, workers=2)
+            assert np.allclose(got, expected, atol=1e-6)
+        on_disk = v.pairwise_distances(df, path=str(tmp_path / 'dist.npy'), block_size=30)
+        assert np.allclose(np.load(str(tmp_path / 'dist.npy')), pdist(matrix.astype(bool), 'jaccard'))
+        assert on_disk.shape == (100 * 99 // 2,)
+
+        neighbors = v.nearest_neighbors(df, k=3, block_size=16)
+        assert neighbors.shape == (300, 4)
+        assert (neighbors['incident_id'] != neighbors['neighbor_id']).all()
+        square = squareform(pdist(matrix.astype(bool), 'jaccard'))
+        np.fill_diagonal(square, np.inf)
+        assert np.allclose(neighbors['distance'].to_numpy().reshape(100, 3), np.sort(square, axis=1)[:, :3])
+
+    def test_similarity_index(self, tmp_path):
+        v = VERIS(verbose=False)
+        fnames = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json')))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        matrix = v.df_to_matrix(df).astype(bool)
+        index = v.similarity_index(df)
+        assert len(index) == 100
+
+        # the similarities are exact Jaccard similarities, the incident itself is left out
+        incident_id = df['incident_id'].iloc[3]
+        similar = v.similar_incidents(index, incident_id, k=5)
+        assert 0 < len(similar) <= 5 and incident_id not in set(similar['incident_id'])
+        assert list(similar['similarity']) == sorted(similar['similarity'], reverse=True)
+        for row in similar.itertuples():
+            other = matrix[list(df['incident_id']).index(row.incident_id)]
+            assert row.similarity == pytest.approx((matrix[3] & other).sum() / (matrix[3] | other).sum())
+
+        # an incident's JSON finds the incident itself
+        with open(fnames[3]) as f:
+            incident = json.load(f)
+        by_json = v.similar_incidents(index, incident, k=5)
+        assert by_json['incident_id'].iloc[0] == incident_id and by_json['similarity'].iloc[0] == 1
+
+        # built incrementally, or saved and loaded, the index gives the same answers
+        partial = v.similarity_index(df.iloc[:60])
+        v.update_similarity_index(partial, df.iloc[50:])
+        assert partial.buckets == index.buckets  # replaced incidents leave no trace (nor empty buckets) behind
+        index.save(str(tmp_path / 'index.pkl'))
+        loaded = MinHashIndex.load(str(tmp_path / 'index.pkl'))
+        for other in [partial, loaded]:
+            assert len(other) == 100
+            pd.testing.assert_frame_equal(v.similar_incidents(other, incident_id, k=5), similar)
+
+    def test_synthetic_incidents(self, tmp_path):
+        # the same seed gives the same incidents
+        assert list(IncidentGenerator(seed=1).incidents(20)) == list(IncidentGenerator(seed=1).incidents(20))
+        assert IncidentGenerator(seed=1).incident() != IncidentGenerator(seed=2).incident()
+
+        with open(SCHEMA_PATH, 'r') as f:
+            schema = json.load(f)
+        fnames = write_incidents(str(tmp_path / 'synthetic.jsonl.gz'), 500, schema=schema, seed=3)
+        v = VERIS(verbose=False)
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        assert df.shape[0] == 500 and df['incident_id'].is_unique
+        assert set(v.plan.columns) <= set(df.columns)
+        for required in schema['required']:
+            assert df.columns.str.startswith(required).any()
+        assert df['timeline.incident.year'].between(2010, 2022).all()
+        assert df['victim.industry2'].isin(v.plan.industry_codes).all()
+        summary = v.enum_summary(df, 'action')
+        assert (summary['x'] > 0).sum() >= 5  # every action category shows up
+
+        # one JSON file per incident
+        fnames = write_incidents(str(tmp_path / 'incidents'), 20, schema=schema, seed=3)
+        assert len(fnames) == 20 and all(fname.endswith('.json') for fname in fnames)
+        assert v.json_to_df(fnames, schema_path=SCHEMA_PATH).shape[0] == 20
+
+    def test_bit_packed_frame(self):
+        v = VERIS(verbose=False)
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        packed = v.json_to_df(fnames, schema_path=SCHEMA_PATH, packed=True)
+        assert isinstance(packed, BitPackedFrame)
+        assert packed.shape == df.shape
+        assert packed.words.nbytes * 4 < df.select_dtypes(bool).memory_usage(index=False).sum()
+        pd.testing.assert_frame_equal(packed.to_df(), df)
+        pd.testing.assert_series_equal(packed['action.Hacking'], df['action.Hacking'])
+        pd.testing.assert_series_equal(packed['victim.industry2'], df['victim.industry2'])
+
+        for enum, by in [('action', None), ('action', 'actor'), ('action.hacking.variety', 'timeline.incident.year'),
+                         ('timeline.incident.year', 'action')]:
+            pd.testing.assert_frame_equal(v.enum_summary(packed, enum, by=by, ci_method='wilson'),
+                                          v.enum_summary(df, enum, by=by, ci_method='wilson'))
+            pd.testing.assert_frame_equal(v.enum_summary(packed, enum, by=by, use_unk=True),
+                                          v.enum_summary(df, enum, by=by, use_unk=True))
+        assert (v.df_to_matrix(packed) == v.df_to_matrix(df)).all()
+
+    def test_column_index(self):
+        v = VERIS(verbose=False)
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        df = v.json_to_df(fnames[:10], schema_path=SCHEMA_PATH)
+
+        index = column_index(df)
+        assert column_index(df) is index  # cached per DataFrame
+        assert column_index(df).dtypes is index.dtypes  # dtype tags are not re-read while the frame is unchanged
+        social = index.bool_children('action.social.variety')
+        assert social == [col for col in df.columns if col.startswith('action.social.variety.')
+                          and len(col.split('.')) == 4 and df[col].dtype == bool]
+        assert 'action.Hacking' in index.bool_children('action')
+        assert 'action.hacking.variety.SQLi' not in index.bool_children('action')
+        assert 'action.hacking.variety.SQLi' in index.descendants('action')
+        assert index.startswith('victim.industry') == [col for col in df.columns if col.startswith('victim.industry')]
+        assert index.bool_children('mmm_donuts') == []
+
+        # dtype tags follow in-place changes to the DataFrame
+        df['action.Hacking'] = df['action.Hacking'].astype(int)
+        assert 'action.Hacking' not in column_index(df).bool_children('action')
+
+        # new columns get a new index
+        df['action.Donuts'] = True
+        assert 'action.Donuts' in column_index(df).bool_children('action')
+
+    def test_query(self):
+        v = VERIS(verbose=False)
+        fnames = glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*json'))
+        df = v.json_to_df(fnames, schema_path=SCHEMA_PATH)
+        packed = BitPackedFrame.from_df(df)
+
+        def any_of(prefix, unknown=None):
+            cols = [col for col in df.columns if col.startswith(prefix + '.') and df[col].dtype == bool
+                    and (unknown is None or (col.split('.')[-1].lower() == 'unknown') == unknown)]
+            return df[cols].any(axis=1).to_numpy()
+
+        hacking = df['action.Hacking'].to_numpy()
+        finance = df['victim.industry2.52'].to_numpy()
+        internal = df['actor.Internal'].to_numpy()
+        variety = 'action.hacking.variety'
+        expected = {
+            'action.Hacking & victim.industry2.52 & !actor.Internal': hacking & finance & ~internal,
+            'action.Hacking | victim.industry2.52 & ~actor.Internal': hacking | (finance & ~internal),
+            '(action.Hacking | victim.industry2.52) & !(actor.Internal)': (hacking | finance) & ~internal,
+            '!!action.Hacking': hacking,
+            'actor.internal': any_of('actor.internal'),
+            'known(action.hacking.variety)': any_of(variety, unknown=False),
+            'unknown(action.hacking.variety)': any_of(variety, unknown=True) & ~any_of(variety, unknown=False),
+            '"asset.cloud.On-Premise Asset(s)" | `asset.cloud.External Cloud Asset(s)`':
+                df['asset.cloud.On-Premise Asset(s)'].to_numpy() | df['asset.cloud.External Cloud Asset(s)'].to_numpy(),
+            'asset.assets.variety.S - Web application': df['asset.assets.variety.S - Web application'].to_numpy(),
+        }
+        for expression, mask in expected.items():
+            got = v.query(df, expression)
+            assert got.dtype == bool and (got == mask).all(), expression
+            assert (v.query(packed, expression) == mask).all(), expression
+            assert v.query(df, expression, count=True) == v.query(packed, expression, count=True) == mask.sum()
+        assert 0 < v.query(df, 'action.Hacking', count=True) < df.shape[0]
+        assert v.query(df, '!action.Hacking', count=True) == df.shape[0] - hacking.sum()
+
+        for expression in ['', 'action.Hacking &', '(action.Hacking', 'action.Hacking)', 'known(action', '"action',
+                           'mmm_donuts', 'victim.industry']:
+            with pytest.raises(ValueError):
+                v.query(df, expression)
@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+
+COLUMN_CHUNK = 256  # columns packed at a time, to bound the temporary memory used by `from_df`
+
+
+def pack_bools(block):
+    """ Pack a 2-d boolean array column by column.
+
+    Parameters
+    ----------
+    block: np ndarray
+        Boolean array of shape (rows, columns)
+
+    Returns
+    -------
+    np ndarray
+        uint64 array of shape (columns, ceil(rows / 64)). Bit i of column j is row i, least significant bit first.
+    """
+    nrows, ncols = block.shape
+    nwords = (nrows + 63) // 64
+    packed = np.packbits(np.ascontiguousarray(block.T), axis=1, bitorder='little')
+    padded = np.zeros((ncols, nwords * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view(np.uint64)
+
+
+def unpack_bools(words, nrows):
+    """ Inverse of `pack_bools`: (columns, words) uint64 array to a (rows, columns) boolean array. """
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=1, count=nrows, bitorder='little')
+    return bits.T.astype(bool)
+
+
+if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+    def popcount(words):
+        """ Number of set bits in each uint64 of `words`. """
+        return np.bitwise_count(words)
+
+    def row_popcount(words):
+        """ Number of set bits in each row of the 2-d uint64 array `words`. """
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    _POPCOUNT_TABLE16 = np.array([bin(i).count('1') for i in range(1 << 16)], dtype=np.uint8)
+
+    def popcount(words):
+        """ Number of set bits in each uint64 of `words`. """
+        return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+    def row_popcount(words):
+        """ Number of set bits in each row of the 2-d uint64 array `words`. """
+        return _POPCOUNT_TABLE16[np.ascontiguousarray(words).view(np.uint16)].sum(axis=1, dtype=np.int64)
+
+
+class BitPackedFrame(object):
+    """
+    A VERIS DataFrame with its boolean columns packed into bits.
+
+    The boolean columns (the enumerations, A4 names, industry columns, ...) are stored 64 incidents to a `uint64` word,
+    one row of words per column, which takes an eighth of the memory of numpy booleans. The other columns stay in a
+    regular DataFrame. `VERIS.enum_summary` and `VERIS.df_to_matrix` accept a `BitPackedFrame` in place of a DataFrame
+    and only unpack the columns they use. Use `to_df` to get the full DataFrame back.
+
+    Parameters
+    ------------
+    words: np ndarray
+        uint64 array of shape (len(bool_columns), ceil(rows / 64)), see `pack_bools`
+    bool_columns: list
+        Names of the packed columns
+    other: pd DataFrame
+        The remaining (non-boolean) columns. Its index is the index of the frame.
+    columns: list
+        All column names, in order
+    """
+
+    def __init__(self, words, bool_columns, other, columns):
+        self.words = words
+        self.bool_columns = list(bool_columns)
+        self.other = other
+        self.columns = pd.Index(columns)
+        self._positions = {col: i for i, col in enumerate(self.bool_columns)}
+
+    @classmethod
+    def from_df(cls, df):
+        """ Pack the boolean columns of `df`. """
+        is_bool = (df.dtypes == bool).values
+        bool_columns = list(df.columns[is_bool])
+        words = np.zeros((len(bool_columns), (df.shape[0] + 63) // 64), dtype=np.uint64)
+        for start in range(0, len(bool_columns), COLUMN_CHUNK):
+            chunk = bool_columns[start:start + COLUMN_CHUNK]
+            words[start:start + len(chunk)] = pack_bools(df[chunk].to_numpy(dtype=bool))
+        return cls(words, bool_columns, df.loc[:, ~is_bool], df.columns)
+
+    def to_df(self):
+        """ Unpack into a regular DataFrame, identical to the one the frame was built from. """
+        packed = pd.DataFrame(unpack_bools(self.words, self.shape[0]), index=self.index, columns=self.bool_columns)
+        return pd.concat([self.other, packed], axis=1)[self.columns]
+
+    @property
+    def index(self):
+        return self.other.index
+
+    @property
+    def shape(self):
+        return (self.other.shape[0], len(self.columns))
+
+    @property
+    def dtypes(self):
+        """ Series of column dtypes, as `pd.DataFrame.dtypes` """
+        dtypes = pd.concat([self.other.dtypes, pd.Series(np.dtype(bool), index=self.bool_columns, dtype=object)])
+        return dtypes[self.columns]
+
+    def memory_usage(self):
+        """ Bytes used by the packed words and the other columns. """
+        return self.words.nbytes + int(self.other.memory_usage(deep=False).sum())
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __contains__(self, col):
+        return col in self._positions or col in self.other.columns
+
+    def __getitem__(self, col):
+        """ A single column as a pd Series. """
+        if col in self._positions:
+            words = self.words[self._positions[col]:self._positions[col] + 1]
+            return pd.Series(unpack_bools(words, self.shape[0])[:, 0], index=self.index, name=col)
+        return self.other[col]
+
+    def bool_block(self, cols):
+        """ (rows, len(cols)) boolean array of the packed columns `cols`. """
+        positions = [self._positions[col] for col in cols]
+        return unpack_bools(self.words[positions], self.shape[0])
+
+    def count(self, cols, mask=None):
+        """ Number of True values in each packed column of `cols`, optionally only counting rows where `mask` is True.
+
+        Counts are computed on the packed words without unpacking the columns.
+
+        Parameters
+        ----------
+        cols: list
+            Packed column names
+        mask: np ndarray, optional (default: None)
+            Boolean row mask
+
+        Returns
+        -------
+        np ndarray
+            int64 counts, one per column
+        """
+        words = self.words[[self._positions[col] for col in cols]]
+        if mask is not None:
+            words = words & pack_bools(np.asarray(mask, dtype=bool)[:, None])
+        return popcount(words).sum(axis=1, dtype=np.int64)
+
+    def any_words(self, cols):
+        """ Packed words of the rows with at least one True value among the packed columns `cols`. """
+        return np.bitwise_or.reduce(self.words[[self._positions[col] for col in cols]], axis=0)
+
+    def any_count(self, cols, mask=None):
+        """ Number of rows (where `mask` is True, if given) with at least one True value among the packed columns `cols`. """
+        words = self.any_words(cols)
+        if mask is not None:
+            words = words & pack_bools(np.asarray(mask, dtype=bool)[:, None])[0]
+        return int(popcount(words).sum(dtype=np.int64))
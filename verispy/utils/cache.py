@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import warnings
+
+from .schema import default_cache_dir
+
+
+CACHE_SUFFIX = '.pkl'
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3  # 2 GB
+
+
+def schema_hash(schema):
+    """ Content hash of a VERIS schema (dict), independent of key order. """
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def file_hash(filename, blocksize=1024 * 1024):
+    """ sha256 of a file's contents. """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class DataFrameCache(object):
+    """
+    On-disk cache of DataFrames built by `VERIS.json_to_df`.
+
+    Each entry is a single pickle file (protocol 5, so the numpy column blocks are written as contiguous buffers)
+    named after its key. Entries are written atomically, so an interrupted write never leaves a partial entry behind,
+    and unreadable entries are discarded. When the total size of the cache goes above `max_size`, the least recently
+    used entries are evicted.
+
+    Parameters
+    ------------
+    cache_dir: str, optional (default: None)
+        Directory where the cached DataFrames are stored. Created if it does not exist. Defaults to the `dataframes`
+        directory of the verispy cache directory (see `verispy.utils.schema.default_cache_dir`), as it is when the
+        cache is created.
+    max_size: int (default: 2 GB)
+        Maximum total size of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = os.path.join(default_cache_dir(), 'dataframes')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, filenames, schema, version, hash_contents=False, **options):
+        """ Build the cache key for a `json_to_df` call.
+
+        Parameters
+        ----------
+        filenames: list
+            The input files, in order (the order of the rows depends on it).
+        schema: dict
+            The VERIS schema
+        version: str
+            The verispy version
+        hash_contents: bool (default: False)
+            Hash the contents of every file. If False, the file size and modification time are used instead, which
+            is much faster but will not notice a file rewritten with the same size within the same timestamp.
+        **options:
+            Any other parameters that change the resulting DataFrame
+
+        Returns
+        -------
+        str
+            Hex digest identifying the DataFrame
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps({'version': version, 'schema': schema_hash(schema), 'options': options},
+                            sort_keys=True, default=str).encode('utf-8'))
+        for filename in filenames:
+            if hash_contents:
+                fileid = file_hash(filename)
+            else:
+                stat = os.stat(filename)
+                fileid = '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+            h.update('{}\0{}\0'.format(os.path.abspath(filename), fileid).encode('utf-8'))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """ Return the DataFrame stored under `key`, or None if there is no (readable) entry. """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                df = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:  # corrupted or written by an incompatible pandas version
+            warnings.warn('Discarding unreadable cache entry {}: {}'.format(path, e))
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        os.utime(path)  # mark as recently used
+        self.hits += 1
+        return df
+
+    def store(self, key, df):
+        """ Store `df` under `key`, then evict old entries if the cache is over its size limit. """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(df, f, protocol=5)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self.evict(keep=key)
+
+    def entries(self):
+        """ List of (path, size, last use) for every entry, least recently used first. """
+        out = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # removed by another process
+                continue
+            out.append((path, stat.st_size, stat.st_mtime))
+        return sorted(out, key=lambda entry: entry[2])
+
+    def size(self):
+        """ Total size of the cache entries in bytes. """
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self, keep=None):
+        """ Remove least recently used entries until the cache fits in `max_size`. The entry `keep` is never removed. """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        keep_path = self._path(keep) if keep else None
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            if path == keep_path:
+                continue
+            self._remove(path)
+            total -= size
+
+    def invalidate(self, key):
+        """ Remove the entry stored under `key`, if any. """
+        self._remove(self._path(key))
+
+    def clear(self):
+        """ Remove every entry from the cache. """
+        for path, _, _ in self.entries():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
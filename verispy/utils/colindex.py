@@ -0,0 +1,137 @@
+import bisect
+import weakref
+
+import numpy as np
+
+
+class ColumnIndex(object):
+    """
+    Prefix index over the dot-separated column names of a VERIS DataFrame.
+
+    Column names such as `action.hacking.variety.SQLi` form a tree. The index records, for every inner node of the tree
+    (`action`, `action.hacking`, `action.hacking.variety`, ...), its direct children and all of its descendants, and tags
+    every column with its dtype, so questions like "the boolean columns directly below `action.hacking.variety`" are a
+    dictionary lookup instead of a scan over the column names. Use `column_index` to get the (cached) index of a DataFrame.
+
+    Parameters
+    ------------
+    columns: list
+        Column names
+    dtypes: list
+        dtype of each column
+    """
+
+    def __init__(self, columns, dtypes):
+        self.columns = list(columns)
+        self.position = {col: i for i, col in enumerate(self.columns)}
+        self._children = {}
+        self._descendants = {}
+        for pos, col in enumerate(self.columns):
+            parts = col.split('.')
+            for depth in range(1, len(parts)):
+                prefix = '.'.join(parts[:depth])
+                self._descendants.setdefault(prefix, []).append(pos)
+                if depth == len(parts) - 1:
+                    self._children.setdefault(prefix, []).append(pos)
+        self._sorted = sorted(self.columns)
+        self.set_dtypes(dtypes)
+
+    def set_dtypes(self, dtypes):
+        """ (Re)tag the columns with their dtypes. """
+        self.dtypes = dtypes if isinstance(dtypes, list) else list(dtypes)
+        self.is_bool = np.array([dtype == bool for dtype in self.dtypes], dtype=bool)
+        self._bool_children = {}
+
+    def dtype(self, col):
+        """ dtype of column `col` """
+        return self.dtypes[self.position[col]]
+
+    def is_bool_column(self, col):
+        """ Is `col` a column of the DataFrame with a boolean dtype? """
+        pos = self.position.get(col)
+        return pos is not None and bool(self.is_bool[pos])
+
+    def children(self, prefix):
+        """ Columns exactly one level below `prefix` (e.g. `action.Hacking` for `action`), in column order. """
+        return [self.columns[pos] for pos in self._children.get(prefix, [])]
+
+    def bool_children(self, prefix):
+        """ Boolean columns exactly one level below `prefix`, in column order. """
+        children = self._bool_children.get(prefix)
+        if children is None:
+            children = [self.columns[pos] for pos in self._children.get(prefix, []) if self.is_bool[pos]]
+            self._bool_children[prefix] = children
+        return list(children)
+
+    def descendants(self, prefix):
+        """ Columns at any level below `prefix`, in column order. """
+        return [self.columns[pos] for pos in self._descendants.get(prefix, [])]
+
+    def startswith(self, prefix):
+        """ Columns whose names start with the string `prefix` (not necessarily at a dot), in column order. """
+        start = bisect.bisect_left(self._sorted, prefix)
+        matches = []
+        for col in self._sorted[start:]:
+            if not col.startswith(prefix):
+                break
+            matches.append(col)
+        return sorted(matches, key=self.position.__getitem__)
+
+
+_INDEXES = {}  # id(columns) -> (weak reference to columns, ColumnIndex)
+_DTYPES = weakref.WeakKeyDictionary()  # frame's block manager (or BitPackedFrame) -> (its blocks, list of dtypes)
+
+
+def _frame_dtypes(df):
+    """ The dtypes of `df` as a list, cached for as long as the frame's blocks are unchanged.
+
+    pandas replaces the tuple of blocks of a DataFrame's block manager whenever a column is set, added or removed, so
+    checking that it is the same object tells whether the cached dtypes are still valid, whatever the number of
+    columns. The cache is keyed on the block manager itself (or on the `BitPackedFrame`, whose packed columns cannot
+    change), so it does not keep any data alive once the frame is gone.
+    """
+    mgr = getattr(df, '_mgr', None)
+    if mgr is not None:
+        owner, blocks = mgr, mgr.blocks
+    else:  # BitPackedFrame: only its unpacked columns (a DataFrame) can change
+        owner, blocks = df, df.other._mgr.blocks
+    entry = _DTYPES.get(owner)
+    if entry is None or entry[0] is not blocks:
+        entry = (blocks, list(df.dtypes.values))
+        _DTYPES[owner] = entry
+    return entry[1]
+
+
+def column_index(df):
+    """ The `ColumnIndex` of a DataFrame (or `BitPackedFrame`).
+
+    Indexes are cached for as long as the DataFrame's `columns` object is alive (pandas replaces it whenever columns are
+    added or set), and their dtype tags are refreshed if the dtypes have changed since. Both checks take constant time,
+    so only the first lookup (or the first one after a change) depends on the number of columns.
+
+    Parameters
+    ----------
+    df: pd DataFrame
+
+    Returns
+    -------
+    ColumnIndex
+    """
+    columns = df.columns
+    dtypes = _frame_dtypes(df)
+    key = id(columns)
+    entry = _INDEXES.get(key)
+    if entry is not None and entry[0]() is columns:
+        index = entry[1]
+        if index.dtypes is not dtypes:
+            index.set_dtypes(dtypes)
+        return index
+
+    index = ColumnIndex(columns, dtypes)
+
+    def forget(ref, key=key):
+        if key in _INDEXES and _INDEXES[key][0] is ref:
+            del _INDEXES[key]
+
+    _INDEXES[key] = (weakref.ref(columns, forget), index)
+    return index
@@ -8,11 +8,23 @@ A4NAMES = {'actor': ['External', 'Internal', 'Partner', 'Unknown'],
            'attribute': ['Confidentiality', 'Integrity', 'Availability'],
            'asset': {'variety': list(ASSETMAP.values()), 
                      'assets.variety': list(ASSETMAP.keys())}}
+CONFIDENTIALITY_EXCLUDE = ['attribute.confidentiality.data_disclosure.No', 'attribute.confidentiality.data_disclosure.Unknown']
 SMALL_ORG_SUFFIXES = ['1 to 10', '11 to 100', '101 to 1000', 'Small']
 LARGE_ORG_SUFFIXES = ['1001 to 10000', '10001 to 25000', '25001 to 50000', '50001 to 100000', 'Over 100000', 'Large']
 SMALL_ORG = ['.'.join(('victim.employee_count', suffix)) for suffix in SMALL_ORG_SUFFIXES]
 LARGE_ORG = ['.'.join(('victim.employee_count', suffix)) for suffix in LARGE_ORG_SUFFIXES]
 ORG_SMALL_LARGE = {'victim.orgsize.Small' : SMALL_ORG, 'victim.orgsize.Large' : LARGE_ORG}
+# DBIR incident classification patterns (2014 DBIR), in order of precedence for the single `pattern` column
+PATTERNS = ['Point of Sale', 'Web Applications', 'Privilege Misuse', 'Lost and Stolen Assets', 'Miscellaneous Errors',
+            'Crimeware', 'Payment Card Skimmers', 'Denial of Service', 'Cyber-Espionage', 'Everything Else']
+# columns the patterns are computed from
+PATTERN_ENUMS = ['action.physical.variety.Skimmer', 'action.physical.variety.Tampering',
+                 'attribute.confidentiality.data.variety.Payment', 'actor.external.motive.Espionage',
+                 'actor.external.variety.State-affiliated', 'asset.assets.variety.S - POS controller',
+                 'asset.assets.variety.U - POS terminal', 'action.hacking.variety.DoS',
+                 'action.hacking.vector.Web application', 'action.Misuse', 'action.Malware',
+                 'action.malware.vector.Direct install', 'action.error.variety.Loss', 'action.physical.variety.Theft',
+                 'action.Error']
 
 # MATRIX CONSTANTS
 MATRIX_ENUMS = ['actor', 'action', 'victim.employee_count', 'security_incident', 'asset.assets', 
@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+
+
 INDUSTRY_LONG = [
   { "code": "00",   
     "title": "Non Categorized", 
@@ -158,4 +162,78 @@ for ind in INDUSTRY_LONG:
         INDUSTRY_BY_TITLE[ind['title']] = {'code': [ind['code']], 'short': [ind['short']], 'shorter': ind['shorter']}
     else:
         INDUSTRY_BY_TITLE[ind['title']]['code'].append(ind['code'])
-        INDUSTRY_BY_TITLE[ind['title']]['short'].append(ind['short'])
\ No newline at end of file
+        INDUSTRY_BY_TITLE[ind['title']]['short'].append(ind['short'])
+
+
+MAX_INDUSTRY_DEPTH = 6  # NAICS codes have up to 6 digits
+
+
+class IndustryIndex(object):
+    """
+    Vectorized lookups in the NAICS industry hierarchy.
+
+    Industry codes (`victim.industry`, `actor.partner.industry`) repeat a lot across incidents, so every lookup
+    factorizes the codes first and then works on the distinct codes only: the prefixes at each level of the hierarchy
+    (the first 2, 3, ... 6 digits), the names of the 2-digit sectors in `INDUSTRY_LONG` and their one-hot encoding.
+
+    Parameters
+    ------------
+    industries: list, optional (default: None)
+        Sectors, as in `INDUSTRY_LONG` (the default)
+    """
+
+    def __init__(self, industries=None):
+        industries = INDUSTRY_LONG if industries is None else industries
+        self.codes = list(dict.fromkeys(ind['code'] for ind in industries))
+        by_code = {ind['code']: ind for ind in industries}
+        # sector fields, with 'Unknown' at the end for codes that are not sectors
+        self._fields = {field: np.array([by_code[code][field] for code in self.codes] + ['Unknown'], dtype=object)
+                        for field in ('title', 'short', 'shorter')}
+
+    @staticmethod
+    def factorize(values):
+        """ (codes, uniques): integer code of each value, and the distinct values as strings followed by None.
+
+        Missing values get the code -1, which picks the trailing None of `uniques`.
+        """
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        return codes, np.array([str(value) for value in uniques] + [None], dtype=object)
+
+    def levels(self, values, levels=(2, 3)):
+        """ First `level` digits of each industry code (None for missing codes), for each level of `levels`.
+
+        Returns
+        -------
+        dict
+            level -> object array
+        """
+        codes, uniques = self.factorize(values)
+        return {level: np.array([value[:level] if value is not None else None for value in uniques], dtype=object)[codes]
+                for level in levels}
+
+    def categorical(self, values, level):
+        """ First `level` digits of each industry code, as a pd Categorical (NaN for missing codes). """
+        return pd.Categorical(self.levels(values, [level])[level])
+
+    def sector_positions(self, sectors, codes=None):
+        """ Position of each 2-digit code of `sectors` in `codes` (default: `self.codes`), or -1. """
+        codes = self.codes if codes is None else codes
+        value_codes, uniques = self.factorize(sectors)
+        position = {code: i for i, code in enumerate(codes)}
+        return np.array([position.get(value, -1) for value in uniques], dtype=np.int64)[value_codes]
+
+    def names(self, sectors, field='shorter'):
+        """ `field` ('title', 'short' or 'shorter') of the sector of each 2-digit code, 'Unknown' if not a sector. """
+        return self._fields[field][self.sector_positions(sectors)]
+
+    def one_hot(self, sectors, codes=None):
+        """ (len(sectors), len(codes)) boolean array: is each 2-digit code of `sectors` each code of `codes`? """
+        codes = self.codes if codes is None else codes
+        positions = self.sector_positions(sectors, codes)
+        one_hot = np.zeros((len(positions), len(codes)), dtype=bool)
+        known = positions >= 0
+        one_hot[np.flatnonzero(known), positions[known]] = True
+        return one_hot
+
+
+INDUSTRY_INDEX = IndustryIndex()
@@ -0,0 +1,333 @@
+import glob
+import gzip
+import itertools
+import json
+import os
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:  # optional, faster JSON parser
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DEFAULT_CHUNKSIZE = 256
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+JSONL_SUFFIXES = ('.jsonl', '.jsonl.gz')
+BUNDLE_SUFFIXES = ZIP_SUFFIXES + TAR_SUFFIXES + JSONL_SUFFIXES
+
+
+def parse_json(content, fast_json=False):
+    """ Parse a JSON document given as bytes or str, with `orjson` if `fast_json` and it is installed (see `load_json_file`). """
+    if fast_json and orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
+
+
+def load_json_file(filename, fast_json=False):
+    """ Load a single VERIS-formatted JSON file.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the JSON file
+    fast_json: bool (default: False)
+        Parse with `orjson` when it is installed. Falls back to the standard library parser if `orjson` is not
+        available or cannot parse the document (for example, integers larger than 64 bits).
+
+    Returns
+    -------
+    dict
+        The parsed incident
+    """
+    if fast_json and orjson is not None:
+        with open(filename, 'rb') as f:
+            return parse_json(f.read(), fast_json)
+
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def source_kind(filename):
+    """ Kind of a source file, from its name: 'zip', 'tar', 'jsonl' or 'json' (anything else is read as a JSON file). """
+    lower = filename.lower()
+    for kind, suffixes in (('zip', ZIP_SUFFIXES), ('tar', TAR_SUFFIXES), ('jsonl', JSONL_SUFFIXES)):
+        if lower.endswith(suffixes):
+            return kind
+    return 'json'
+
+
+def find_sources(json_dir):
+    """ The JSON files, zip and tar archives and JSONL files in directory `json_dir` (or `[json_dir]` if it is a file). """
+    if os.path.isfile(json_dir):
+        return [json_dir]
+    filenames = glob.glob(os.path.join(json_dir, '*.json'))
+    for suffix in BUNDLE_SUFFIXES:
+        filenames.extend(glob.glob(os.path.join(json_dir, '*' + suffix)))
+    return filenames
+
+
+def expand_sources(filenames):
+    """ Split source files into entries that can be loaded independently of each other.
+
+    JSON files are entries on their own, and so is each `.json` member of a zip archive, as `(archive, member name)`.
+    Tar archives and JSONL files can only be read from start to end, so each one is a single `(filename, None)` entry.
+
+    Parameters
+    ----------
+    filenames: list
+        JSON files, zip or tar archives of JSON files, or JSONL files (one incident per line), optionally gzipped.
+        Entries that were already expanded are kept as they are.
+
+    Returns
+    -------
+    list
+        Entries, in the order of `filenames` (and of the members within each zip archive)
+    """
+    entries = []
+    for filename in filenames:
+        if not isinstance(filename, str):
+            entries.append(filename)
+            continue
+        kind = source_kind(filename)
+        if kind == 'json':
+            entries.append(filename)
+        elif kind == 'zip':
+            with zipfile.ZipFile(filename) as archive:
+                entries.extend((filename, info.filename) for info in archive.infolist()
+                               if not info.is_dir() and info.filename.lower().endswith('.json'))
+        else:
+            entries.append((filename, None))
+    return entries
+
+
+def is_stream_entry(entry):
+    """ Is `entry` (from `expand_sources`) a tar archive or JSONL file, read as a whole? """
+    return not isinstance(entry, str) and entry[1] is None
+
+
+def field_tree(fields):
+    """ Nested dict of the dot-separated field names `fields`, for `select_fields`. Each key maps to the tree of the
+    fields to keep under it, or to None to keep all of it. """
+    tree = {}
+    for field in fields:
+        node = tree
+        keys = field.split('.')
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+            if node is None:  # a shorter field keeps all of it already
+                break
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def select_fields(incident, tree):
+    """ The fields of a parsed incident that are in `tree` (from `field_tree`). Arrays are kept whole, as they are
+    single columns of the raw DataFrame. """
+    selected = {}
+    for key, subtree in tree.items():
+        if key in incident:
+            value = incident[key]
+            selected[key] = select_fields(value, subtree) if subtree is not None and isinstance(value, dict) else value
+    return selected
+
+
+def _iter_stream_jsons(filename, fast_json):
+    if source_kind(filename) == 'tar':
+        with tarfile.open(filename, 'r:*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith('.json'):
+                    yield parse_json(archive.extractfile(member).read(), fast_json)
+    else:
+        opener = gzip.open if filename.lower().endswith('.gz') else open
+        with opener(filename, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield parse_json(line, fast_json)
+
+
+def iter_stream_entry(entry, fast_json=False, where=None, fields=None):
+    """ Parse the incidents of a tar archive or JSONL entry one at a time, without extracting or holding them all.
+    Only the incidents for which `where` (a function of the parsed incident, if given) is true are yielded, with only
+    the `fields` (a `field_tree`, if given). """
+    jsons = _iter_stream_jsons(entry[0], fast_json)
+    if where is not None:
+        jsons = (incident for incident in jsons if where(incident))
+    if fields is not None:
+        jsons = (select_fields(incident, fields) for incident in jsons)
+    return jsons
+
+
+def _load_json_chunk(entries, fast_json=False, where=None, fields=None):
+    # module-level so that it can be pickled and sent to worker processes. Incidents are filtered here, as soon as
+    # they are parsed, so that discarded incidents are neither kept nor sent back to the parent process.
+    jsons = []
+    archives = {}  # each zip archive is opened once per chunk
+    try:
+        for entry in entries:
+            if is_stream_entry(entry):
+                jsons.extend(iter_stream_entry(entry, fast_json, where, fields))
+                continue
+            if isinstance(entry, str):
+                incident = load_json_file(entry, fast_json)
+            else:
+                filename, member = entry
+                if filename not in archives:
+                    archives[filename] = zipfile.ZipFile(filename)
+                incident = parse_json(archives[filename].read(member), fast_json)
+            if where is None or where(incident):
+                jsons.append(incident if fields is None else select_fields(incident, fields))
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return jsons
+
+
+def chunk_list(items, chunksize):
+    """ Split a list into consecutive chunks of at most `chunksize` items. """
+    return [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+
+
+def _make_executor(workers, use_processes):
+    """ Thread (or process) pool of `workers` workers for `load_json_files`. """
+    pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    return pool_cls(max_workers=workers)
+
+
+def load_json_files(filenames, workers=1, chunksize=None, use_processes=False, fast_json=False, verbose=False, where=None,
+                    fields=None, executor=None):
+    """ Load a list of VERIS-formatted JSON files, optionally in parallel.
+
+    Files are split into chunks of `chunksize` files and each chunk is handed to a thread (or process) pool.
+    The returned list always has the same order as `filenames`, regardless of the number of workers.
+    Zip and tar archives and JSONL files are read member by member without extracting them (see `expand_sources`);
+    the members of a zip archive are loaded in chunks like files, while a tar archive or JSONL file is loaded by a
+    single worker.
+
+    Parameters
+    ----------
+    filenames: list
+        Filenames of VERIS-schema files, or of archives or JSONL files of them, to open
+    workers: int (default: 1)
+        Number of workers to use. A value of 1 (or None) loads the files serially in the current thread.
+    chunksize: int, optional (default: None)
+        Number of files handed to a worker at once. Defaults to `DEFAULT_CHUNKSIZE`.
+    use_processes: bool (default: False)
+        Use a process pool rather than a thread pool. Processes avoid the GIL during parsing, but the parsed
+        objects must be pickled back to the parent process.
+    fast_json: bool (default: False)
+        Parse with `orjson` if it is installed.
+    verbose: bool (default: False)
+        Display a progress bar (one step per chunk)
+    where: callable, optional (default: None)
+        Function of a parsed incident (see `verispy.utils.where.compile_where`): only the incidents for which it is
+        true are kept. It runs in the workers, so with `use_processes` it must be picklable (an `IncidentFilter`
+        without function conditions, or a module-level function).
+    fields: list, optional (default: None)
+        Dot-separated names of the fields to keep (with everything under them) in each incident, to save memory and
+        normalization time when only some of the fields are used. By default, all fields are kept.
+    executor: concurrent.futures.Executor, optional (default: None)
+        Pool to load the chunks with, in place of one created (and shut down) for this call when `workers` > 1. It is
+        left running, so that several calls can share it (see `iter_json_chunks`).
+
+    Returns
+    -------
+    list
+        Parsed JSON objects (those passing `where`), in the same order as `filenames`
+    """
+    if workers is None:
+        workers = 1
+    if workers < 1:
+        raise ValueError('Parameter `workers` must be a positive integer, got {}.'.format(workers))
+    if chunksize is None:
+        chunksize = DEFAULT_CHUNKSIZE
+    if chunksize < 1:
+        raise ValueError('Parameter `chunksize` must be a positive integer, got {}.'.format(chunksize))
+
+    chunks = chunk_list(expand_sources(filenames), chunksize)
+    fields = None if fields is None else field_tree(fields)
+    if verbose:
+        from tqdm import tqdm
+    progress = (lambda it: tqdm(it, total=len(chunks))) if verbose else (lambda it: it)
+
+    jsons = []
+    if workers == 1 and executor is None:
+        for chunk in progress(chunks):
+            jsons.extend(_load_json_chunk(chunk, fast_json, where, fields))
+        return jsons
+
+    pool = executor if executor is not None else _make_executor(workers, use_processes)
+    try:
+        results = pool.map(_load_json_chunk, chunks, [fast_json] * len(chunks), [where] * len(chunks),
+                           [fields] * len(chunks))
+        for chunk_jsons in progress(results):
+            jsons.extend(chunk_jsons)
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    return jsons
+
+
+def iter_json_chunks(filenames, chunk_size, workers=1, chunksize=None, use_processes=False, fast_json=False, where=None,
+                     fields=None):
+    """ Load VERIS-formatted JSON files (or archives or JSONL files of them) `chunk_size` incidents at a time.
+
+    With `workers` > 1, a single thread (or process) pool loads all of the chunks; it is shut down when the iteration
+    finishes or the generator is closed.
+
+    Parameters
+    ----------
+    filenames: list
+        Sources to open, as in `load_json_files`
+    chunk_size: int
+        Number of incidents in each chunk (the last one may have fewer). With `where`, chunks are filled with the
+        incidents that pass it.
+    workers, chunksize, use_processes, fast_json, where, fields:
+        See `load_json_files`
+
+    Yields
+    ------
+    list
+        Parsed JSON objects, in order. At most about two chunks of incidents are held in memory at once, even when
+        reading a large tar archive or JSONL file.
+    """
+    stream_fields = None if fields is None else field_tree(fields)
+    executor = _make_executor(workers, use_processes) if workers is not None and workers > 1 else None
+
+    def load_batch(batch):
+        return load_json_files(batch, workers=workers, chunksize=chunksize, use_processes=use_processes,
+                               fast_json=fast_json, where=where, fields=fields, executor=executor)
+
+    def iter_jsons():
+        batch = []
+        for entry in expand_sources(filenames):
+            if is_stream_entry(entry) or len(batch) == chunk_size:
+                for item in load_batch(batch):
+                    yield item
+                batch = []
+            if is_stream_entry(entry):
+                for item in iter_stream_entry(entry, fast_json, where, stream_fields):
+                    yield item
+            else:
+                batch.append(entry)
+        for item in load_batch(batch):
+            yield item
+
+    try:
+        jsons = iter_jsons()
+        while True:
+            chunk = list(itertools.islice(jsons, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if executor is not None:
+            executor.shutdown()
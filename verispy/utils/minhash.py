@@ -0,0 +1,185 @@
+import pickle
+
+import numpy as np
+
+from .bitpack import pack_bools, row_popcount
+
+
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = np.uint32(MERSENNE_PRIME)  # signature of an empty set
+SIGNATURE_CHUNK = 8192  # incidents hashed (and packed) at a time when adding to an index
+
+
+class MinHashIndex(object):
+    """
+    Approximate nearest-neighbour index of incidents, by the Jaccard similarity of their sets of True columns.
+
+    Each incident (a row of a `VERIS.df_to_matrix` matrix) gets a MinHash signature of `num_perm` values. The
+    signature is cut into `bands` bands, and incidents that share a band are indexed in the same bucket
+    (locality-sensitive hashing), so a query only looks at incidents that agree with it on at least one band. These
+    candidates are then ranked by their exact Jaccard similarity to the query, computed on the rows packed into bits.
+    Pairs with a Jaccard similarity above about `(1 / bands) ** (bands / num_perm)` are very likely to be candidates of
+    each other.
+
+    Incidents can be added (or replaced, by `incident_id`) at any time with `add`. Use `save` and `load` to store the
+    index on disk. See also `VERIS.similarity_index`.
+
+    Parameters
+    ------------
+    columns: list
+        Names of the matrix columns
+    num_perm: int (default: 128)
+        Number of hash functions in a signature
+    bands: int (default: 16)
+        Number of bands the signatures are cut into. Must divide `num_perm`.
+    seed: int (default: 0)
+        Seed of the hash functions
+    """
+
+    def __init__(self, columns, num_perm=128, bands=16, seed=0):
+        if num_perm % bands != 0:
+            raise ValueError('bands ({}) must divide num_perm ({}).'.format(bands, num_perm))
+        self.columns = list(columns)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        a = rng.randint(1, MERSENNE_PRIME, size=(num_perm, 1)).astype(np.uint64)
+        b = rng.randint(0, MERSENNE_PRIME, size=(num_perm, 1)).astype(np.uint64)
+        # hash of every column under every hash function: (a * column + b) mod p
+        self._column_hashes = ((a * np.arange(len(self.columns), dtype=np.uint64) + b) % MERSENNE_PRIME).astype(np.uint32)
+
+        self.incident_ids = []
+        self.positions = {}  # incident_id -> row
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.bits = np.zeros((0, (len(self.columns) + 63) // 64), dtype=np.uint64)
+        self.sizes = np.zeros(0, dtype=np.int64)  # number of True columns of each incident
+        self.buckets = [{} for _ in range(bands)]  # band key -> set of rows
+
+    def __len__(self):
+        return len(self.incident_ids)
+
+    def _signatures(self, matrix):
+        """ MinHash signatures of the rows of a CSR matrix. """
+        signatures = np.full((matrix.shape[0], self.num_perm), MAX_HASH, dtype=np.uint32)
+        for start in range(0, matrix.shape[0], SIGNATURE_CHUNK):
+            chunk = matrix[start:start + SIGNATURE_CHUNK]
+            nonempty = np.diff(chunk.indptr) > 0
+            if chunk.nnz == 0:
+                continue
+            hashes = self._column_hashes[:, chunk.indices]
+            minima = np.minimum.reduceat(hashes, chunk.indptr[:-1][nonempty], axis=1)
+            signatures[start + np.flatnonzero(nonempty)] = minima.T
+        return signatures
+
+    def _band_keys(self, signature):
+        rows = self.num_perm // self.bands
+        return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def _as_csr(self, matrix):
+        from scipy import sparse
+        matrix = sparse.csr_matrix(matrix, dtype=bool)
+        if matrix.shape[1] != len(self.columns):
+            raise ValueError('Matrix has {} columns, the index {}.'.format(matrix.shape[1], len(self.columns)))
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        return matrix
+
+    def add(self, incident_ids, matrix):
+        """ Add incidents to the index, replacing the ones already in it with the same `incident_id`.
+
+        Parameters
+        ----------
+        incident_ids: list
+            `incident_id` of each row of `matrix`
+        matrix: np ndarray or scipy.sparse matrix
+            Incidents by `columns` (non-zero values are True), e.g. from `VERIS.df_to_matrix(df, columns=index.columns)`
+        """
+        matrix = self._as_csr(matrix)
+        incident_ids = list(incident_ids)
+        if matrix.shape[0] != len(incident_ids):
+            raise ValueError('Got {} incident_ids for {} rows.'.format(len(incident_ids), matrix.shape[0]))
+        if len(set(incident_ids)) != len(incident_ids):
+            raise ValueError('Duplicated incident_ids.')
+        signatures = self._signatures(matrix)
+        bits = np.zeros((matrix.shape[0], self.bits.shape[1]), dtype=np.uint64)
+        for start in range(0, matrix.shape[0], SIGNATURE_CHUNK):
+            chunk = matrix[start:start + SIGNATURE_CHUNK]
+            bits[start:start + chunk.shape[0]] = pack_bools(chunk.toarray().T)
+        sizes = np.diff(matrix.indptr).astype(np.int64)
+
+        new_rows = []
+        for row, incident_id in enumerate(incident_ids):
+            position = self.positions.get(incident_id)
+            if position is None:
+                position = len(self.incident_ids) + len(new_rows)
+                self.positions[incident_id] = position
+                new_rows.append(row)
+            else:  # replace: take the old version out of its buckets
+                for band, key in enumerate(self._band_keys(self.signatures[position])):
+                    bucket = self.buckets[band][key]
+                    bucket.discard(position)
+                    if not bucket:
+                        del self.buckets[band][key]
+                self.signatures[position] = signatures[row]
+                self.bits[position] = bits[row]
+                self.sizes[position] = sizes[row]
+            for band, key in enumerate(self._band_keys(signatures[row])):
+                self.buckets[band].setdefault(key, set()).add(position)
+        self.incident_ids.extend(incident_ids[row] for row in new_rows)
+        self.signatures = np.concatenate([self.signatures, signatures[new_rows]])
+        self.bits = np.concatenate([self.bits, bits[new_rows]])
+        self.sizes = np.concatenate([self.sizes, sizes[new_rows]])
+
+    def query(self, incident, k=10):
+        """ The indexed incidents most similar to `incident`.
+
+        Parameters
+        ----------
+        incident: str, np ndarray or scipy.sparse matrix
+            `incident_id` of an incident of the index (which is then left out of the results), or a row of `columns`
+        k: int (default: 10)
+            Number of incidents to return. Fewer are returned if fewer share a band with `incident`.
+
+        Returns
+        -------
+        list
+            (incident_id, Jaccard similarity) pairs, most similar first (ties in the order the incidents were added)
+        """
+        if isinstance(incident, str):
+            position = self.positions[incident]
+            signature, bits, size = self.signatures[position], self.bits[position], self.sizes[position]
+        else:
+            position = None
+            row = self._as_csr(np.atleast_2d(incident.toarray() if hasattr(incident, 'toarray') else incident))
+            signature = self._signatures(row)[0]
+            bits = pack_bools(row.toarray().T)[0]
+            size = row.nnz
+
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+        candidates.discard(position)
+        if not candidates:
+            return []
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+
+        intersection = row_popcount(self.bits[candidates] & bits)
+        union = self.sizes[candidates] + size - intersection
+        similarity = np.where(union > 0, intersection / np.maximum(union, 1), 1.0)
+        order = np.lexsort((candidates, -similarity))[:k]
+        return [(self.incident_ids[candidates[i]], float(similarity[i])) for i in order]
+
+    def save(self, path):
+        """ Write the index to `path` (a pickle). """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """ Read an index written by `save`. """
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        if not isinstance(index, cls):
+            raise TypeError('{} does not hold a {}.'.format(path, cls.__name__))
+        return index
@@ -0,0 +1,226 @@
+from . import constants as veris_const
+from . import industry as industry_const
+from .cache import schema_hash
+
+
+class SchemaPlan(object):
+    """
+    Everything `VERIS` derives from a schema, computed once.
+
+    The plan holds the enumerations found by `VERIS._enums_from_schema` along with the structures built from them: the
+    column names of each enumeration, the columns OR-ed together for each A4 name and organization size, the victim
+    industry and DBIR pattern columns, and the schema-determined column order and dtypes of the final DataFrame. Plans
+    only hold plain lists and dicts, so they can be pickled and handed to other processes or `VERIS` objects (see
+    `register_plan`).
+
+    Parameters
+    ------------
+    schema_id: str
+        Content hash of the schema (see `verispy.utils.cache.schema_hash`)
+    enum_list: list
+        Output of `VERIS._enums_from_schema`
+    """
+
+    def __init__(self, schema_id, enum_list):
+        self.schema_id = schema_id
+        self.enumerations = {item['name']: item['enumlist'] for item in enum_list if 'enumlist' in item}
+        self.nonenum_vars = [item for item in enum_list if 'enumlist' not in item]
+
+        # enumeration -> its columns, in schema order
+        self.enum_columns = {enum: list(dict.fromkeys('.'.join((enum, suffix)) for suffix in suffixes))
+                             for enum, suffixes in self.enumerations.items()}
+        all_enum_columns = [col for cols in self.enum_columns.values() for col in cols]
+        enum_column_set = set(all_enum_columns)
+
+        # A4 names: list of (A4 column, columns to OR together, negate). A negated A4 name is True when none of its
+        # columns are (`actor.Unknown`, `action.Unknown`: complements of the other A4 names in their class).
+        self.a4_groups = []
+        revassetmap = {veris_const.ASSETMAP[key]: key for key in veris_const.ASSETMAP}
+        for name in veris_const.A4NAMES:
+            if name.startswith('asset'):
+                varname = '.'.join((name, 'variety'))
+                for suffix in veris_const.A4NAMES[name]['variety']:
+                    searchname = '.'.join((name, 'assets.variety', revassetmap[suffix]))
+                    self.a4_groups.append(('.'.join((varname, suffix)),
+                                           [col for col in all_enum_columns if col.startswith(searchname)], False))
+            else:
+                for suffix in veris_const.A4NAMES[name]:
+                    fullname = '.'.join((name, suffix))
+                    if suffix == 'Unknown':
+                        searchnames = ['.'.join((name, other.lower())) for other in veris_const.A4NAMES[name]
+                                       if other != 'Unknown']
+                        self.a4_groups.append((fullname, self._columns_under(searchnames), True))
+                        continue
+                    columns = self._columns_under([fullname.lower()])
+                    if fullname == 'attribute.Confidentiality':
+                        # attribute.confidentiality.data_disclosure.No and .Unknown do not make an incident a
+                        # confidentiality incident. (.Potentially is left in.)
+                        columns = [col for col in columns if col not in veris_const.CONFIDENTIALITY_EXCLUDE]
+                    self.a4_groups.append((fullname, columns, False))
+
+        # organization size: list of (orgsize column, employee_count columns to OR together)
+        self.orgsize_groups = [(orgsize, [col for col in orgcols if col in enum_column_set])
+                               for orgsize, orgcols in veris_const.ORG_SMALL_LARGE.items()]
+
+        # victim industries
+        self.industry_codes = list(industry_const.INDUSTRY_BY_CODE.keys())
+        self.industry2_columns = ['.'.join(('victim.industry2', code)) for code in self.industry_codes]
+        industry_columns = ['victim.industry2', 'victim.industry3', 'victim.industry.name', 'victim.industry.fullname',
+                            'actor.partner.industry2']
+        self.industry_columns = industry_columns
+
+        # nominal dtypes of the columns the schema determines. Raw columns not in the schema come on top of these.
+        dtypes = {}
+        for nonenum in self.nonenum_vars:
+            dtypes[nonenum['name']] = 'float64' if nonenum['type'] in ('integer', 'number') else 'object'
+        for enum, cols in self.enum_columns.items():
+            is_amount = enum.endswith('.amount') and enum[:-len('.amount')] in veris_const.VARIETY_AMT_ENUMS
+            for col in cols:
+                dtypes[col] = 'object' if is_amount else 'bool'
+        for col in industry_columns:
+            dtypes[col] = 'object'
+        self.pattern_columns = ['.'.join(('pattern', pattern)) for pattern in veris_const.PATTERNS]
+        for col in [group[0] for group in self.a4_groups + self.orgsize_groups] + self.industry2_columns + self.pattern_columns:
+            dtypes[col] = 'bool'
+        dtypes['pattern'] = 'category'
+        self.dtypes = dtypes
+
+        # schema type ('string', 'integer', 'number' or 'boolean') of the columns that are not booleans, which picks
+        # their compact dtype in `VERIS.json_to_df(compact=True)`. Amounts are counts; industries are strings.
+        schema_types = {nonenum['name']: nonenum['type'] for nonenum in self.nonenum_vars}
+        for col, dtype in dtypes.items():
+            if dtype == 'object' and col not in schema_types:
+                schema_types[col] = 'string' if col in industry_columns else 'integer'
+        for level in range(4, industry_const.MAX_INDUSTRY_DEPTH + 1):
+            schema_types['victim.industry{}'.format(level)] = 'string'
+        self.schema_types = schema_types
+        self.columns = sorted(dtypes)
+        self.column_index = {col: i for i, col in enumerate(self.columns)}
+
+    def _columns_under(self, prefixes):
+        """ Enumeration columns of every enumeration whose name starts with one of `prefixes`, in schema order. """
+        return [col for enum, cols in self.enum_columns.items()
+                for prefix in prefixes if enum.startswith(prefix) for col in cols]
+
+
+def _under(col, prefixes):
+    """ Is column `col` one of `prefixes`, or under one of them (after a dot)? """
+    for prefix in prefixes:
+        if col == prefix or col.startswith(prefix + '.'):
+            return True
+    return False
+
+
+class Projection(object):
+    """
+    The columns of a `VERIS.json_to_df(include=..., exclude=...)` DataFrame, and what must be built to get them.
+
+    A column is selected if it is, or is under (after a dot), one of the `include` prefixes (any column when `include`
+    is None) and neither is nor is under one of the `exclude` prefixes. `incident_id` is always selected. Only the
+    enumerations, schema variables and raw columns that are selected, or that a selected A4 name, organization size,
+    victim industry or DBIR pattern column is computed from, are built; those dependencies are dropped from the
+    DataFrame at the end unless they are selected themselves.
+
+    Parameters
+    ------------
+    plan: SchemaPlan
+        Plan of the schema
+    include: list, optional (default: None)
+        Column prefixes to select, such as `'action'` or `'asset.assets'` (a trailing `.*` is ignored)
+    exclude: list, optional (default: None)
+        Column prefixes to leave out, even if they are under an `include` prefix
+    """
+
+    def __init__(self, plan, include=None, exclude=None):
+        if isinstance(include, str) or isinstance(exclude, str):
+            raise TypeError('`include` and `exclude` must be lists of column prefixes, not strings.')
+        strip = lambda prefix: prefix[:-2] if prefix.endswith('.*') else prefix
+        self.include = None if include is None else [strip(prefix) for prefix in include]
+        self.exclude = [strip(prefix) for prefix in exclude or []]
+        selects = self.selects
+
+        # derived columns, and the columns they are computed from
+        self.patterns = any(selects(col) for col in plan.pattern_columns + ['pattern'])
+        pattern_enums = set(veris_const.PATTERN_ENUMS) if self.patterns else set()
+        self.a4_groups = [group for group in plan.a4_groups if selects(group[0]) or group[0] in pattern_enums]
+        self.orgsize_groups = [group for group in plan.orgsize_groups if selects(group[0])]
+        victim_industry_columns = ([col for col in plan.industry_columns if col.startswith('victim.')] + plan.industry2_columns +
+                                   ['victim.industry{}'.format(level)
+                                    for level in range(4, industry_const.MAX_INDUSTRY_DEPTH + 1)])
+        self.victim_industry = any(selects(col) for col in victim_industry_columns)
+        self.partner_industry = selects('actor.partner.industry2')
+
+        needed = set(col for col in plan.dtypes if selects(col)) | pattern_enums
+        for _, columns, _ in self.a4_groups:
+            needed.update(columns)
+        for _, columns in self.orgsize_groups:
+            needed.update(columns)
+        if self.victim_industry:
+            needed.add('victim.industry')
+        if self.partner_industry:
+            needed.add('actor.partner.industry')
+        self._needed = needed
+
+        # enumerations to expand. The variety and amount of a variety/amount object come from the same raw column, so
+        # they are expanded together.
+        enums = set(enum for enum, columns in plan.enum_columns.items() if any(col in needed for col in columns))
+        for col in veris_const.VARIETY_AMT_ENUMS:
+            pair = ['.'.join((col, variety_or_amt)) for variety_or_amt in veris_const.VARIETY_AMT]
+            if any(enum in enums for enum in pair):
+                enums.update(enum for enum in pair if enum in plan.enumerations)
+        self.enumerations = {enum: suffixes for enum, suffixes in plan.enumerations.items() if enum in enums}
+        self.nonenum_vars = [nonenum for nonenum in plan.nonenum_vars if nonenum['name'] in needed]
+        self._schema_enums = plan.enumerations
+
+        # JSON fields to load (see `verispy.utils.loaders.select_fields`); all of them unless `include` limits them
+        self.raw_fields = None
+        if self.include is not None:
+            variety_amounts = [col for col in veris_const.VARIETY_AMT_ENUMS if self.uses_raw(col)]
+            self.raw_fields = sorted(set(['incident_id'] + list(self.enumerations) + variety_amounts + self.include +
+                                         [nonenum['name'] for nonenum in self.nonenum_vars]))
+
+    def selects(self, col):
+        """ Is column `col` in the projected DataFrame? """
+        if col == 'incident_id':
+            return True
+        if self.include is not None and not _under(col, self.include):
+            return False
+        return not _under(col, self.exclude)
+
+    def uses_raw(self, col):
+        """ Is raw column `col` used: an enumeration (or variety/amount object) to expand, or a column to keep? """
+        if col in self.enumerations or col in self._needed:
+            return True
+        if col in veris_const.VARIETY_AMT_ENUMS:
+            return '.'.join((col, veris_const.VARIETY_AMT[0])) in self.enumerations
+        return col not in self._schema_enums and self.selects(col)
+
+
+_PLANS = {}
+
+
+def register_plan(plan):
+    """ Make `plan` available to `get_plan`, for example after unpickling it in another process. """
+    _PLANS[plan.schema_id] = plan
+
+
+def get_plan(schema, build_enum_list):
+    """ Return the plan for `schema`, compiling it on first use.
+
+    Parameters
+    ----------
+    schema: dict
+        The VERIS schema
+    build_enum_list: callable
+        Called with the schema to get its enumeration list (`VERIS._enums_from_schema`) if the plan must be compiled
+
+    Returns
+    -------
+    SchemaPlan
+    """
+    schema_id = schema_hash(schema)
+    plan = _PLANS.get(schema_id)
+    if plan is None:
+        plan = SchemaPlan(schema_id, build_enum_list(schema))
+        register_plan(plan)
+    return plan
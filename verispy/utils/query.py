@@ -0,0 +1,179 @@
+import functools
+import re
+
+import numpy as np
+
+from .bitpack import COLUMN_CHUNK, BitPackedFrame, pack_bools, popcount, unpack_bools
+from .colindex import column_index
+
+
+FUNCTIONS = ('known', 'unknown')
+_TOKEN = re.compile(r"""\s*(?:(?P<op>[&|!~()])|`(?P<backquoted>[^`]*)`|"(?P<dquoted>[^"]*)"|'(?P<squoted>[^']*)'"""
+                    r"""|(?P<name>[^&|!~()`"']+))""")
+
+
+def _tokenize(expression):
+    """ (kind, text) tokens of a query: kind is 'op' or 'name'. Unquoted names may contain spaces. """
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN.match(expression, pos)
+        if match is None:
+            raise ValueError('Invalid query "{}": unterminated quote at position {}.'.format(expression, pos))
+        pos = match.end()
+        if match.group('op'):
+            tokens.append(('op', match.group('op')))
+        elif match.group('name') is not None:
+            tokens.append(('name', match.group('name').strip()))
+        else:
+            tokens.append(('name', next(group for group in match.group('backquoted', 'dquoted', 'squoted')
+                                        if group is not None)))
+    return tokens
+
+
+class _Parser(object):
+    """ Recursive descent parser of the query grammar:
+
+        expression := term ('|' term)*
+        term       := factor ('&' factor)*
+        factor     := ('!' | '~') factor | '(' expression ')' | function '(' name ')' | name
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+
+    def error(self, message):
+        return ValueError('Invalid query "{}": {}.'.format(self.expression, message))
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind, text=None):
+        token = self.peek()
+        if token[0] != kind or (text is not None and token[1] != text):
+            raise self.error('expected {} at token {}, found {}'.format(
+                repr(text) if text else 'a name', self.pos + 1, repr(token[1]) if token[1] else 'the end'))
+        self.pos += 1
+        return token[1]
+
+    def parse(self):
+        node = self.expression_()
+        if self.pos != len(self.tokens):
+            raise self.error('unexpected {!r} at token {}'.format(self.peek()[1], self.pos + 1))
+        return node
+
+    def expression_(self):
+        nodes = [self.term()]
+        while self.peek() == ('op', '|'):
+            self.pos += 1
+            nodes.append(self.term())
+        return nodes[0] if len(nodes) == 1 else ('or',) + tuple(nodes)
+
+    def term(self):
+        nodes = [self.factor()]
+        while self.peek() == ('op', '&'):
+            self.pos += 1
+            nodes.append(self.factor())
+        return nodes[0] if len(nodes) == 1 else ('and',) + tuple(nodes)
+
+    def factor(self):
+        kind, text = self.peek()
+        if kind == 'op' and text in ('!', '~'):
+            self.pos += 1
+            return ('not', self.factor())
+        if kind == 'op' and text == '(':
+            self.pos += 1
+            node = self.expression_()
+            self.take('op', ')')
+            return node
+        name = self.take('name')
+        if name in FUNCTIONS and self.peek() == ('op', '('):
+            self.pos += 1
+            argument = self.take('name')
+            self.take('op', ')')
+            return (name, argument)
+        return ('name', name)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_query(expression):
+    """ Parse a query (see `VERIS.query`) into a tree of tuples: ('name', name), ('known', name), ('unknown', name),
+    ('not', node), ('and', node, node, ...) and ('or', node, node, ...). Raises ValueError if it is not valid. """
+    if not expression or not expression.strip():
+        raise ValueError('Empty query.')
+    return _Parser(expression).parse()
+
+
+def _is_unknown(col):
+    return col.split('.')[-1].lower() == 'unknown'
+
+
+class _Evaluator(object):
+    """ Evaluates a parsed query over the boolean columns of a DataFrame or `BitPackedFrame`, as packed uint64 words. """
+
+    def __init__(self, df):
+        self.df = df
+        self.index = column_index(df)
+        self.nrows = df.shape[0]
+        self.valid = pack_bools(np.ones((self.nrows, 1), dtype=bool))[0]  # the padding bits of the last word are 0
+
+    def columns(self, name):
+        """ The boolean column `name`, or the boolean columns below it. """
+        if self.index.is_bool_column(name):
+            return [name]
+        columns = [col for col in self.index.descendants(name) if self.index.is_bool_column(col)]
+        if not columns:
+            raise ValueError('"{}" is neither a boolean column nor has boolean columns below it. Quote names with '
+                           'parentheses or operators in them with backquotes.'.format(name))
+        return columns
+
+    def any_words(self, columns):
+        """ Packed words of the rows with a True value in at least one of `columns`. """
+        if not columns:
+            return np.zeros_like(self.valid)
+        if isinstance(self.df, BitPackedFrame):
+            return self.df.any_words(columns)
+        words = np.zeros_like(self.valid)
+        for start in range(0, len(columns), COLUMN_CHUNK):
+            block = self.df[columns[start:start + COLUMN_CHUNK]].to_numpy(dtype=bool)
+            words |= pack_bools(block.any(axis=1)[:, None])[0]
+        return words
+
+    def evaluate(self, node):
+        op = node[0]
+        if op == 'name':
+            return self.any_words(self.columns(node[1]))
+        if op == 'known':
+            return self.any_words([col for col in self.columns(node[1]) if not _is_unknown(col)])
+        if op == 'unknown':
+            columns = self.columns(node[1])
+            unknown = self.any_words([col for col in columns if _is_unknown(col)])
+            return unknown & ~self.any_words([col for col in columns if not _is_unknown(col)])
+        if op == 'not':
+            return ~self.evaluate(node[1]) & self.valid
+        words = self.evaluate(node[1])
+        for child in node[2:]:
+            if op == 'and':
+                words &= self.evaluate(child)
+            else:
+                words |= self.evaluate(child)
+        return words
+
+
+def query_words(df, expression):
+    """ The rows of `df` (a DataFrame or `BitPackedFrame`) matching the query `expression`, as packed uint64 words (see
+    `verispy.utils.bitpack.pack_bools`). See `VERIS.query` for the query language. """
+    return _Evaluator(df).evaluate(parse_query(expression))
+
+
+def query_mask(df, expression):
+    """ Boolean row mask of the rows of `df` matching the query `expression`. """
+    return unpack_bools(query_words(df, expression)[None, :], df.shape[0])[:, 0]
+
+
+def query_count(df, expression):
+    """ Number of rows of `df` matching the query `expression`, counted on the packed words. """
+    return int(popcount(query_words(df, expression)).sum(dtype=np.int64))
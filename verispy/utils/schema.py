@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import warnings
+
+
+BUNDLED_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'verisc-merged.json')
+DEFAULT_SCHEMA_TTL = 24 * 60 * 60  # seconds
+DEFAULT_SCHEMA_TIMEOUT = 10  # seconds
+DEFAULT_CACHE_DIR = object()  # stands for `default_cache_dir()`, looked up when the cache is created
+
+
+def default_cache_dir():
+    """ Per-user cache directory for verispy (`$XDG_CACHE_HOME/verispy`, or `~/.cache/verispy`). """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'verispy')
+
+
+def load_bundled_schema():
+    """ Load the copy of the VERIS schema that ships with verispy (see `verispy/data/README.md`). """
+    with open(BUNDLED_SCHEMA_PATH, 'r') as f:
+        return json.load(f)
+
+
+class SchemaCache(object):
+    """
+    Fetch the VERIS schema over HTTP, keeping a local copy.
+
+    A cached copy younger than `ttl` seconds is used without touching the network. An older copy is revalidated with a
+    conditional request (`If-None-Match` / `If-Modified-Since`), so an unchanged schema is not downloaded again. If the
+    request fails (no network, timeout, server error, invalid JSON), the cached copy is used if there is one, and
+    otherwise the schema bundled with verispy.
+
+    Parameters
+    ------------
+    cache_dir: str, optional (default: None)
+        Directory in which to keep the downloaded schemas. If None, nothing is written to disk and every call makes a
+        request (still falling back to the bundled schema on failure).
+    ttl: float (default: 86400)
+        Number of seconds a downloaded schema is used before being revalidated.
+    timeout: float (default: 10)
+        Timeout, in seconds, of the HTTP request.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_SCHEMA_TTL, timeout=DEFAULT_SCHEMA_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.timeout = timeout
+
+    def _paths(self, url):
+        name = 'schema-' + hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, name + '.json'), os.path.join(self.cache_dir, name + '.meta.json')
+
+    def _read(self, url):
+        """ Return (schema, metadata) for the cached copy of `url`, or (None, None). """
+        if not self.cache_dir:
+            return None, None
+        schema_path, meta_path = self._paths(url)
+        try:
+            with open(schema_path, 'r') as f:
+                schema = json.load(f)
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        return schema, meta
+
+    def _write(self, url, schema=None, meta=None):
+        """ Cache the schema and/or metadata of `url`. Caching is best-effort: failures only issue a warning. """
+        if not self.cache_dir:
+            return
+        schema_path, meta_path = self._paths(url)
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # the schema is written before its metadata, so a crash never leaves metadata pointing at a missing schema
+            for path, obj in ((schema_path, schema), (meta_path, meta)):
+                if obj is None:
+                    continue
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(obj, f)
+                os.replace(tmp_path, path)
+                tmp_path = None
+        except OSError as e:
+            warnings.warn('Could not write the VERIS schema cache in {} ({}).'.format(self.cache_dir, e))
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def fetch(self, url):
+        """ Get the schema at `url`.
+
+        Parameters
+        ----------
+        url: str
+            URL of the VERIS schema
+
+        Returns
+        -------
+        tuple
+            (schema dict, source) where source is one of 'cache' (fresh cached copy), 'revalidated' (cached copy that
+            the server says is unchanged), 'network' (downloaded), 'stale-cache' (cached copy used because the request
+            failed) or 'bundled' (the schema shipped with verispy, used because the request failed and nothing was cached)
+        """
+        schema, meta = self._read(url)
+        now = time.time()
+        if schema is not None and now - meta.get('fetched', 0) < self.ttl:
+            return schema, 'cache'
+
+        headers = {}
+        if schema is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        import requests  # slow to import: only when the schema is downloaded
+        try:
+            r = requests.get(url, headers=headers, timeout=self.timeout)
+            if r.status_code == 304 and schema is not None:
+                meta['fetched'] = now
+                self._write(url, meta=meta)
+                return schema, 'revalidated'
+            r.raise_for_status()  # check for bad request
+            new_schema = r.json()
+            if not isinstance(new_schema, dict):
+                raise ValueError('Schema at {} is not a JSON object.'.format(url))
+        except (requests.RequestException, ValueError) as e:
+            if schema is not None:
+                warnings.warn('Could not fetch VERIS schema from {} ({}). Using the cached copy from {}.'.format(
+                    url, e, time.ctime(meta.get('fetched', 0))))
+                return schema, 'stale-cache'
+            warnings.warn('Could not fetch VERIS schema from {} ({}). Using the schema bundled with verispy.'.format(url, e))
+            return load_bundled_schema(), 'bundled'
+
+        self._write(url, new_schema, {'url': url, 'fetched': now, 'etag': r.headers.get('ETag'),
+                                      'last_modified': r.headers.get('Last-Modified')})
+        return new_schema, 'network'
@@ -0,0 +1,171 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+METRICS = ('jaccard', 'hamming', 'cosine')
+DEFAULT_BLOCK_SIZE = 256  # rows of distances computed at a time
+
+
+def _prepare(matrix, metric):
+    """ (CSR float32 matrix, per-row statistic) for `metric`: row sums of the binarized matrix, or row norms for cosine. """
+    if metric not in METRICS:
+        raise ValueError('Unknown metric "{}". Use one of {}.'.format(metric, ', '.join(METRICS)))
+    from scipy import sparse
+    X = sparse.csr_matrix(matrix, dtype=np.float32, copy=True)
+    if metric == 'cosine':
+        stats = np.sqrt(np.asarray(X.multiply(X).sum(axis=1), dtype=np.float32).ravel())
+    else:  # Jaccard and Hamming distances treat any non-zero value as True
+        X.data = (X.data != 0).astype(np.float32)
+        X.eliminate_zeros()
+        stats = np.asarray(X.sum(axis=1), dtype=np.float32).ravel()
+    return X, stats
+
+
+def _distance_block(X, stats, metric, start, stop):
+    """ Distances from rows `start:stop` of `X` to all of its rows, as a float32 array of shape (stop - start, rows). """
+    # dot products of the block's rows with every row: sparse matrix times a small dense block
+    dots = np.ascontiguousarray((X @ X[start:stop].toarray().T).T, dtype=np.float32)
+    block_stats = stats[start:stop, None]
+    if metric == 'hamming':
+        dots *= -2
+        dots += block_stats
+        dots += stats[None, :]
+        dots /= X.shape[1]
+        return dots
+    if metric == 'jaccard':
+        denom = block_stats + stats[None, :] - dots
+    else:
+        denom = block_stats * stats[None, :]
+    empty = denom == 0
+    np.divide(dots, denom, out=dots, where=~empty)
+    np.subtract(1, dots, out=dots)
+    if metric == 'cosine':
+        np.maximum(dots, 0, out=dots)  # rounding can push identical rows slightly below 0
+        # an all-zero row is at distance 0 from other all-zero rows and 1 from the rest
+        dots[empty] = 1
+        dots[empty & (block_stats == 0) & (stats[None, :] == 0)] = 0
+    else:
+        dots[empty] = 0  # two rows without any True value are identical
+    return dots
+
+
+def iter_distance_blocks(matrix, metric='jaccard', block_size=DEFAULT_BLOCK_SIZE, workers=1):
+    """ Compute the pairwise distances between the rows of a matrix, one block of rows at a time.
+
+    Each block is the product of the (sparse) matrix with a small dense block of its rows, so no more than
+    `block_size` x rows distances are held in memory per worker, whatever the number of rows.
+
+    Parameters
+    ----------
+    matrix: np ndarray or scipy.sparse matrix
+        Incidents by columns, such as the output of `VERIS.df_to_matrix`
+    metric: str (default: 'jaccard')
+        One of 'jaccard', 'hamming' (the fraction of columns that differ) or 'cosine'. Jaccard and Hamming distances
+        treat any non-zero value as True; they match `scipy.spatial.distance.jaccard` and `.hamming` on boolean rows.
+    block_size: int (default: 256)
+        Number of rows in each block
+    workers: int (default: 1)
+        Number of threads computing blocks. At most two blocks per worker are held in memory at once.
+
+    Yields
+    ------
+    tuple
+        (start, block): `block` is the float32 array of distances from rows `start` to `start + len(block)` to every row
+    """
+    if block_size < 1 or workers < 1:
+        raise ValueError('block_size and workers must be positive integers.')
+    X, stats = _prepare(matrix, metric)
+    starts = range(0, X.shape[0], block_size)
+    if workers == 1:
+        for start in starts:
+            yield start, _distance_block(X, stats, metric, start, min(start + block_size, X.shape[0]))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for start in starts:
+            pending.append((start, pool.submit(_distance_block, X, stats, metric, start, min(start + block_size, X.shape[0]))))
+            if len(pending) >= 2 * workers:
+                start, future = pending.popleft()
+                yield start, future.result()
+        while pending:
+            start, future = pending.popleft()
+            yield start, future.result()
+
+
+def top_k_neighbors(matrix, k=10, metric='jaccard', block_size=DEFAULT_BLOCK_SIZE, workers=1):
+    """ The `k` nearest rows of each row of a matrix (not counting the row itself).
+
+    Parameters
+    ----------
+    matrix: np ndarray or scipy.sparse matrix
+        Incidents by columns, such as the output of `VERIS.df_to_matrix`
+    k: int (default: 10)
+        Number of neighbours. At most rows - 1 are returned.
+    metric, block_size, workers:
+        See `iter_distance_blocks`
+
+    Returns
+    -------
+    tuple
+        (indices, distances): arrays of shape (rows, k) with the row numbers of the neighbours of each row, nearest
+        first (ties in order of row number, among the neighbours returned), and their distances
+    """
+    nrows = matrix.shape[0]
+    k = max(min(k, nrows - 1), 0)
+    indices = np.zeros((nrows, k), dtype=np.int64)
+    distances = np.zeros((nrows, k), dtype=np.float32)
+    if k == 0:
+        return indices, distances
+    for start, block in iter_distance_blocks(matrix, metric, block_size, workers):
+        rows = np.arange(block.shape[0])
+        block[rows, start + rows] = np.inf  # a row is not its own neighbour
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        nearest_dist = np.take_along_axis(block, nearest, axis=1)
+        order = np.lexsort((nearest, nearest_dist), axis=-1)
+        indices[start:start + block.shape[0]] = np.take_along_axis(nearest, order, axis=1)
+        distances[start:start + block.shape[0]] = np.take_along_axis(nearest_dist, order, axis=1)
+    return indices, distances
+
+
+def condensed_distances(matrix, metric='jaccard', path=None, block_size=DEFAULT_BLOCK_SIZE, workers=1, dtype=np.float32):
+    """ All pairwise distances between the rows of a matrix, in the condensed form of `scipy.spatial.distance.pdist`.
+
+    The condensed array holds the distance between rows i < j at position rows * i - i * (i + 1) / 2 + j - i - 1, and
+    can be passed to `scipy.spatial.distance.squareform` or `scipy.cluster.hierarchy.linkage`.
+
+    Parameters
+    ----------
+    matrix: np ndarray or scipy.sparse matrix
+        Incidents by columns, such as the output of `VERIS.df_to_matrix`
+    metric: str (default: 'jaccard')
+        See `iter_distance_blocks`
+    path: str, optional (default: None)
+        Write the array to this `.npy` file, filling it block by block, and return it memory-mapped. Otherwise the
+        array is built in memory.
+    block_size, workers:
+        See `iter_distance_blocks`
+    dtype: np dtype (default: np.float32)
+        dtype of the returned distances
+
+    Returns
+    -------
+    np ndarray or np memmap
+        Condensed distance array of length rows * (rows - 1) / 2
+    """
+    nrows = matrix.shape[0]
+    size = nrows * (nrows - 1) // 2
+    if path is not None:
+        condensed = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(size,))
+    else:
+        condensed = np.empty(size, dtype=dtype)
+    for start, block in iter_distance_blocks(matrix, metric, block_size, workers):
+        for offset, row in enumerate(block):
+            i = start + offset
+            first = nrows * i - i * (i + 1) // 2
+            condensed[first:first + nrows - i - 1] = row[i + 1:]
+    if path is not None:
+        condensed.flush()
+    return condensed
@@ -0,0 +1,112 @@
+import contextlib
+import datetime
+import json
+import sys
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """ Peak resident set size of the process so far, in MB (None where the platform does not report it). """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB elsewhere
+
+
+class PipelineStats(object):
+    """
+    Statistics of each stage of a `VERIS.json_to_df` (or `iter_json_to_df`, `update_df`) run.
+
+    Every stage gets a record (a dict) with its name (`stage`), its wall and CPU times in seconds (`wall_s`, `cpu_s`),
+    how much it raised the peak resident set size of the process (`peak_rss_delta_mb`: 0 when the stage stayed below an
+    earlier peak), and the number of `rows` and `columns` of its output. Some stages add their own counts, such as
+    `dropped_duplicates` or `files`. Measuring a stage costs a few microseconds, so statistics are always collected.
+
+    Parameters
+    ------------
+    observer: callable, optional (default: None)
+        Called with (a copy of) the record of each stage as soon as the stage finishes
+    """
+
+    def __init__(self, observer=None):
+        self.observer = observer
+        self.started = datetime.datetime.now().isoformat()
+        self.stages = []
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __repr__(self):
+        return '<PipelineStats: {} stages, {:.3f} s>'.format(len(self.stages), self.total('wall_s'))
+
+    def _start(self, name, counts):
+        record = {'stage': name}
+        record.update(counts)
+        return record, (time.perf_counter(), time.process_time(), peak_rss_mb())
+
+    def _finish(self, record, start):
+        start_wall, start_cpu, start_peak = start
+        record['wall_s'] = time.perf_counter() - start_wall
+        record['cpu_s'] = time.process_time() - start_cpu
+        end_peak = peak_rss_mb()
+        record['peak_rss_delta_mb'] = end_peak - start_peak if end_peak is not None else None
+        self.stages.append(record)
+        if self.observer is not None:
+            self.observer(dict(record))
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        """ Measure the code run in the `with` block as stage `name`.
+
+        Yields the stage's record, for the block to add its counts to (see `set_shape`). The record is kept, and passed
+        to the observer, when the block completes.
+        """
+        record, start = self._start(name, counts)
+        yield record
+        self._finish(record, start)
+
+    def timed(self, name, iterable):
+        """ Iterate over `iterable`, measuring the production of each item (e.g. reading a chunk) as a stage `name`. """
+        iterator = iter(iterable)
+        while True:
+            record, start = self._start(name, {})
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            record['items'] = len(item) if hasattr(item, '__len__') else None
+            self._finish(record, start)
+            yield item
+
+    @staticmethod
+    def set_shape(record, df):
+        """ Record the number of rows and columns of `df` in `record`. """
+        record['rows'], record['columns'] = df.shape
+
+    def total(self, key='wall_s'):
+        """ Sum of `key` over the stages that have it. """
+        return sum(record[key] for record in self.stages if record.get(key) is not None)
+
+    def to_dict(self):
+        """ The statistics as a dict: when the run `started`, the records of its `stages`, and the total times. """
+        return {'started': self.started, 'stages': [dict(record) for record in self.stages],
+                'wall_s': self.total('wall_s'), 'cpu_s': self.total('cpu_s'), 'peak_rss_mb': peak_rss_mb()}
+
+    def to_json(self, path=None, **kwargs):
+        """ The statistics as a JSON string (see `to_dict`), also written to `path` if given. `kwargs` go to `json.dumps`. """
+        text = json.dumps(self.to_dict(), **kwargs)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_df(self):
+        """ The records of the stages as a pd DataFrame, one row per stage. """
+        return pd.DataFrame(self.stages)
@@ -0,0 +1,229 @@
+import bisect
+import gzip
+import json
+import os
+import random
+import uuid
+
+from . import industry as industry_const
+from .schema import load_bundled_schema
+
+
+WORDS = ('breach', 'server', 'employee', 'customer', 'records', 'email', 'laptop', 'stolen', 'website', 'malware',
+         'phishing', 'credentials', 'database', 'ransom', 'attacker', 'hospital', 'bank', 'exposed', 'lost', 'access',
+         'network', 'payment', 'cards', 'files', 'unauthorized', 'vendor', 'police', 'reported', 'data', 'system')
+TEXT_FIELDS = ('summary', 'notes', 'discovery_notes', 'reference', 'comment')  # free text: a sentence, not a word
+# optional in the schema, but (nearly) always filled in in practice
+COMMON_FIELDS = ('victim', 'victim.industry', 'victim.employee_count', 'victim.country', 'attribute')
+FIELD_FACTORIES = {}  # field name -> function(generator, schema node) making the field's value function
+
+
+def _field(*names):
+    """ Register a value factory for the fields `names`, which need more realistic values than their schema gives. """
+    def register(factory):
+        for name in names:
+            FIELD_FACTORIES[name] = factory
+        return factory
+    return register
+
+
+@_field('incident_id')
+def _incident_id(generator, node):
+    rng = generator.rng
+    return lambda: str(uuid.UUID(int=rng.getrandbits(128), version=4)).upper()
+
+
+@_field('schema_version')
+def _schema_version(generator, node):
+    version = node.get('default', '1.3.4')
+    return lambda: version
+
+
+@_field('victim.industry', 'actor.partner.industry')
+def _industry(generator, node):
+    rng = generator.rng
+    pick = generator._weighted([ind['code'] for ind in industry_const.INDUSTRY_LONG])
+    # 2- to 6-digit NAICS codes
+    return lambda: pick() + ''.join(rng.choice('0123456789') for _ in range(rng.randint(0, 4)))
+
+
+@_field('timeline.incident.year')
+def _year(generator, node):
+    rng = generator.rng
+    last = node.get('maximum', 2022)
+    first = max(node.get('minimum', 1950), last - 12)
+    return lambda: rng.randint(first, last)
+
+
+@_field('timeline.incident.time')
+def _time(generator, node):
+    rng = generator.rng
+    return lambda: '{:02d}:{:02d}:{:02d} {}'.format(rng.randint(1, 12), rng.randint(0, 59), rng.randint(0, 59),
+                                                     rng.choice('AP') + 'M')
+
+
+class IncidentGenerator(object):
+    """
+    Random VERIS incidents that follow a schema, for testing and benchmarking at scale.
+
+    The schema is compiled once into a tree of value functions, which are then called for every incident. Required
+    properties are always present, and each optional property is present with probability `optional_rate` (objects
+    get at least their `minProperties`); a few fields that are nearly always filled in in practice, such as the victim's
+    industry, are always present. Enumeration values are skewed like real data, the first values of each
+    enumeration being the most common, and arrays hold 1 to `max_items` items, mostly 1. Numbers have a heavy
+    tail, and fields such as `incident_id`, `victim.industry` (NAICS codes) and `timeline.incident.year` get
+    realistic values. The same `seed` always gives the same incidents.
+
+    Parameters
+    ------------
+    schema: dict, optional (default: None)
+        The VERIS schema. Defaults to the schema bundled with verispy.
+    seed: int (default: 0)
+        Seed of the random number generator
+    optional_rate: float (default: 0.3)
+        Probability of including each optional property of an object
+    max_items: int (default: 3)
+        Maximum number of items of an array
+    """
+
+    def __init__(self, schema=None, seed=0, optional_rate=0.3, max_items=3):
+        self.schema = load_bundled_schema() if schema is None else schema
+        self.rng = random.Random(seed)
+        self.optional_rate = optional_rate
+        self.max_items = max_items
+        self._make = self._compile(self.schema, '')
+
+    def _weighted(self, values):
+        """ Function drawing one of `values`, the i-th with a weight of 1 / (i + 1). """
+        rng = self.rng
+        cum_weights = []
+        total = 0.0
+        for i in range(len(values)):
+            total += 1.0 / (i + 1)
+            cum_weights.append(total)
+        return lambda: values[min(bisect.bisect(cum_weights, rng.random() * total), len(values) - 1)]
+
+    def _count(self, minimum=1, maximum=None):
+        """ Function drawing a number of array items in [minimum, maximum], mostly `minimum`. """
+        rng = self.rng
+        maximum = max(minimum, self.max_items if maximum is None else min(maximum, self.max_items))
+        return lambda: minimum + int(rng.random() ** 3 * (maximum - minimum + 1))
+
+    def _compile(self, node, name):
+        """ Function making a random value of the schema `node` (of the field `name`), or None to leave it out. """
+        rng = self.rng
+        if name in FIELD_FACTORIES:
+            return FIELD_FACTORIES[name](self, node)
+        node_type = node.get('type')
+
+        if node_type == 'object' or (node_type is None and 'properties' in node):
+            properties = [(key, self._compile(value, '.'.join((name, key)) if name else key))
+                          for key, value in node.get('properties', {}).items()]
+            properties = [(key, make) for key, make in properties if make is not None]
+            required = set(node.get('required', [])) | {key for key, _ in properties
+                                                        if ('.'.join((name, key)) if name else key) in COMMON_FIELDS}
+            always = [(key, make) for key, make in properties if key in required]
+            optional = [(key, make) for key, make in properties if key not in required]
+            min_properties = min(node.get('minProperties', 0), len(properties))
+            rate = self.optional_rate
+
+            def make_object():
+                chosen = always + [prop for prop in optional if rng.random() < rate]
+                if len(chosen) < min_properties:
+                    chosen += rng.sample([prop for prop in optional if prop not in chosen], min_properties - len(chosen))
+                return {key: make() for key, make in chosen}
+            return make_object
+
+        if node_type == 'array':
+            items = node.get('items', {})
+            count = self._count(max(node.get('minItems', 1), 1), node.get('maxItems'))
+            if 'enum' in items and node.get('uniqueItems'):
+                pick = self._weighted(items['enum'])
+                distinct = len(items['enum'])
+
+                def make_unique_items():
+                    values = {}
+                    target = min(count(), distinct)
+                    for _ in range(4 * target):  # a few extra draws for repeats; fewer items is fine
+                        values[pick()] = None
+                        if len(values) == target:
+                            break
+                    return list(values)
+                return make_unique_items
+            make_item = self._compile(items, name)
+            if make_item is None:
+                return None
+            return lambda: [make_item() for _ in range(count())]
+
+        if 'enum' in node:
+            return self._weighted(node['enum'])
+        if node_type == 'string':
+            last = name.split('.')[-1]
+            if node.get('pattern') == '\\d{6}':  # region codes
+                return lambda: '{:06d}'.format(rng.randint(0, 999999))
+            if last in TEXT_FIELDS:
+                return lambda: ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))).capitalize()
+            return lambda: '{} {}'.format(rng.choice(WORDS), rng.randint(1, 9999))
+        if node_type in ('integer', 'number'):
+            minimum = node.get('minimum')
+            maximum = node.get('maximum')
+            if minimum is not None and maximum is not None:
+                return lambda: rng.randint(minimum, maximum)
+            if node_type == 'integer':
+                return lambda: int(rng.paretovariate(0.8))
+            return lambda: round(rng.paretovariate(0.8), 2)
+        if node_type == 'boolean':
+            return lambda: rng.random() < 0.5
+        return None
+
+    def incident(self):
+        """ One random incident, as a dict. """
+        return self._make()
+
+    def incidents(self, n):
+        """ Generate `n` random incidents. """
+        for _ in range(n):
+            yield self._make()
+
+
+def write_incidents(path, n, schema=None, seed=0, **kwargs):
+    """ Write `n` random incidents (see `IncidentGenerator`) to disk.
+
+    Parameters
+    ----------
+    path: str
+        A JSONL file (`.jsonl`, or `.jsonl.gz` to compress it), with one incident per line, or else a directory in which
+        to write one `<incident_id>.json` file per incident, like VCDB. Directories are created if needed.
+    n: int
+        Number of incidents
+    schema: dict, optional (default: None)
+        The VERIS schema. Defaults to the schema bundled with verispy.
+    seed: int (default: 0)
+        Seed of the random number generator
+    **kwargs:
+        Other parameters of `IncidentGenerator`
+
+    Returns
+    -------
+    list
+        Filenames to pass to `VERIS.json_to_df`
+    """
+    generator = IncidentGenerator(schema, seed=seed, **kwargs)
+    lower = path.lower()
+    if lower.endswith('.jsonl') or lower.endswith('.jsonl.gz'):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        opener = gzip.open if lower.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as f:
+            for incident in generator.incidents(n):
+                f.write(json.dumps(incident))
+                f.write('\n')
+        return [path]
+
+    os.makedirs(path, exist_ok=True)
+    filenames = []
+    for incident in generator.incidents(n):
+        filenames.append(os.path.join(path, '{}.json'.format(incident['incident_id'])))
+        with open(filenames[-1], 'w') as f:
+            json.dump(incident, f)
+    return filenames
@@ -0,0 +1,139 @@
+import json
+import operator
+
+
+# operator name -> function(field value, operand)
+OPERATORS = {
+    '==': operator.eq,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda value, operand: value in operand,
+    'startswith': lambda value, operand: isinstance(value, str) and value.startswith(operand),
+}
+NEGATED_OPERATORS = {'!=': '==', 'not in': 'in'}  # hold when no value of the field satisfies the operator they negate
+OPERATOR_NAMES = set(OPERATORS) | set(NEGATED_OPERATORS) | {'exists'}
+
+
+def field_values(incident, path):
+    """ The values of the dot-separated field `path` (e.g. `'asset.assets.variety'`) of a parsed incident.
+
+    Arrays met on the way are looked into item by item, and an array value contributes each of its items, so the
+    result is a flat list: empty if the field is missing.
+    """
+    nodes = [incident]
+    for key in path.split('.'):
+        values = []
+        for node in nodes:
+            if isinstance(node, dict) and key in node:
+                value = node[key]
+                if isinstance(value, list):
+                    values.extend(value)
+                else:
+                    values.append(value)
+        nodes = values
+    return nodes
+
+
+def _normalize_condition(path, condition):
+    """ (operator, operand) of the condition on field `path`. """
+    if isinstance(condition, tuple):
+        if len(condition) != 2 or condition[0] not in OPERATOR_NAMES:
+            raise ValueError('Condition on "{}" must be an (operator, value) tuple with one of the operators {}, got {!r}.'.format(
+                path, ', '.join(sorted(OPERATOR_NAMES)), condition))
+        return condition
+    if isinstance(condition, (set, frozenset)):
+        return 'in', sorted(condition, key=repr)  # in the same order in every interpreter, for `key`
+    if isinstance(condition, list):
+        return 'in', list(condition)
+    if callable(condition):
+        return 'call', condition
+    return '==', condition
+
+
+def _holds(values, op, operand):
+    if op == 'exists':
+        return bool(values) == bool(operand)
+    if op in NEGATED_OPERATORS:
+        return not _holds(values, NEGATED_OPERATORS[op], operand)
+    for value in values:
+        try:
+            if operand(value) if op == 'call' else OPERATORS[op](value, operand):
+                return True
+        except TypeError:  # e.g. comparing a string with a number: not a match
+            continue
+    return False
+
+
+class IncidentFilter(object):
+    """
+    Predicate on parsed (raw JSON) incidents, built from conditions on their fields.
+
+    An incident passes when every condition holds. A condition on a field inside arrays (such as
+    `asset.assets.variety`) holds when any of the field's values satisfies it; `!=` and `not in` hold when none does,
+    so they also hold when the field is missing, while every other condition then fails.
+
+    Parameters
+    ------------
+    conditions: dict
+        Dot-separated field name (as in the raw DataFrame, e.g. `'timeline.incident.year'`) to condition, one of:
+        an `(operator, value)` tuple, the operator being one of '==', '!=', '<', '<=', '>', '>=', 'in', 'not in',
+        'startswith' or 'exists' (with a value of True or False); a list or set of values, which the field must be one
+        of; a function of the field's value, returning True to keep the incident; or any other value, which the field
+        must equal.
+
+    Examples
+    --------
+    >>> IncidentFilter({'timeline.incident.year': ('>=', 2018), 'victim.industry': ('startswith', '52')})
+    """
+
+    def __init__(self, conditions):
+        if not isinstance(conditions, dict):
+            raise TypeError('Conditions must be a dict of field name to condition, got {}.'.format(type(conditions).__name__))
+        self.conditions = [(path, _normalize_condition(path, condition)) for path, condition in conditions.items()]
+
+    def __call__(self, incident):
+        for path, (op, operand) in self.conditions:
+            if not _holds(field_values(incident, path), op, operand):
+                return False
+        return True
+
+    def __repr__(self):
+        return 'IncidentFilter({!r})'.format(dict((path, condition) for path, condition in self.conditions))
+
+    def key(self):
+        """ A string identifying the filter (for cache keys), or None if it has function conditions. """
+        if any(op == 'call' for _, (op, _) in self.conditions):
+            return None
+        conditions = []
+        for path, (op, operand) in self.conditions:
+            if op in ('in', 'not in') and isinstance(operand, (list, tuple, set, frozenset)):
+                operand = sorted(operand, key=repr)  # membership does not depend on the order of the values
+            conditions.append([path, op, operand])
+        try:
+            return json.dumps(sorted(conditions), sort_keys=True)
+        except TypeError:  # values JSON cannot represent
+            return None
+
+
+def compile_where(where):
+    """ The predicate of a `where` parameter (see `VERIS.json_to_df`): an `IncidentFilter` of a dict of conditions,
+    or `where` itself if it is already a function of the incident (or None). """
+    if where is None or isinstance(where, IncidentFilter):
+        return where
+    if isinstance(where, dict):
+        return IncidentFilter(where)
+    if callable(where):
+        return where
+    raise TypeError('Parameter `where` must be a dict of conditions or a function of the incident, got {}.'.format(
+        type(where).__name__))
+
+
+def where_key(where):
+    """ String identifying a compiled `where` for cache keys: '' for no filter, None if it cannot be identified. """
+    if where is None:
+        return ''
+    if isinstance(where, IncidentFilter):
+        return where.key()
+    return None
@@ -1,16 +1,339 @@
 import pandas as pd
 import numpy as np
 import json
-import requests
-import glob
 import warnings
-import os
-from statsmodels.stats.proportion import proportion_confint
-import matplotlib.pyplot as plt
-from tqdm import tqdm
 
 from .utils import industry as industry_const
 from .utils import constants as veris_const
+from .utils import loaders
+from .utils import cache as veris_cache
+from .utils import schema as veris_schema
+from .utils import plan as veris_plan
+from .utils import similarity
+from .utils.minhash import MinHashIndex
+from .utils import query as veris_query
+from .utils.bitpack import BitPackedFrame
+from .utils.colindex import column_index
+from .utils.stats import PipelineStats
+from .utils.where import compile_where, where_key
+from . import __version__
+
+
+CROSSTAB_CHUNK_ROWS = 4096  # rows per float32 matrix product in `_row_crosstab`
+DEFAULT_STREAM_CHUNK_SIZE = 5000  # incidents per chunk of `VERIS.iter_json_to_df`
+MATRIX_COLUMN_CHUNK = 256  # columns converted at a time by `VERIS.df_to_matrix(sparse=True)`
+COMPACT_MAX_CATEGORY_FRACTION = 0.5  # string columns with at most this many distinct values per row become categoricals
+NUMERIC_INFERRED_TYPES = ('empty', 'integer', 'floating', 'mixed-integer-float', 'decimal')
+
+
+def _unique_items(items):
+    """ Deduplicate a list of enumeration values, keeping the first-seen order. """
+    return list(dict.fromkeys(items))
+
+
+def _expand_enum_column(values, items):
+    """ One-hot encode a raw column of enumeration values in a single pass.
+
+    A cell is True for an enumeration value if the cell is a list containing that value or a string equal to it. Any other
+    cell (NaN, numbers, dicts, ...) is False for every enumeration value.
+
+    Parameters
+    ----------
+    values: pd Series
+        Raw column from `_rawjson_to_df`
+    items: list
+        The enumeration values from the schema
+
+    Returns
+    -------
+    tuple
+        (boolean ndarray of shape (len(values), len(unique items)), list of unique items giving the column order)
+    """
+    items = _unique_items(items)
+    onehot = np.zeros((len(values), len(items)), dtype=bool, order='F')
+    if len(values) == 0 or len(items) == 0:
+        return onehot, items
+
+    # explode the lists so that each element gets its own entry, indexed by the position of the row it came from
+    exploded = pd.Series(np.asarray(values, dtype=object), dtype=object).explode()
+    rows = exploded.index.to_numpy()
+    vals = exploded.to_numpy(dtype=object)
+    is_str = np.fromiter((isinstance(val, str) for val in vals), dtype=bool, count=len(vals))
+    codes = pd.Index(items, dtype=object).get_indexer(vals[is_str])
+    found = codes >= 0
+    onehot[rows[is_str][found], codes[found]] = True
+
+    return onehot, items
+
+
+def _expand_variety_amount_column(values, variety_items, amount_items):
+    """ Expand a raw column of `{'variety': ..., 'amount': ...}` objects (e.g. `asset.assets`) in a single pass.
+
+    For each row and variety, the variety flag is True if any object (or plain string) in the row's list names that variety.
+    The amount is the `amount` of the first object naming that variety which has an amount (`True` if the first match is a
+    plain string), and None if there is no such object.
+
+    Parameters
+    ----------
+    values: pd Series
+        Raw column from `_rawjson_to_df`
+    variety_items: list
+        The enumeration values for the `.variety` columns
+    amount_items: list
+        The enumeration values for the `.amount` columns
+
+    Returns
+    -------
+    tuple
+        (boolean variety ndarray, unique variety items, object amount ndarray, unique amount items)
+    """
+    variety_items = _unique_items(variety_items)
+    amount_items = _unique_items(amount_items)
+    variety_lookup = {item: j for j, item in enumerate(variety_items)}
+    amount_lookup = {item: j for j, item in enumerate(amount_items)}
+
+    varieties = np.zeros((len(values), len(variety_items)), dtype=bool, order='F')
+    amounts = np.full((len(values), len(amount_items)), None, dtype=object)
+    amount_found = np.zeros(amounts.shape, dtype=bool)
+
+    for i, row in enumerate(values):
+        if not isinstance(row, list):
+            continue
+        for value in row:
+            if isinstance(value, dict):
+                variety = value.get('variety')
+                if not isinstance(variety, str):
+                    continue
+                j = variety_lookup.get(variety)
+                if j is not None:
+                    varieties[i, j] = True
+                k = amount_lookup.get(variety)
+                if k is not None and 'amount' in value and not amount_found[i, k]:
+                    amounts[i, k] = value['amount']
+                    amount_found[i, k] = True
+            elif isinstance(value, str):
+                j = variety_lookup.get(value)
+                if j is not None:
+                    varieties[i, j] = True
+                k = amount_lookup.get(value)
+                if k is not None and not amount_found[i, k]:
+                    amounts[i, k] = True
+                    amount_found[i, k] = True
+
+    return varieties, variety_items, amounts, amount_items
+
+
+def _bool_block(df, cols):
+    """ (rows, len(cols)) boolean array of the columns `cols` of a DataFrame or `BitPackedFrame`. """
+    if isinstance(df, BitPackedFrame):
+        return df.bool_block(cols)
+    return df[cols].to_numpy(dtype=bool)
+
+
+def _row_crosstab(block, masks, chunk_rows=CROSSTAB_CHUNK_ROWS):
+    """ counts[i, j] = number of rows where both `masks[:, i]` and `block[:, j]` are True.
+
+    This is the matrix product `masks.T @ block`. It is computed in float32 over chunks of `chunk_rows` rows, so it goes
+    through BLAS without converting the whole block at once, and is exact as long as a chunk has less than 2**24 rows.
+    """
+    counts = np.zeros((masks.shape[1], block.shape[1]), dtype=np.int64)
+    for start in range(0, block.shape[0], chunk_rows):
+        chunk_masks = masks[start:start + chunk_rows].astype(np.float32)
+        chunk_block = block[start:start + chunk_rows].astype(np.float32)
+        counts += np.rint(chunk_masks.T @ chunk_block).astype(np.int64)
+    return counts
+
+
+def _count_list(keep_list, use_unk=False):
+    """ Columns of `keep_list` that count towards n in `enum_summary`: all of them if `use_unk`, else the non-'Unknown' ones. """
+    return keep_list if use_unk else [col for col in keep_list if col.split('.')[-1].lower() != 'unknown']
+
+
+def _enum_counts(df, keep_lists, submasks, use_unk=False):
+    """ x and n of several boolean enumerations within each subset of rows of `submasks` (see `_by_submasks`).
+
+    Parameters
+    ----------
+    df: pd DataFrame or `BitPackedFrame`
+    keep_lists: list
+        For each enumeration, the list of its boolean columns
+    submasks: list
+        (by value, boolean row mask or None) pairs
+    use_unk: bool (default: False)
+        Count rows with only 'Unknown' values in n
+
+    Returns
+    -------
+    tuple
+        (x, n): x[i, j] is the number of rows of subset i where column j of the concatenated `keep_lists` is True, and
+        n[i, k] the number of rows of subset i where at least one column of `_count_list` of enumeration k is True.
+    """
+    cols = [col for keep_list in keep_lists for col in keep_list]
+    if submasks[0][1] is None and isinstance(df, BitPackedFrame):  # counted on the packed words, without unpacking
+        x_counts = df.count(cols)[None, :]
+        n_counts = np.array([[df.any_count(_count_list(keep_list, use_unk)) for keep_list in keep_lists]], dtype=np.int64)
+        return x_counts, n_counts
+
+    block = _bool_block(df, cols) if cols else np.zeros((df.shape[0], 0), dtype=bool)
+    counted = np.zeros((df.shape[0], len(keep_lists)), dtype=bool)
+    start = 0
+    for i, keep_list in enumerate(keep_lists):
+        counted_cols = set(_count_list(keep_list, use_unk))
+        positions = [start + pos for pos, col in enumerate(keep_list) if col in counted_cols]
+        if positions:
+            counted[:, i] = block[:, positions].any(axis=1)
+        start += len(keep_list)
+
+    if submasks[0][1] is None:
+        return block.sum(axis=0)[None, :], counted.sum(axis=0)[None, :]
+    masks = np.column_stack([mask for _, mask in submasks])
+    return _row_crosstab(block, masks), _row_crosstab(counted, masks)
+
+
+def _is_numeric_column(index, col):
+    """ Is `col` a numerical column (int, float, or the nullable and smaller types of `compact=True`), not boolean? """
+    if col not in index.position:
+        return False
+    dtype = index.dtype(col)
+    return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+
+
+def _by_submasks(df, by, index):
+    """ Subsets of the rows to summarize by, for `enum_summary`: returns (by, list of (by value, boolean row mask)).
+
+    Without a `by` (or if it matches nothing, in which case `by` is returned as None) there is a single subset, the
+    whole DataFrame, with a mask of None. Working with masks rather than sub-DataFrames avoids copying the DataFrame once
+    per `by` value, and works with `BitPackedFrame`s.
+    """
+    if not by:
+        return by, [(None, None)]
+    # need to be able to tell if "by" is already a column (like `timeline.incident.year`, or if we are looking at enumerations of it)
+    if _is_numeric_column(index, by):
+        by_values = df[by]
+        uniques = set(by_values.dropna())
+        return by, [(unique_val, (by_values == unique_val).to_numpy(dtype=bool, na_value=False)) for unique_val in uniques]
+    # check to see if `by` is an enumeration (should we do this check before the column check? Does it matter?)
+    by_list = index.bool_children(by)
+    if len(by_list) == 0:
+        warnings.warn('Could not find enumeration columns matching "by" value "{}". Ignoring this value at this time.'.format(by))
+        return None, [(None, None)]
+    return by, [(by_col, df[by_col].to_numpy(dtype=bool)) for by_col in by_list]
+
+
+def _bool_enum_dict(curby, keep_list, xs, count, use_unk):
+    """ Rows of an `enum_summary` for the boolean columns `keep_list`, with counts `xs` out of `count` incidents. """
+    enum_dict = {'by': [], 'enum': [], 'x': [], 'n': []}
+    for var, x in zip(keep_list, xs):
+        var_suff = var.split('.')[-1]
+        enum_dict['by'].append(curby)
+        enum_dict['enum'].append(var_suff)
+        enum_dict['x'].append(x)
+        if var_suff.lower() != 'unknown' or use_unk:
+            enum_dict['n'].append(count)
+        else:
+            enum_dict['n'].append(np.nan)
+    return enum_dict
+
+
+def _summary_frame(enum_dict, round_freq):
+    """ `enum_summary` DataFrame of one subset of rows, sorted by decreasing frequency. """
+    out_df = pd.DataFrame(enum_dict)
+    out_df['freq'] = np.round(out_df['x'] / out_df['n'], round_freq)
+    out_df.sort_values(by=['freq'], ascending=False, inplace=True)
+    out_df.reset_index(inplace=True, drop=True)
+    return out_df
+
+
+def _add_confint(out_df, ci_method, ci_level, round_freq):
+    """ Add the 'method', 'lower' and 'upper' confidence interval columns to an `enum_summary` DataFrame. """
+    from statsmodels.stats.proportion import proportion_confint  # slow to import: only when CIs are asked for
+    out_df['method'] = ci_method
+    out_df['lower'], out_df['upper'] = np.round(proportion_confint(out_df['x'], out_df['n'], alpha=1-ci_level, method=ci_method), round_freq)
+
+
+def _set_columns(df, columns):
+    """ Set several columns of `df` at once, from a dict of column name to values. Returns the DataFrame.
+
+    Existing columns are overwritten; new ones are added together as a single block, which is much faster (and leaves
+    a less fragmented DataFrame) than inserting them one by one.
+    """
+    new_columns = {}
+    for col, values in columns.items():
+        if col in df.columns:
+            df[col] = values
+        else:
+            new_columns[col] = values
+    if new_columns:
+        df[list(new_columns)] = pd.DataFrame(new_columns, index=df.index)
+    return df
+
+
+def _numeric_values(series):
+    """ Values of a numerical (or all-numbers object) column as a float array with NaN for missing values, else None. """
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return None
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) in NUMERIC_INFERRED_TYPES:
+        return series.to_numpy(dtype=float, na_value=np.nan)
+    return None
+
+
+def _compact_numeric(values, schema_type):
+    """ Smallest nullable integer (for whole-number 'integer' columns), float32 or float64 array holding `values` exactly. """
+    missing = np.isnan(values)
+    known = values[~missing]
+    if schema_type == 'integer' and np.all(np.isfinite(known)) and np.all(known == np.round(known)):
+        for dtype in (np.int8, np.int16, np.int32, np.int64):
+            info = np.iinfo(dtype)
+            if known.size == 0 or (known.min() >= info.min and known.max() <= info.max):
+                return pd.arrays.IntegerArray(np.where(missing, 0, values).astype(dtype), missing)
+    if np.array_equal(known.astype(np.float32), known):
+        return values.astype(np.float32)
+    return values
+
+
+def _compact_columns(df, schema_types):
+    """ Give the columns of `df` typed in the schema (see `SchemaPlan.schema_types`) compact dtypes.
+
+    'integer' columns of whole numbers become the smallest nullable integer type (`Int8` to `Int64`) that holds them,
+    and other numerical columns float32 where it represents every value exactly. String columns with few distinct
+    values (see `COMPACT_MAX_CATEGORY_FRACTION`) become categoricals. Columns holding anything else (such as lists),
+    boolean columns and columns not in `schema_types` are left as they are.
+    """
+    columns = {}
+    for col, schema_type in schema_types.items():
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if schema_type in ('integer', 'number'):
+            values = _numeric_values(series)
+            if values is not None:
+                columns[col] = _compact_numeric(values, schema_type)
+        elif schema_type == 'string' and not isinstance(series.dtype, pd.CategoricalDtype):
+            if series.isna().all():  # e.g. an empty categorical after a concatenation
+                columns[col] = pd.Categorical([None] * len(series), categories=pd.Index([], dtype=object))
+            elif series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == 'string' and \
+                    series.nunique() <= COMPACT_MAX_CATEGORY_FRACTION * len(series):
+                columns[col] = pd.Categorical(series)
+    if not columns:
+        return df
+    out_df = pd.concat([df.drop(columns=list(columns)), pd.DataFrame(columns, index=df.index)], axis=1)
+    return out_df[df.columns]
+
+
+def _conform_columns(df, columns, dtypes):
+    """ Reindex `df` to `columns` and cast them to their nominal `dtypes` (see `SchemaPlan.dtypes`).
+
+    Missing columns are filled as in `VERIS._combine_enums_raw_df`: False for booleans, NaN for numbers and categories
+    (such as `pattern`) and None otherwise. Columns without a nominal dtype are left as they are.
+    """
+    fillers = {'bool': False, 'float64': np.nan, 'category': np.nan, 'object': None}
+    df = _set_columns(df, {col: fillers[dtypes.get(col, 'object')] for col in columns if col not in df.columns})[columns]
+    casts = {col: dtypes[col] for col in columns if col in dtypes and df[col].dtype != dtypes[col]}
+    if casts:
+        df = df.astype(casts)
+    return df
 
 
 class VERIS(object):
@@ -23,18 +346,49 @@ class VERIS(object):
     Parameters
     ------------
     json_dir: str (default: None)
-        The directory where the VERIS-formatted JSON files are stored (locally).
+        The directory where the VERIS-formatted JSON files are stored (locally). Zip and tar archives of JSON files (`.zip`,
+        `.tar`, `.tar.gz`, `.tgz`) and JSONL files with one incident per line (`.jsonl`, `.jsonl.gz`) in the directory are
+        read as well, without extracting them. May also be the path of a single archive or JSONL file.
     verbose: bool (default: False) 
         Print status messages while processing
     schema_url: str (default: "https://raw.githubusercontent.com/vz-risk/veris/master/verisc-merged.json")
         URL where VERIS schema lives.
+    schema_cache_dir: str, optional (default: `$XDG_CACHE_HOME/verispy` or `~/.cache/verispy`)
+        Directory in which to keep a copy of the schema downloaded from `schema_url`. If None, the schema is downloaded on
+        every call to `load_schema`. If the download fails, the cached copy (or else the schema bundled with verispy)
+        is used instead, with a warning. The default is looked up when the object is created.
+    schema_ttl: float (default: 86400)
+        Number of seconds a downloaded schema is used before checking `schema_url` for a newer one. The check uses
+        a conditional request, so an unchanged schema is not downloaded again.
+    schema_timeout: float (default: 10)
+        Timeout, in seconds, for downloading the schema.
+    cache_dir: str, optional (default: None)
+        Directory in which to cache the DataFrames built by `json_to_df`. If None, no caching is done. A cached DataFrame
+        is reused when the input files (names, sizes and modification times), the schema, the verispy version and the
+        `json_to_df` options are all unchanged.
+    cache_max_size: int (default: 2 GB)
+        Maximum size of the cache directory in bytes. The least recently used DataFrames are evicted beyond this size.
+    cache_hash_contents: bool (default: False)
+        Identify the input files by a hash of their contents rather than their size and modification time. Slower, but
+        robust to files being rewritten in place.
+    industry_depth: int (default: 3)
+        Deepest level of the NAICS victim industry columns: `victim.industry2` and `victim.industry3` are always built,
+        and `victim.industry4` up to `victim.industry6` (the first 4 to 6 digits of `victim.industry`) on request.
+    stats_observer: callable, optional (default: None)
+        Called with the statistics of each stage of `json_to_df`, `iter_json_to_df` and `update_df` (a dict, see
+        `verispy.utils.stats.PipelineStats`) as soon as the stage finishes, e.g. to forward them to a metrics system.
+        The statistics of the last run are also kept in the `stats` attribute.
     """
 
-    def __init__(self, json_dir=None, verbose=True, schema_url=veris_const.SCHEMA_URL):
+    def __init__(self, json_dir=None, verbose=True, schema_url=veris_const.SCHEMA_URL,
+                 schema_cache_dir=veris_schema.DEFAULT_CACHE_DIR, schema_ttl=veris_schema.DEFAULT_SCHEMA_TTL,
+                 schema_timeout=veris_schema.DEFAULT_SCHEMA_TIMEOUT, cache_dir=None,
+                 cache_max_size=veris_cache.DEFAULT_MAX_SIZE, cache_hash_contents=False, industry_depth=3,
+                 stats_observer=None):
 
         self.json_dir = json_dir
         if json_dir:  # build when building data frame
-            self.filenames = glob.glob(os.path.join(json_dir, '*.json'))
+            self.filenames = loaders.find_sources(json_dir)
             if verbose: print('Found {} json files.'.format(len(self.filenames)))
             if len(self.filenames) == 0:
                 warnings.warn('Heads up!! No valid json files found in specified directory!')
@@ -42,24 +396,52 @@ class VERIS(object):
             self.filenames = []
         
         self.schema_url = schema_url 
+        if schema_cache_dir is veris_schema.DEFAULT_CACHE_DIR:  # looked up now, not when verispy was imported
+            schema_cache_dir = veris_schema.default_cache_dir()
+        self.schema_cache = veris_schema.SchemaCache(schema_cache_dir, schema_ttl, schema_timeout)
+        self.schema_source = None
 
         self.raw_df = None
         self.data = None
         self.enumerations = None
         self.vschema = None
+        self.plan = None
         self.schema_path = None
         self.matrix_enums = veris_const.MATRIX_ENUMS
         self.matrix_ignore = veris_const.MATRIX_IGNORE
+        self.matrix_columns = None
+        self.matrix_incident_ids = None
+        self.matrix_scaling = None
         self.industry_by_title = industry_const.INDUSTRY_BY_TITLE
         self.verbose = verbose
-
-    def _rawjson_to_df(self, filenames):
+        self.cache = veris_cache.DataFrameCache(cache_dir, cache_max_size) if cache_dir else None
+        self.cache_hash_contents = cache_hash_contents
+        if not 3 <= industry_depth <= industry_const.MAX_INDUSTRY_DEPTH:
+            raise ValueError('industry_depth must be between 3 and {}, got {}.'.format(industry_const.MAX_INDUSTRY_DEPTH, industry_depth))
+        self.industry_depth = industry_depth
+        self.stats_observer = stats_observer
+        self.stats = PipelineStats(stats_observer)
+
+    def _rawjson_to_df(self, filenames, workers=1, chunksize=None, use_processes=False, fast_json=False, where=None,
+                       fields=None):
         """ Take a directory of VERIS-formatted JSON data and convert it to Pandas data frame.
 
         Parameters
         ----------
         filenames: list
             Filenames of VERIS-schema files to open
+        workers: int (default: 1)
+            Number of threads (or processes) used to read and parse the files. The default of 1 reads serially.
+        chunksize: int, optional (default: None)
+            Number of files handed to each worker at once. See `verispy.utils.loaders.load_json_files`.
+        use_processes: bool (default: False)
+            Use a process pool rather than a thread pool when `workers` > 1.
+        fast_json: bool (default: False)
+            Parse the files with `orjson`, if it is installed.
+        where: dict or callable, optional (default: None)
+            Only keep the incidents matching these conditions on their raw JSON fields. See `json_to_df`.
+        fields: list, optional (default: None)
+            Only keep these fields of the incidents (see `verispy.utils.loaders.load_json_files`)
 
         Returns
         -------
@@ -68,12 +450,8 @@ class VERIS(object):
         """
         verbose = self.verbose
         if verbose: print('Loading JSON files to DataFrame.')
-        jsons = []
-        t = tqdm(filenames) if verbose else filenames
-        for j in t:
-            with open(j, 'r') as f:
-                jf = json.load(f)
-            jsons.append(jf)
+        jsons = loaders.load_json_files(filenames, workers=workers, chunksize=chunksize, use_processes=use_processes,
+                                        fast_json=fast_json, verbose=verbose, where=compile_where(where), fields=fields)
         df_comb = pd.json_normalize(jsons)
         if verbose: print('Finished loading JSON files to dataframe.')
 
@@ -133,7 +511,7 @@ class VERIS(object):
         return outlist
 
 
-    def _combine_enums_raw_df(self, enums, non_enums, raw_df):
+    def _combine_enums_raw_df(self, enums, non_enums, raw_df, raw_columns=None):
         """ Combine the raw DataFrame with the enumerations from that DataFrame
 
         Parameters
@@ -144,6 +522,8 @@ class VERIS(object):
              The non-enumeration variables
         raw_df: pd DataFrame
             Output of `_rawjson_to_df`
+        raw_columns: list, optional (default: None)
+            The columns of `raw_df` to use; defaults to all of them (see `verispy.utils.plan.Projection.uses_raw`)
 
         Returns
         -------
@@ -152,76 +532,55 @@ class VERIS(object):
         """
         verbose = self.verbose
 
-        # function to check the enumerations in the raw dataframe and set to True-False
-        def enum_checker(dfitem, enumitem):
-            if isinstance(dfitem, list):
-                if enumitem in dfitem:
-                    return True
-            elif isinstance(dfitem, str):
-                if enumitem == dfitem:
-                    return True
-            return False
-
-        def var_amt_enum_checker(dfitem, enumitem, variety_or_amt):  
-            if isinstance(dfitem, list):
-                for value in dfitem:
-                    if isinstance(value, dict) and variety_or_amt in value.keys() and value['variety'] == enumitem:
-                        if variety_or_amt == 'variety':  
-                            return True
-                        elif variety_or_amt == 'amount':
-                            return value[variety_or_amt]
-                    if isinstance(value, str): 
-                        if value == enumitem:
-                            return True
-
-            # if found nothing, return value depends on whether this is a variety or amount
-            return False if variety_or_amt == 'variety' else None
-
-
-        comb_df = pd.DataFrame()
-        top_level_enums = [enum for enum in enums]
+        # collect every column first and build the DataFrame once at the end; inserting thousands of columns
+        # one at a time fragments the frame and is very slow
+        columns = {}
         if verbose: print('Building enumeration columns.')
-        t = tqdm(raw_df.columns) if verbose else raw_df.columns
+        if verbose:
+            from tqdm import tqdm
+        if raw_columns is None:
+            raw_columns = raw_df.columns
+        t = tqdm(raw_columns) if verbose else raw_columns
         for col in t:
-            if col in top_level_enums:
+            if col in enums:
                 # go through the enumerations
-                for item in enums[col]:
-                    newvarname = '.'.join((col, item))
-                    comb_df[newvarname] = raw_df[col].apply(lambda x: enum_checker(x, item))
+                onehot, items = _expand_enum_column(raw_df[col], enums[col])
+                for j, item in enumerate(items):
+                    columns['.'.join((col, item))] = onehot[:, j]
             elif col in veris_const.VARIETY_AMT_ENUMS:  # handle "variety" and "amount" pairs separately
-                for variety_or_amt in veris_const.VARIETY_AMT:
-                    enum_var_or_amt = '.'.join((col, variety_or_amt))
-                    for item in enums[enum_var_or_amt]:
-                        newvarname = '.'.join((enum_var_or_amt, item))
-                        comb_df[newvarname] = raw_df[col].apply(lambda x: var_amt_enum_checker(x, item, variety_or_amt))
+                variety_enum, amount_enum = ['.'.join((col, variety_or_amt)) for variety_or_amt in veris_const.VARIETY_AMT]
+                varieties, variety_items, amounts, amount_items = _expand_variety_amount_column(
+                    raw_df[col], enums[variety_enum], enums[amount_enum])
+                for j, item in enumerate(variety_items):
+                    columns['.'.join((variety_enum, item))] = varieties[:, j]
+                for j, item in enumerate(amount_items):
+                    # let pandas infer the dtype of the amounts (int, float or object), as `Series.apply` would
+                    columns['.'.join((amount_enum, item))] = pd.Series(amounts[:, j], index=raw_df.index).infer_objects()
             else:
-                comb_df[col] = raw_df[col]
+                columns[col] = raw_df[col]
 
         # now add in the rest of the enumerations
-        comb_df_cols = comb_df.columns
         for enum in enums:
             for suffix in enums[enum]:
                 var = '.'.join((enum, suffix))
-                if var not in comb_df_cols:
-                    comb_df[var] = False
+                if var not in columns:
+                    columns[var] = False
 
         # add in the variables which were not enumerations
-        comb_df_cols = comb_df.columns
         for vardict in non_enums:
             varname = vardict['name']
             vartype = vardict['type']
-            if varname not in comb_df_cols:  # only add the columns in that haven't already been added
-                if vartype == 'string':
-                    comb_df[varname] = None
-                elif vartype == 'integer' or vartype == 'number':
-                    comb_df[varname] = np.nan
+            if varname not in columns:  # only add the columns in that haven't already been added
+                if vartype == 'integer' or vartype == 'number':
+                    columns[varname] = np.nan
                 else:
-                    comb_df[varname] = None 
+                    columns[varname] = None
 
+        comb_df = pd.DataFrame(columns, index=raw_df.index)
 
         return comb_df
 
-    def _aggregate_a4s(self, df):
+    def _aggregate_a4s(self, df, projection=None):
         """ Add in the A4 Names; apply OR operation to the binary vars making up the a4(A4: http://veriscommunity.net/a4grid.html).
 
         This function is normally called from `json_to_df` and should not be called individually.
@@ -230,95 +589,243 @@ class VERIS(object):
         ----------
         df: pd DataFrame 
             DataFrame following from `self._combine_enums_raw_df`
+        projection: Projection, optional (default: None)
+            Only add the A4 names of this `verispy.utils.plan.Projection`
 
         Returns
         -------
         pd DataFrame 
             With A4 names and values added in.
         """
-
-        revassetmap = {veris_const.ASSETMAP[key]: key for key in veris_const.ASSETMAP}
-
-        for name in veris_const.A4NAMES:
-            if name.startswith('asset'):
-                assetdict = veris_const.A4NAMES[name]
-                varname = '.'.join((name, 'variety'))
-                for suffix in assetdict['variety']:
-                    fullname = '.'.join((varname, suffix))
-                    searchname = '.'.join((name, 'assets.variety', revassetmap[suffix]))
-                    df[fullname] = df[[col for col in df.columns if col.startswith(searchname)]].sum(axis=1)
-                    df[fullname] = df[fullname].apply(lambda x: True if x >= 1 else False)
+        # the columns making up each A4 name are worked out once per schema; see `verispy.utils.plan.SchemaPlan`
+        a4_groups = self._get_plan().a4_groups if projection is None else projection.a4_groups
+        index = column_index(df)
+
+        # lay the boolean columns out in one contiguous block, with the columns of each A4 name next to each other, so
+        # that most A4 names are an OR-reduction over a slice of the block
+        block_cols = list(dict.fromkeys(col for _, searchnames, _ in a4_groups for col in searchnames
+                                        if index.is_bool_column(col)))
+        block_pos = {col: i for i, col in enumerate(block_cols)}
+        block = df[block_cols].to_numpy(dtype=bool)
+
+        a4_cols = {}
+        for fullname, searchnames, negate in a4_groups:
+            positions = sorted(set(block_pos[col] for col in searchnames if col in block_pos))
+            if positions and positions[-1] - positions[0] + 1 == len(positions):
+                group_block = block[:, positions[0]:positions[-1] + 1]
             else:
-                for suffix in veris_const.A4NAMES[name]:
-                    fullname = '.'.join((name, suffix))
-                    searchname = fullname.lower()
-                    searchnames = ['.'.join((attr, suffix)) for attr in self.enumerations \
-                                   for suffix in self.enumerations[attr] if attr.startswith(searchname)]
-
-                    df[fullname] = df[searchnames].sum(axis=1)
-                    if fullname == 'attribute.Confidentiality':
-                        # Need to remove attribute.confidentiality.data_disclosure.No
-                        # and attribute.confidentiality.data_disclosure.Unknown from sum/searchlist
-                        # Unsure if I should leave in attribute.confidentiality.data_disclosure.Potentially.  Will do so for now.
-                        #  Note: after testing both ways, it doesn't much matter, because `True`s get summed over the partial values too. 
-                        searchnames.remove('attribute.confidentiality.data_disclosure.No')
-                        searchnames.remove('attribute.confidentiality.data_disclosure.Unknown')
-                        df[fullname] = df[searchnames].sum(axis=1)
-                    elif suffix == 'Unknown': # actor.Unknown, action.Unknown -- should be complement of other A4 enums in its class
-                        # get all other searchnames
-                        unk_searchnames = ['.'.join((name, suff.lower())) for suff in veris_const.A4NAMES[name] \
-                                           if suff != 'Unknown']
-                        unk_searchnames_long = ['.'.join((attr, suffix)) for attr in self.enumerations \
-                                                for suffix in self.enumerations[attr] \
-                                                for searchname in unk_searchnames \
-                                                if attr.startswith(searchname) ]
-                        df[fullname] = df[unk_searchnames_long].sum(axis=1)
-                        df[fullname] = -(df[fullname] - 1) # trick to get True/False working right
-                    
-                    # might have some numerical values that should just be True
-                    df[fullname] = df[fullname].apply(lambda x: True if x >= 1 else False)
+                group_block = block[:, positions]
+            other_cols = [col for col in searchnames if col not in block_pos]
+
+            if other_cols:
+                # amount columns (attribute.confidentiality.data.amount.*) count for their numerical value
+                total = group_block.sum(axis=1) + df[other_cols].sum(axis=1).to_numpy()
+                # actor.Unknown, action.Unknown -- should be complement of other A4 enums in its class
+                a4_cols[fullname] = np.asarray(total <= 0 if negate else total >= 1, dtype=bool)
+            else:
+                hits = group_block.any(axis=1)
+                a4_cols[fullname] = ~hits if negate else hits
 
-        return df
+        return _set_columns(df, a4_cols)
 
-    def _victim_postproc(self, df):
+    def _victim_postproc(self, df, projection=None):
         """ Fill in the victim industries with the 2-digit and 3-digit enumerations columns, and additional information about organization size.
 
         Parameters
         ----------
         df: pd DataFrame 
             A processed data frame (from `json_to_df`) with a `victim.industry` column.
+        projection: Projection, optional (default: None)
+            Only add the industry and orgsize columns of this `verispy.utils.plan.Projection`
 
         Returns
         -------
         pd DataFrame 
-            Returns initial DataFrame, but with processed `victim.industry*` columns and orgsize columns.
+            Returns initial DataFrame, but with processed `victim.industry*` columns and orgsize columns. The industry
+            codes are looked up once per distinct code (see `verispy.utils.industry.IndustryIndex`).
         """
+        plan = self._get_plan()
+        industry_index = industry_const.INDUSTRY_INDEX
+        columns = {}
 
-        # get victim industry 2 and 3
-        df['victim.industry2'] = df['victim.industry'].apply(lambda x: str(x)[:2] if not pd.isnull(x) else None)
-        df['victim.industry3'] = df['victim.industry'].apply(lambda x: str(x)[:3] if not pd.isnull(x) else None)
+        if projection is None or projection.victim_industry:
+            # get victim industry 2, 3 (and deeper levels, up to `industry_depth`)
+            levels = industry_index.levels(df['victim.industry'], range(2, self.industry_depth + 1))
+            for level, prefixes in levels.items():
+                columns['victim.industry{}'.format(level)] = prefixes
 
-        # victim industry name
-        known_ind_codes = list(industry_const.INDUSTRY_BY_CODE.keys())
-        df['victim.industry.name'] = df['victim.industry2'].apply(
-            lambda x: industry_const.INDUSTRY_BY_CODE[x]['shorter'] if x in known_ind_codes else 'Unknown')
-        df['victim.industry.fullname'] = df['victim.industry2'].apply(
-            lambda x: industry_const.INDUSTRY_BY_CODE[x]['title'] if x in known_ind_codes else 'Unknown')
+            # victim industry name
+            columns['victim.industry.name'] = industry_index.names(levels[2], 'shorter')
+            columns['victim.industry.fullname'] = industry_index.names(levels[2], 'title')
 
-        # fill out the 2-digit code columns
-        for code in industry_const.INDUSTRY_BY_CODE.keys(): #df['victim.industry2'].unique():
-            colname = '.'.join(('victim.industry2', code))
-            df[colname] = df['victim.industry2'].apply(lambda x: True if x == code else False)
+            # fill out the 2-digit code columns
+            one_hot = industry_index.one_hot(levels[2], plan.industry_codes)
+            for i, colname in enumerate(plan.industry2_columns):
+                columns[colname] = one_hot[:, i]
 
         # partner industry
-        df['actor.partner.industry2'] = df['actor.partner.industry'].apply(lambda x: str(x)[:2] if not pd.isnull(x) else None)
+        if projection is None or projection.partner_industry:
+            columns['actor.partner.industry2'] = industry_index.levels(df['actor.partner.industry'], [2])[2]
 
         # next fill out orgsize
-        for orgsize, orgcols in veris_const.ORG_SMALL_LARGE.items():
-            df[orgsize] = df[[col for col in df.columns if col in orgcols]].sum(axis = 1)
-            df[orgsize] = df[orgsize].apply(lambda x: True if x >= 1 else False)
+        for orgsize, orgcols in (plan.orgsize_groups if projection is None else projection.orgsize_groups):
+            columns[orgsize] = _bool_block(df, orgcols).any(axis=1)
 
-        return df
+        return _set_columns(df, columns)
+
+    def _pattern_postproc(self, df, projection=None):
+        """ Classify the incidents into the DBIR patterns (first described in the 2014 DBIR), as in Jay Jacobs'
+        [getpatternlist.R](https://gist.github.com/jayjacobs/a145cb87551f551fc719).
+
+        An incident may match several patterns; its `pattern` is the first of them in the order of `veris_const.PATTERNS`.
+        Incidents matching none of the other patterns are "Everything Else". Every pattern is a vectorized boolean
+        expression over the enumeration columns, which are read in a single block. Enumeration columns that are not in
+        `df` (e.g. with an older schema) count as False.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            A processed data frame (from `json_to_df`) with the A4 columns (`action.Misuse`, ...).
+        projection: Projection, optional (default: None)
+            Leave the patterns out unless this `verispy.utils.plan.Projection` selects them
+
+        Returns
+        -------
+        pd DataFrame
+            Returns initial DataFrame, with a `pattern.<Name>` boolean column for each pattern, and a categorical
+            `pattern` column.
+        """
+        if projection is not None and not projection.patterns:
+            return df
+        plan = self._get_plan()
+        needed = veris_const.PATTERN_ENUMS
+        present = [col for col in needed if col in df.columns]
+        block = _bool_block(df, present)
+        missing = np.zeros(df.shape[0], dtype=bool)
+        enum = {col: block[:, i] for i, col in enumerate(present)}
+        enum = {col: enum.get(col, missing) for col in needed}
+
+        skimmer = enum['action.physical.variety.Skimmer'] | \
+                  (enum['action.physical.variety.Tampering'] & enum['attribute.confidentiality.data.variety.Payment'])
+        espionage = enum['actor.external.motive.Espionage'] | enum['actor.external.variety.State-affiliated']
+        pos = enum['asset.assets.variety.S - POS controller'] | enum['asset.assets.variety.U - POS terminal']
+        dos = enum['action.hacking.variety.DoS']
+        webapp = enum['action.hacking.vector.Web application'] & ~dos
+        misuse = enum['action.Misuse']
+        matched = skimmer | espionage | pos | dos | webapp | misuse
+        malware = enum['action.Malware'] & ~enum['action.malware.vector.Direct install'] & ~matched
+        theftloss = enum['action.error.variety.Loss'] | enum['action.physical.variety.Theft']
+        matched = matched | malware | theftloss
+        errors = enum['action.Error'] & ~matched
+        other = ~(matched | errors)
+
+        # in the order of `veris_const.PATTERNS`
+        patterns = np.column_stack([pos, webapp, misuse, theftloss, errors, malware, skimmer, dos, espionage, other])
+        columns = {col: patterns[:, i] for i, col in enumerate(plan.pattern_columns)}
+        # every incident matches at least one pattern ("Everything Else" if nothing else), so argmax finds the first
+        columns['pattern'] = pd.Categorical.from_codes(patterns.argmax(axis=1), categories=veris_const.PATTERNS)
+        return _set_columns(df, columns)
+
+    def _build_enumerations(self):
+        """ Get the schema plan for the loaded schema (`vschema`), and populate the `plan`, `enumerations` and `nonenum_vars` attributes.
+
+        Plans are compiled once per schema and shared between `VERIS` objects. See `verispy.utils.plan.SchemaPlan`.
+        """
+        self.plan = veris_plan.get_plan(self.vschema, self._enums_from_schema)
+        self.enumerations = self.plan.enumerations
+        self.nonenum_vars = self.plan.nonenum_vars
+
+    def _get_plan(self):
+        """ The schema plan for the loaded schema, building it if needed. """
+        if self.plan is None:
+            if self.vschema is None:
+                raise ValueError('No VERIS schema loaded. Run `load_schema` or `json_to_df` first.')
+            self._build_enumerations()
+        return self.plan
+
+    def _get_projection(self, include=None, exclude=None):
+        """ The `verispy.utils.plan.Projection` of `include` and `exclude` for the loaded schema, or None for every column. """
+        if include is None and not exclude:
+            return None
+        return veris_plan.Projection(self._get_plan(), include, exclude)
+
+    def _drop_duplicates(self, raw_df, seen_ids=None, stats=None):
+        """ De-duplicate rows of the raw DataFrame on `incident_id` -- a few duplicate instances may happen.
+
+        If a set `seen_ids` is given, rows with an `incident_id` in it are dropped as well, and the ids of the kept rows
+        are added to it (used to de-duplicate across the chunks of `iter_json_to_df`). The stage is recorded in the
+        `PipelineStats` `stats`, if given.
+        """
+        stats = PipelineStats() if stats is None else stats
+        with stats.stage('drop_duplicates') as record:
+            rows_before = raw_df.shape[0]
+            raw_df = raw_df.drop_duplicates(subset=['incident_id'])
+            if seen_ids is not None:
+                raw_df = raw_df[~raw_df['incident_id'].isin(seen_ids)]
+                seen_ids.update(raw_df['incident_id'])
+            rows_after = raw_df.shape[0]
+            record['dropped_duplicates'] = rows_before - rows_after
+            stats.set_shape(record, raw_df)
+        if self.verbose: print('Dropped {} rows with duplicated incident_id values.'.format(rows_before-rows_after))
+        return raw_df
+
+    def _build_df(self, raw_df, stats=None, projection=None):
+        """ Run a de-duplicated raw DataFrame through the enumeration, A4 and victim post-processing stages.
+
+        Parameters
+        ----------
+        raw_df: pd DataFrame
+            Output of `_rawjson_to_df`, de-duplicated on `incident_id`
+        stats: PipelineStats, optional (default: None)
+            Record the stages in these statistics
+        projection: Projection, optional (default: None)
+            Only build what the columns of this `verispy.utils.plan.Projection` need, and only return those columns
+
+        Returns
+        -------
+        pd DataFrame
+            The VERIS DataFrame, with its columns sorted alphabetically
+        """
+        verbose = self.verbose
+        stats = PipelineStats() if stats is None else stats
+
+        # build the enumerations
+        if verbose: print('Building DataFrame with enumerations.')
+
+        with stats.stage('enumerations') as record:
+            if projection is None:
+                comb_df = self._combine_enums_raw_df(self.enumerations, self.nonenum_vars, raw_df)
+            else:
+                raw_columns = [col for col in raw_df.columns if projection.uses_raw(col)]
+                comb_df = self._combine_enums_raw_df(projection.enumerations, projection.nonenum_vars, raw_df,
+                                                     raw_columns)
+            stats.set_shape(record, comb_df)
+
+        if verbose: print('Done building DataFrame with enumerations.')
+
+        # add in A4 names
+        if verbose: print('Post-Processing DataFrame (A4 Names, Victim Industries, Patterns)')
+        with stats.stage('a4_aggregation') as record:
+            comb_df = self._aggregate_a4s(comb_df, projection)
+            stats.set_shape(record, comb_df)
+
+        # victim industries
+        with stats.stage('victim_postproc') as record:
+            comb_df = self._victim_postproc(comb_df, projection)
+            stats.set_shape(record, comb_df)
+
+        # DBIR patterns
+        with stats.stage('patterns') as record:
+            comb_df = self._pattern_postproc(comb_df, projection)
+            stats.set_shape(record, comb_df)
+
+        # sort columns alphabetically, leaving out the columns only built for the projection's derived columns
+        with stats.stage('sort_columns') as record:
+            columns = comb_df.columns if projection is None else [col for col in comb_df.columns if projection.selects(col)]
+            comb_df = comb_df.reindex(sorted(columns), axis=1)
+            stats.set_shape(record, comb_df)
+
+        return comb_df
 
     def load_schema(self, schema_path=None, schema_url=None):
         """ Load the VERIS schema into the VERIS object
@@ -336,23 +843,25 @@ class VERIS(object):
         Return
         ------
         None
-            Schema is stored in the `self.vschema` attribute of the VERIS object 
+            Schema is stored in the `self.vschema` attribute of the VERIS object, and where it came from in `self.schema_source`
+            (see `verispy.utils.schema.SchemaCache.fetch`)
         """
         if schema_path:  # load from the local computer if possible
             self.schema_path = schema_path
             with open(schema_path, 'r') as f:
                 vschema = json.load(f)
+            self.schema_source = 'file'
         else:
             if schema_url:
                 self.schema_url = schema_url
-            r = requests.get(self.schema_url)
-            r.raise_for_status() # check for bad request
-            vschema = r.json()
-            #with urllib.request.urlopen(self.schema_url) as url:
-            #    vschema = json.loads(url.read().decode())
+            vschema, self.schema_source = self.schema_cache.fetch(self.schema_url)
+            if self.verbose: print('Loaded schema ({}).'.format(self.schema_source))
         self.vschema = vschema
+        self.plan = None  # rebuilt from the new schema when needed
 
-    def json_to_df(self, filenames=None, keep_raw=False, schema_path=None, schema_url=None, verbose=None):
+    def json_to_df(self, filenames=None, keep_raw=False, schema_path=None, schema_url=None, verbose=None,
+                   workers=1, chunksize=None, use_processes=False, fast_json=False, use_cache=True, packed=False,
+                   compact=False, where=None, include=None, exclude=None):
         """ Take a directory of VERIS-formatted JSON data and convert it to pd DataFrame
 
         This is the main data conversion function of the `verispy` package. It takes a directory full of VERIS-formatted JSON files and converts the files
@@ -367,6 +876,7 @@ class VERIS(object):
         ----------
         filenames: list, optional (default: None)
             List of filenames of VERIS-schema files to open, ideally from the local file system. Not needed if `json_dir` passed when object initialized.
+            Zip or tar archives of VERIS-schema files and JSONL files (optionally gzipped) may be given as well; see `json_dir`.
         keep_raw: bool (default: False)
             Keep the raw data frame, created before creating the enumerations?  If `True`, it is stored in the `raw_df` attribute in the current object.
         schema_path: str, optional (default: None)
@@ -376,11 +886,52 @@ class VERIS(object):
             the schema location may already be in the object.
         verbose: bool, (default: None)
             May be set here or upon object instantiation
+        workers: int (default: 1)
+            Number of threads (or processes, see `use_processes`) used to read and parse the JSON files. 
+            The resulting DataFrame is identical regardless of the number of workers.
+        chunksize: int, optional (default: None)
+            Number of files handed to each worker at once.
+        use_processes: bool (default: False)
+            Use a process pool rather than a thread pool when `workers` > 1.
+        fast_json: bool (default: False)
+            Parse the JSON files with `orjson` if it is installed; otherwise the standard library `json` module is used.
+        use_cache: bool (default: True)
+            Look up and store the DataFrame in the cache, if the object was created with a `cache_dir`. Since the raw
+            DataFrame is not cached, `keep_raw=True` always rebuilds the DataFrame (and then refreshes the cache entry).
+        packed: bool (default: False)
+            Return a `verispy.utils.bitpack.BitPackedFrame`, with the boolean columns packed into bits, rather than a DataFrame.
+            `enum_summary` and `df_to_matrix` accept either; use its `to_df` function to get the DataFrame.
+        compact: bool (default: False)
+            Store the columns that are not enumerations in compact dtypes picked from their schema type: the smallest
+            nullable integer type (e.g. `Int16` for `timeline.incident.year`) for integers such as years and counts,
+            float32 for numbers it holds exactly, and categoricals for strings with few distinct values (such as
+            `victim.state` or the victim industries). Uses much less memory, and speeds up grouping on those columns.
+        where: dict or callable, optional (default: None)
+            Only load the incidents matching these conditions on their raw JSON fields. Incidents are tested as soon as
+            they are parsed (in the workers, when there are several), and the others are discarded before any further
+            processing. Either a dict of dot-separated field name to condition, all of which must hold, such as
+            `{'timeline.incident.year': ('>=', 2018), 'victim.industry': ('startswith', '52')}` (see
+            `verispy.utils.where.IncidentFilter` for the conditions), or a function of the parsed incident (a dict)
+            returning True to keep it. With `use_processes`, the function must be picklable (defined at module level).
+            Duplicated incidents are dropped among the incidents that match. Results of a `where` with functions in it
+            are not cached.
+        include: list, optional (default: None)
+            Only build these columns: column name prefixes, each selecting a column and the columns under it (after a
+            dot), such as `['action', 'actor', 'asset.assets']`. Only the enumerations (and other schema variables and
+            raw fields) needed for them are expanded and filled in, so time and memory scale with the selection. The A4
+            names, organization sizes, victim industries and DBIR patterns are computed from the columns they depend on
+            even when those are not selected (e.g. `action.Hacking` from `action.hacking.*`). `incident_id` is always
+            included. The selected columns are the same as in the full DataFrame. See `verispy.utils.plan.Projection`.
+            Only the JSON fields that are needed are loaded, so the raw DataFrame (`keep_raw`) has just those.
+        exclude: list, optional (default: None)
+            Column name prefixes to leave out, even if they are under an `include` prefix.
         
         Returns
         -------
         pd DataFrame 
             The parsed, structured VERIS data. This function will also populate the `enumerations` attribute, which may be useful. 
+            The time and memory taken by each stage (schema load, raw load, de-duplication, enumerations, A4 aggregation,
+            victim post-processing, column sort) are recorded in the `stats` attribute (see `verispy.utils.stats.PipelineStats`).
         """
 
         # load schema
@@ -388,9 +939,12 @@ class VERIS(object):
             verbose = self.verbose
         else:
             self.verbose = verbose 
+        stats = self.stats = PipelineStats(self.stats_observer)
             
         if verbose: print('Loading schema')
-        self.load_schema(schema_path, schema_url)
+        with stats.stage('load_schema'):
+            self.load_schema(schema_path, schema_url)
+            self._build_enumerations()
 
         if not filenames:
             filenames = self.filenames
@@ -398,42 +952,258 @@ class VERIS(object):
         if len(filenames) == 0:
             warnings.warn('No valid JSON filenames passed to `json_to_df` function. This returns a Data Frame with 0 rows.')
 
-        raw_df = self._rawjson_to_df(filenames)
-
-        # de-duplicate rows -- a few duplicate instances may happen
-        rows_before = raw_df.shape[0]
-        raw_df = raw_df.drop_duplicates(subset=['incident_id'])
-        rows_after = raw_df.shape[0]
-        if verbose: print('Dropped {} rows with duplicated incident_id values.'.format(rows_before-rows_after))
+        where = compile_where(where)
+        projection = self._get_projection(include, exclude)
+        cache_key = None
+        if use_cache and self.cache is not None and where_key(where) is not None:
+            cache_key = self.cache.make_key(filenames, self.vschema, __version__, self.cache_hash_contents,
+                                            industry_depth=self.industry_depth, compact=compact, where=where_key(where),
+                                            include=include, exclude=exclude)
+            if not keep_raw:
+                with stats.stage('cache_load') as record:
+                    cached_df = self.cache.load(cache_key)
+                    record['hit'] = cached_df is not None
+                    if cached_df is not None:
+                        stats.set_shape(record, cached_df)
+                if cached_df is not None:
+                    if verbose: print('Loaded VERIS DataFrame from cache ({} hits, {} misses).'.format(
+                        self.cache.hits, self.cache.misses))
+                    return BitPackedFrame.from_df(cached_df) if packed else cached_df
+                if verbose: print('No cached VERIS DataFrame found ({} hits, {} misses).'.format(
+                    self.cache.hits, self.cache.misses))
+
+        with stats.stage('load_raw', files=len(filenames)) as record:
+            raw_df = self._rawjson_to_df(filenames, workers=workers, chunksize=chunksize, use_processes=use_processes,
+                                         fast_json=fast_json, where=where,
+                                         fields=None if projection is None else projection.raw_fields)
+            stats.set_shape(record, raw_df)
+
+        raw_df = self._drop_duplicates(raw_df, stats=stats)
 
         if keep_raw: self.raw_df = raw_df
 
-        # build the enumerations
-        if verbose: print('Building DataFrame with enumerations.')
+        comb_df = self._build_df(raw_df, stats, projection)
+        if compact:
+            with stats.stage('compact') as record:
+                comb_df = _compact_columns(comb_df, self.plan.schema_types)
+                stats.set_shape(record, comb_df)
 
-        enum_list = self._enums_from_schema(self.vschema, '', [])
-        self.enumerations = {item['name']: item['enumlist'] for item in enum_list if 'enumlist' in item}
-        self.nonenum_vars = [item for item in enum_list if 'enumlist' not in item]
+        if cache_key is not None:
+            with stats.stage('cache_store'):
+                self.cache.store(cache_key, comb_df)
+            if verbose: print('Saved VERIS DataFrame to cache.')
 
-        comb_df = self._combine_enums_raw_df(self.enumerations, self.nonenum_vars, raw_df)
+        if verbose: print('Finished building VERIS DataFrame')
 
-        if verbose: print('Done building DataFrame with enumerations.')
+        if packed:
+            with stats.stage('pack'):
+                return BitPackedFrame.from_df(comb_df)
+        return comb_df
 
-        # add in A4 names
-        if verbose: print('Post-Processing DataFrame (A4 Names, Victim Industries, Patterns)')
-        comb_df = self._aggregate_a4s(comb_df)
+    def iter_json_to_df(self, filenames=None, chunk_size=DEFAULT_STREAM_CHUNK_SIZE, columns=None, schema_path=None,
+                        schema_url=None, verbose=None, workers=1, chunksize=None, use_processes=False, fast_json=False,
+                        packed=False, compact=False, where=None, include=None, exclude=None):
+        """ Convert VERIS-formatted JSON files to DataFrames chunk by chunk, for collections too large to hold in memory
 
-        # victim industries
-        comb_df = self._victim_postproc(comb_df)
+        A generator version of `json_to_df`: the incidents are read `chunk_size` at a time, and each chunk is run through
+        the enumeration, A4 and victim post-processing stages and yielded before the next one is read. Every chunk has
+        the same columns, in the same order, with the dtypes determined by the schema (see `SchemaPlan.dtypes`), so the
+        chunks can be written to disk or aggregated one after the other. The index continues from one chunk to the next
+        and, as in `json_to_df`, only the first incident with a given `incident_id` is kept, across all chunks. Concatenated,
+        the chunks hold the same data as the `json_to_df` DataFrame restricted to `columns`, except that the amount
+        columns of a variety/amount object (e.g. `impact.loss.amount`) missing from every incident are None, not False.
 
-        # sort columns alphabetically
-        comb_df = comb_df.reindex(sorted(comb_df.columns), axis=1)
+        The schema is loaded when the first chunk is requested.
 
-        if verbose: print('Finished building VERIS DataFrame')
+        Parameters
+        ----------
+        filenames: list, optional (default: None)
+            List of filenames of VERIS-schema files to open. Not needed if `json_dir` passed when object initialized.
+        chunk_size: int (default: 5000)
+            Number of incidents to read and process at a time.
+        columns: list, optional (default: None)
+            Columns of every chunk. Defaults to the columns the schema determines (`self.plan.columns`, along with the
+            deeper industry columns of `industry_depth`); raw fields that are not in the schema (such as most of `plus`)
+            are only included if listed here. With `include` or `exclude`, the default is the selected columns.
+        schema_path, schema_url, verbose, workers, chunksize, use_processes, fast_json, packed, compact, where, include,
+        exclude:
+            See `json_to_df`. With `where`, every chunk is filled with matching incidents. With `compact`, the integer
+            and float dtypes and the categories of each chunk depend on the values in the chunk, so use
+            `pd.api.types.union_categoricals` (or `astype`) to combine chunks.
+
+        Yields
+        ------
+        pd DataFrame
+            The parsed, structured VERIS data of each chunk (or `BitPackedFrame` if `packed`). The `stats` attribute
+            records the stages of every chunk as they run, starting with the reading of its JSON (`read_json`).
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1, got {}.'.format(chunk_size))
+        if verbose is None:
+            verbose = self.verbose
+        else:
+            self.verbose = verbose
 
-        return comb_df
+        stats = self.stats = PipelineStats(self.stats_observer)
+
+        if verbose: print('Loading schema')
+        with stats.stage('load_schema'):
+            self.load_schema(schema_path, schema_url)
+            self._build_enumerations()
+
+        if not filenames:
+            filenames = self.filenames
+
+        if len(filenames) == 0:
+            warnings.warn('No valid JSON filenames passed to `iter_json_to_df` function. No DataFrames will be generated.')
+
+        plan = self._get_plan()
+        projection = self._get_projection(include, exclude)
+        if columns is None:
+            columns = sorted(plan.columns + ['victim.industry{}'.format(level) for level in range(4, self.industry_depth + 1)])
+            if projection is not None:
+                columns = [col for col in columns if projection.selects(col)]
+
+        seen_ids = set()
+        start = 0
+        chunks = loaders.iter_json_chunks(filenames, chunk_size, workers=workers, chunksize=chunksize,
+                                          use_processes=use_processes, fast_json=fast_json, where=compile_where(where),
+                                          fields=None if projection is None else projection.raw_fields)
+        for jsons in stats.timed('read_json', chunks):
+            if verbose: print('Processing incidents {} to {}.'.format(start + 1, start + len(jsons)))
+            with stats.stage('load_raw') as record:
+                raw_df = pd.json_normalize(jsons)
+                raw_df.index += start
+                stats.set_shape(record, raw_df)
+            start += len(jsons)
+            raw_df = self._drop_duplicates(raw_df, seen_ids, stats)
+            if raw_df.shape[0] == 0:
+                continue
+            # a variety/amount object (e.g. `impact.loss`) missing from a whole chunk would get False rather than None
+            # amounts. Treat it as present, so the amount columns are None (and object) in every chunk.
+            for col in veris_const.VARIETY_AMT_ENUMS:
+                if col not in raw_df.columns:
+                    raw_df[col] = np.nan
+
+            comb_df = self._build_df(raw_df, stats, projection)
+            with stats.stage('conform_columns') as record:
+                comb_df = _conform_columns(comb_df, columns, plan.dtypes)
+                if compact:
+                    comb_df = _compact_columns(comb_df, plan.schema_types)
+                stats.set_shape(record, comb_df)
+            yield BitPackedFrame.from_df(comb_df) if packed else comb_df
+
+        if verbose: print('Finished building VERIS DataFrames')
+
+    def update_df(self, df, filenames, schema_path=None, schema_url=None, verbose=None,
+                  workers=1, chunksize=None, use_processes=False, fast_json=False, compact=False, include=None,
+                  exclude=None):
+        """ Merge new or changed VERIS-formatted JSON files into a DataFrame built by `json_to_df`.
+
+        Only `filenames` are loaded and run through the enumeration, A4 and victim post-processing stages. Rows of `df`
+        with the same `incident_id` as one of the new incidents are replaced in place; incidents not yet in `df` are
+        appended at the end, in the order of `filenames`, with index labels continuing on from the end of `df`. As in
+        `json_to_df`, only the first of several of `filenames` with the same `incident_id` is kept.
+
+        When each of `filenames` is either a new incident or a modified version of a file `df` was built from, the
+        result is the same as rebuilding the DataFrame from all of the files with `json_to_df` (index included, for
+        a `df` with the default index). A file that duplicates the `incident_id` of a different file already in `df`
+        differs: `update_df` replaces the row with the new file, while a rebuild keeps the first of the two files.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            DataFrame from the `json_to_df` function. It is not modified.
+        filenames: list
+            Filenames of the added or modified VERIS-schema files
+        schema_path: str, optional (default: None)
+            Path to load the schema from, if no schema has been loaded into this object yet (see `json_to_df`).
+        schema_url: str, optional (default: None)
+            URL to load the schema from, if no schema has been loaded into this object yet (see `json_to_df`).
+        verbose: bool, (default: None)
+            May be set here or upon object instantiation
+        workers, chunksize, use_processes, fast_json:
+            Control how the JSON files are read. See `json_to_df`.
+        compact: bool (default: False)
+            Compact the dtypes of the result, as `json_to_df(compact=True)` does. Use it when `df` was built that way.
+        include, exclude: list, optional (default: None)
+            Only build the selected columns of the new incidents (see `json_to_df`). Pass the `include` and `exclude`
+            that `df` was built with.
+
+        Returns
+        -------
+        pd DataFrame
+            A new DataFrame with the added and updated incidents.
+        """
+        if verbose is None:
+            verbose = self.verbose
+        else:
+            self.verbose = verbose
+
+        if len(filenames) == 0:
+            return df.copy()
+        stats = self.stats = PipelineStats(self.stats_observer)
+
+        if self.enumerations is None or schema_path or schema_url:
+            if verbose: print('Loading schema')
+            with stats.stage('load_schema'):
+                self.load_schema(schema_path, schema_url)
+                self._build_enumerations()
+
+        projection = self._get_projection(include, exclude)
+        with stats.stage('load_raw', files=len(filenames)) as record:
+            raw_df = self._rawjson_to_df(filenames, workers=workers, chunksize=chunksize, use_processes=use_processes,
+                                         fast_json=fast_json, fields=None if projection is None else projection.raw_fields)
+            stats.set_shape(record, raw_df)
+        raw_df = self._drop_duplicates(raw_df, stats=stats)
+
+        # when a variety/amount object (e.g. `impact.loss`) is missing from every incident, its amount columns are
+        # filled with False rather than None. Make the old and new rows agree on whether it was present.
+        reset_amount_cols = []
+        for col in veris_const.VARIETY_AMT_ENUMS:
+            amount_cols = ['.'.join((col, 'amount', item)) for item in self.enumerations['.'.join((col, 'amount'))]]
+            amount_cols = [amount_col for amount_col in amount_cols if amount_col in df.columns]
+            old_present = any(df[amount_col].dtype != bool for amount_col in amount_cols)
+            if old_present and col not in raw_df.columns:
+                raw_df[col] = np.nan
+            elif col in raw_df.columns and not old_present:
+                reset_amount_cols.extend(amount_cols)
+
+        new_df = self._build_df(raw_df, stats, projection)
+
+        with stats.stage('merge') as record:
+            # new rows take the place of old rows with the same incident_id; the others go at the end
+            old_labels = pd.Series(df.index, index=df['incident_id'].values)
+            replaced = new_df['incident_id'].isin(old_labels.index).values
+            start = df.index.max() + 1 if df.shape[0] > 0 else 0
+            appended_labels = start + np.cumsum(~replaced) - 1  # only the appended rows take new labels
+            new_df.index = [old_labels[incident_id] if is_replaced else label
+                            for incident_id, is_replaced, label in zip(new_df['incident_id'], replaced, appended_labels)]
+            order = list(df.index) + list(new_df.index[~replaced])
+
+            kept_df = df[~df['incident_id'].isin(new_df['incident_id'])]
+            if reset_amount_cols:
+                kept_df = kept_df.copy()
+                for amount_col in reset_amount_cols:
+                    kept_df[amount_col] = None
+            out_df = pd.concat([kept_df, new_df], sort=False).loc[order]
+
+            # concatenating can leave object columns where a full rebuild would infer a numeric or boolean dtype
+            for col in out_df.columns:
+                if col in kept_df.columns and col in new_df.columns and kept_df[col].dtype == new_df[col].dtype:
+                    continue
+                if out_df[col].dtype == object:
+                    out_df[col] = out_df[col].infer_objects()
+
+            out_df = out_df.reindex(sorted(out_df.columns), axis=1)
+            if compact:
+                out_df = _compact_columns(out_df, self.plan.schema_types)
+            stats.set_shape(record, out_df)
+        if verbose: print('Updated {} rows and added {} rows.'.format(replaced.sum(), (~replaced).sum()))
+
+        return out_df
 
-    def df_to_matrix(self, df, bools_only=True):
+    def df_to_matrix(self, df, bools_only=True, sparse=False, columns=None, scaling=None):
         """ Convert VERIS DataFrame to binary matrix for clustering
 
         This function takes a DataFrame obtained through the `json_to_df` function and converts it to a numpy
@@ -441,35 +1211,218 @@ class VERIS(object):
 
         To change the default variables filtered on, the user can change the `matrix_enums` or `matrix_ignore` attributes.  
 
+        The column names and the `incident_id` of each row of the matrix are stored in the `matrix_columns` and
+        `matrix_incident_ids` attributes, and the scale of the numerical columns in `matrix_scaling`. Pass `columns` and
+        `scaling` back in to convert another DataFrame (for example a new chunk of incidents) consistently.
+
         Parameters
         ----------
         df: pd DataFrame 
-            DataFrame returned by `json_to_df` function
+            DataFrame (or `BitPackedFrame`) returned by `json_to_df` function
         bools_only: bool (default: True)
-            Whether to return just the boolean enumerations. If False, will scale numerical values. At this time, `False` logic not yet implemented
+            Whether to return just the boolean enumerations. If False, the numerical columns (such as the asset amounts)
+            are included as well, divided by their maximum absolute value so they lie in [-1, 1]. Missing values are 0.
+        sparse: bool (default: False)
+            Return a `scipy.sparse` CSR matrix, of int8 if it only has boolean columns and float32 otherwise, rather
+            than a dense array. The matrix is built a few columns at a time, without making a dense copy of it.
+        columns: list, optional (default: None)
+            Columns of the matrix, for example the `matrix_columns` of a previous call. Columns missing from `df` are all
+            zeros. By default, the columns are chosen with `matrix_enums`, `matrix_ignore` and `bools_only`.
+        scaling: dict, optional (default: None)
+            Scale (column name to divisor) of the numerical columns, for example the `matrix_scaling` of a previous call.
+            Numerical columns not in `scaling` are scaled by their maximum absolute value in `df`.
 
         Returns
         -------
-        np ndarray
-            Array of 0-1 values for False-True, and scaled numerical values.
+        np ndarray or scipy.sparse.csr_matrix
+            Array of 0-1 values for False-True, and scaled numerical values. Columns are in the order of the DataFrame's
+            columns (or of `columns`).
         """
-
-        if bools_only:
-            boolvars = [col for col in df.columns if df[col].dtype == bool]
-            cols_enums = set([col for enum in self.matrix_enums for col in boolvars if col.startswith(enum)])
-            ignore_enums = set([enum for ignore in self.matrix_ignore for enum in cols_enums if ignore in enum])
-            keep_cols = list(cols_enums.difference(ignore_enums))
-            matrix = np.array(df[keep_cols]).astype(int)
-            # do we need to save off incident_id or anything like that?
+        index = column_index(df)
+        numeric = {}  # numerical column -> float values
+        if columns is None:
+            cols_enums = set(col for enum in self.matrix_enums for col in index.startswith(enum))
+            keep_cols = []
+            for col in index.columns:
+                if col not in cols_enums or any(ignore in col for ignore in self.matrix_ignore):
+                    continue
+                if index.is_bool_column(col):
+                    keep_cols.append(col)
+                elif not bools_only:
+                    values = _numeric_values(df[col])
+                    if values is not None:
+                        keep_cols.append(col)
+                        numeric[col] = values
+        else:
+            keep_cols = list(columns)
+            for col in keep_cols:
+                if col in index.position and not index.is_bool_column(col):
+                    values = _numeric_values(df[col])
+                    if values is None:
+                        raise ValueError('Column "{}" is neither boolean nor numerical.'.format(col))
+                    numeric[col] = values
+
+        scaling = dict(scaling or {})
+        for col, values in numeric.items():
+            if col not in scaling:
+                scale = np.nanmax(np.abs(values)) if np.any(~np.isnan(values)) else 0
+                scaling[col] = float(scale) if scale > 0 else 1.0
+
+        if sparse:
+            from scipy import sparse as scipy_sparse
+            dtype = np.float32 if numeric else np.int8
         else:
-            raise NotImplementedError('The bools_only=False logic is not yet implemented.')
-            # with the keep_cols, we need to hold on to the order of those columns *and* their types, as well as scaling
-            # factors if and when we implement that part of the code.  This would be helpful in many ways because
-            # it would allow us to perhaps pull out sections of the data and matricize it, and then find the "average" for 
-            # columns of interest.   
+            dtype = float if numeric else int
+        # a dense matrix is built in one go; a sparse one a few columns at a time, to bound the dense temporary
+        col_chunk = MATRIX_COLUMN_CHUNK if sparse else max(len(keep_cols), 1)
+        blocks = []
+        for start in range(0, len(keep_cols), col_chunk):
+            chunk_cols = keep_cols[start:start + col_chunk]
+            block = np.zeros((df.shape[0], len(chunk_cols)), dtype=dtype)
+            bool_positions = [i for i, col in enumerate(chunk_cols) if index.is_bool_column(col)]
+            if bool_positions:
+                block[:, bool_positions] = _bool_block(df, [chunk_cols[i] for i in bool_positions])
+            for i, col in enumerate(chunk_cols):
+                if col in numeric:
+                    block[:, i] = np.nan_to_num(numeric[col] / scaling[col])
+            blocks.append(scipy_sparse.csc_matrix(block) if sparse else block)
+
+        if sparse:
+            matrix = (scipy_sparse.hstack(blocks, format='csr', dtype=dtype) if blocks
+                      else scipy_sparse.csr_matrix((df.shape[0], 0), dtype=dtype))
+        else:
+            matrix = blocks[0] if blocks else np.zeros((df.shape[0], 0), dtype=dtype)
+
+        self.matrix_columns = np.array(keep_cols, dtype=object)
+        self.matrix_incident_ids = (df['incident_id'].to_numpy() if 'incident_id' in df.columns
+                                    else df.index.to_numpy())
+        self.matrix_scaling = scaling
 
         return matrix
 
+    def nearest_neighbors(self, df, k=10, metric='jaccard', bools_only=True, block_size=similarity.DEFAULT_BLOCK_SIZE, workers=1):
+        """ Find the `k` most similar incidents of every incident
+
+        The distances are computed on the `df_to_matrix` matrix of the DataFrame, a block of incidents at a time, so
+        memory use grows with the number of incidents rather than its square. See `verispy.utils.similarity`.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            DataFrame (or `BitPackedFrame`) from the `json_to_df` function
+        k: int (default: 10)
+            Number of neighbours of each incident
+        metric: str (default: 'jaccard')
+            One of 'jaccard', 'hamming' or 'cosine'
+        bools_only: bool (default: True)
+            See `df_to_matrix`. The numerical columns only make a difference with the 'cosine' metric.
+        block_size: int (default: 256)
+            Number of incidents whose distances to all the others are computed at once
+        workers: int (default: 1)
+            Number of threads computing the distances
+
+        Returns
+        -------
+        pd DataFrame
+            One row per incident and neighbour, with columns 'incident_id', 'rank' (1 for the nearest), 'neighbor_id'
+            and 'distance'
+        """
+        matrix = self.df_to_matrix(df, bools_only=bools_only, sparse=True)
+        indices, distances = similarity.top_k_neighbors(matrix, k, metric, block_size, workers)
+        incident_ids = self.matrix_incident_ids
+        return pd.DataFrame({'incident_id': np.repeat(incident_ids, indices.shape[1]),
+                             'rank': np.tile(np.arange(1, indices.shape[1] + 1), indices.shape[0]),
+                             'neighbor_id': incident_ids[indices.ravel()],
+                             'distance': distances.ravel()})
+
+    def pairwise_distances(self, df, metric='jaccard', path=None, bools_only=True, block_size=similarity.DEFAULT_BLOCK_SIZE,
+                           workers=1):
+        """ Distances between all pairs of incidents, in the condensed form of `scipy.spatial.distance.pdist`
+
+        Like `nearest_neighbors`, the distances are computed a block of incidents at a time. With `path`, they are written
+        to a `.npy` file as they are computed and returned memory-mapped, so the (incidents^2 / 2 floats) array does not
+        need to fit in memory. The incident of each row is in the `matrix_incident_ids` attribute.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            DataFrame (or `BitPackedFrame`) from the `json_to_df` function
+        metric: str (default: 'jaccard')
+            One of 'jaccard', 'hamming' or 'cosine'
+        path: str, optional (default: None)
+            `.npy` file to write the distances to
+        bools_only, block_size, workers:
+            See `nearest_neighbors`
+
+        Returns
+        -------
+        np ndarray or np memmap
+            float32 condensed distance array, which can be passed to `scipy.cluster.hierarchy.linkage`
+        """
+        matrix = self.df_to_matrix(df, bools_only=bools_only, sparse=True)
+        return similarity.condensed_distances(matrix, metric, path, block_size, workers)
+
+    def similarity_index(self, df, num_perm=128, bands=16, seed=0):
+        """ Build an index to look up the incidents most similar to a given one
+
+        The index holds a MinHash signature of the set of True `df_to_matrix` columns of every incident, and finds the
+        incidents with the highest Jaccard similarity to a query without comparing it to all of them. See
+        `verispy.utils.minhash.MinHashIndex`, and `similar_incidents` to query it.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            DataFrame (or `BitPackedFrame`) from the `json_to_df` function
+        num_perm: int (default: 128)
+            Number of hash functions in a signature
+        bands: int (default: 16)
+            Number of bands the signatures are cut into. More bands find less similar incidents, at the cost of slower
+            queries.
+        seed: int (default: 0)
+            Seed of the hash functions
+
+        Returns
+        -------
+        MinHashIndex
+        """
+        matrix = self.df_to_matrix(df, sparse=True)
+        index = MinHashIndex(self.matrix_columns, num_perm=num_perm, bands=bands, seed=seed)
+        index.add(self.matrix_incident_ids, matrix)
+        return index
+
+    def update_similarity_index(self, index, df):
+        """ Add the incidents of `df` to a `similarity_index`, replacing the ones with the same `incident_id`. """
+        matrix = self.df_to_matrix(df, sparse=True, columns=index.columns)
+        index.add(self.matrix_incident_ids, matrix)
+        return index
+
+    def similar_incidents(self, index, incident, k=10):
+        """ Find the incidents of a `similarity_index` most similar to `incident`
+
+        Parameters
+        ----------
+        index: MinHashIndex
+            Index from `similarity_index`
+        incident: str or dict
+            `incident_id` of an incident in the index, or a VERIS-formatted incident (parsed JSON). An incident is run
+            through the same enumeration, A4 and victim stages as in `json_to_df` first, with the schema already loaded
+            into this object.
+        k: int (default: 10)
+            Number of incidents to return
+
+        Returns
+        -------
+        pd DataFrame
+            Columns 'incident_id' and 'similarity' (Jaccard similarity), most similar first. Only incidents sharing
+            at least one band of their signature with `incident` are found, so fewer than `k` may be returned.
+        """
+        if isinstance(incident, dict):
+            self._get_plan()  # a schema is needed to build the incident's row
+            incident_df = self._build_df(pd.json_normalize([incident]))
+            incident = self.df_to_matrix(incident_df, sparse=True, columns=index.columns)
+        neighbors = index.query(incident, k)
+        return pd.DataFrame(neighbors, columns=['incident_id', 'similarity'])
+
     def enum_summary(self, df, enum, by=None, use_unk=False, ci_method=None, ci_level=0.95, round_freq=5):
         ''' Build summary DataFrame given a VERIS enumeration
 
@@ -481,7 +1434,7 @@ class VERIS(object):
         Parameters
         ----------
         df: pd DataFrame
-            DataFrame from the `json_to_df` function
+            DataFrame (or `BitPackedFrame`) from the `json_to_df` function
         enum: string
             VERIS feature or enumeration to summarize
         by: string, optional (default: None)
@@ -508,87 +1461,164 @@ class VERIS(object):
         '''
         
         # get all the variables that start with enum (`enum.`) and only keep the ones that are length 1 longer and boolean:
-
-        if enum in df.columns and df[enum].dtype in ['int', 'float']:
+        index = column_index(df)
+        if _is_numeric_column(index, enum):
             enum_is_col = True
             keep_list = list(set(df[enum]))
         else:
             enum_is_col = False
-            enum_len = len(enum.split('.'))
-            keep_list = [col for col in df.columns if col.startswith('.'.join((enum, '')))]
-            keep_list = [col for col in keep_list if len(col.split('.')) == enum_len + 1]
-            keep_list = [col for col in keep_list if df[col].dtype == 'bool']
-        
-        if by: # split into sub-dataframes if there is a `by` parameters
-            # need to be able to tell if "by" is already a column (like `timeline.incident.year`, or if we are looking at enumerations of it)
-            if by in df.columns and df[by].dtype in ['int', 'float']:   # `by` is a column and an int or float
-                uniques = set(df[by])
-                # remove nans
-                uniques = {x for x in uniques if x==x}
-                subdfs = [(unique_val, df[df[by] == unique_val]) for unique_val in uniques]
-            else:  # check to see if `by` is an enumeration (should we do this check before the column check? Does it matter?)
-                by_len = len(by.split('.'))
-                by_list = [col for col in df.columns if col.startswith('.'.join((by, '')))]
-                by_list = [col for col in by_list if len(col.split('.')) == by_len + 1]
-                by_list = [col for col in by_list if df[col].dtype == 'bool']
-                if len(by_list) == 0:
-                    warnings.warn('Could not find enumeration columns matching "by" value "{}". Ignoring this value at this time.'.format(by))
-                    by = None
-                    subdfs = [(None, df)]
-                else:
-                    subdfs = [(by_col, df[df[by_col]]) for by_col in by_list]
+            keep_list = index.bool_children(enum)
+
+        by, submasks = _by_submasks(df, by, index)
+
+        # Calculate the enumerations. For boolean enumerations, x and n for every `by` value come from a single matrix
+        # product of the row masks with the enumeration block (see `_enum_counts`)
+        if enum_is_col:
+            # position of each row's value in keep_list (-1 for NaN or NA, which is never counted)
+            valid = [pos for pos, val in enumerate(keep_list) if pd.notna(val)]
+            codes = pd.Index([keep_list[pos] for pos in valid]).get_indexer(df[enum].to_numpy())
+            codes = np.where(codes >= 0, np.array(valid + [-1])[codes], -1)
+            x_counts, row_counts = [], []
+            for curby, mask in submasks:
+                row_codes = codes if mask is None else codes[mask]
+                x_counts.append(np.bincount(row_codes[row_codes >= 0], minlength=len(keep_list)))
+                row_counts.append(len(row_codes))
         else:
-            subdfs = [(None, df)]
-        
-        # Calculate the enumerations. Because of `subdfs` structure, doing whole dataframe or subsets can be done at once
+            x_counts, n_counts = _enum_counts(df, [keep_list], submasks, use_unk)
         outdfs = []
-        for curby, subdf in subdfs:
+        for i, (curby, mask) in enumerate(submasks):
             if enum_is_col:
-                count = subdf.shape[0]
-            else:
-                if use_unk:  # what if enum_is_col
-                    count = subdf[keep_list].any(axis=1).sum()
-                else:
-                    count = subdf[[col for col in keep_list if col.split('.')[-1].lower() != 'unknown']].any(axis=1).sum()
-
-            enum_dict = {'by': [], 'enum': [], 'x': [], 'n': []}
-            if enum_is_col:
-                for val in keep_list:
-                    num_this_val = subdf[subdf[enum] == val].shape[0]
+                count = int(row_counts[i])
+                enum_dict = {'by': [], 'enum': [], 'x': [], 'n': []}
+                for val, num_this_val in zip(keep_list, x_counts[i]):
                     if num_this_val == 0: continue
                     enum_dict['by'].append(curby)
                     enum_dict['n'].append(count) # check this
                     enum_dict['enum'].append(val)
-                    enum_dict['x'].append(num_this_val)
+                    enum_dict['x'].append(int(num_this_val))
             else:
-                for var in keep_list:
-                    var_suff = var.split('.')[-1]
-                    enum_dict['by'].append(curby)
-                    enum_dict['enum'].append(var_suff)
-                    enum_dict['x'].append(subdf[var].sum())
-                    if var_suff.lower() != 'unknown' or use_unk:
-                        enum_dict['n'].append(count)
-                    else:
-                        enum_dict['n'].append(np.nan)
-            out_df = pd.DataFrame(enum_dict)
-            out_df['freq'] = np.round(out_df['x'] / out_df['n'], round_freq)
-            out_df.sort_values(by=['freq'], ascending=False, inplace=True)
-            out_df.reset_index(inplace=True, drop=True)
-            outdfs.append(out_df)
+                enum_dict = _bool_enum_dict(curby, keep_list, x_counts[i], n_counts[i, 0], use_unk)
+            outdfs.append(_summary_frame(enum_dict, round_freq))
             
         out_df = pd.concat(outdfs)
         if not by:
             out_df.drop('by', axis=1, inplace=True)
 
         if ci_method:
-            out_df['method'] = ci_method
-            out_df['lower'], out_df['upper'] = np.round(proportion_confint(out_df['x'], out_df['n'], alpha=1-ci_level, method=ci_method), round_freq)
+            _add_confint(out_df, ci_method, ci_level, round_freq)
         
         out_df.reset_index(inplace=True, drop=True)
 
         return out_df
 
 
+    def enum_summary_many(self, df, enums, by=None, use_unk=False, ci_method=None, ci_level=0.95, round_freq=5):
+        ''' Build summary DataFrames for several VERIS enumerations at once
+
+        Equivalent to calling `enum_summary` once per enumeration and stacking the results, but the counts of all the
+        boolean enumerations are computed together: their columns are read into a single boolean block, and x and n for
+        every enumeration (and every `by` value) come from one reduction of that block.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            DataFrame (or `BitPackedFrame`) from the `json_to_df` function
+        enums: list
+            VERIS features or enumerations to summarize
+        by: string, optional (default: None)
+            VERIS feature or enumeration to group by
+        use_unk: bool, optional (default: False) 
+            Use 'Unknown' values in the frequency calculations
+        ci_method: str, optional (default: None) 
+            Method to use for producing the confidence intervals. See `enum_summary`.
+        ci_level: float, optional (default: 0.95)
+            Confidence interval to use when specifying the `ci_method`
+        round_freq: int (default: 5) 
+            Decimal places to round the frequency values to
+
+        Returns
+        -------
+        pd DataFrame
+            Long-format DataFrame: a 'variable' column with the enumeration, followed by the columns of `enum_summary`.
+            The rows of each enumeration are the rows `enum_summary` returns for it, in the same order.
+
+        '''
+        enums = list(enums)
+        if len(enums) == 0:
+            raise ValueError('No enumerations to summarize.')
+
+        index = column_index(df)
+        by, submasks = _by_submasks(df, by, index)
+
+        # the boolean enumerations share one block of columns; each one owns a contiguous slice of it
+        slices = {}
+        start = 0
+        for enum in enums:
+            if enum in slices or _is_numeric_column(index, enum):
+                continue
+            keep_list = index.bool_children(enum)
+            slices[enum] = (keep_list, slice(start, start + len(keep_list)))
+            start += len(keep_list)
+        x_counts, n_counts = _enum_counts(df, [keep_list for keep_list, _ in slices.values()], submasks, use_unk)
+
+        n_positions = {enum: i for i, enum in enumerate(slices)}
+        enum_dfs = []
+        for enum in enums:
+            if enum in slices:
+                keep_list, cols = slices[enum]
+                outdfs = [_summary_frame(_bool_enum_dict(curby, keep_list, x_counts[i, cols], n_counts[i, n_positions[enum]], use_unk),
+                                         round_freq)
+                          for i, (curby, _) in enumerate(submasks)]
+                enum_df = pd.concat(outdfs)
+                if not by:
+                    enum_df.drop('by', axis=1, inplace=True)
+            else:  # a numeric column such as `timeline.incident.year`
+                enum_df = self.enum_summary(df, enum, by=by, use_unk=use_unk, round_freq=round_freq)
+            enum_df.insert(0, 'variable', enum)
+            enum_dfs.append(enum_df)
+
+        out_df = pd.concat(enum_dfs)
+        out_df.reset_index(inplace=True, drop=True)
+        if ci_method:
+            _add_confint(out_df, ci_method, ci_level, round_freq)
+
+        return out_df
+
+
+    def query(self, df, expression, count=False):
+        """ Rows of a VERIS DataFrame matching a boolean expression over its enumeration columns.
+
+        The expression combines names with `&` (and), `|` (or) and `!` or `~` (not), in that order of precedence from
+        lowest to highest, and parentheses. A name is either a boolean column, such as `victim.industry2.52` or
+        `action.Hacking`, or a prefix of boolean columns, such as `actor.internal` or `action.hacking.variety`, which
+        is True when any boolean column under it is. `known(name)` is True when any column under `name` other than its
+        'Unknown' ones is, and `unknown(name)` when an 'Unknown' column under `name` is True but no other one is (the
+        incidents `enum_summary` leaves out of its `n`). Names with spaces may be written as they are; names with
+        parentheses or operator characters in them must be quoted with backquotes or quotes.
+
+        The expression is evaluated on the referenced columns only, packed 64 rows to a word, so the DataFrame is
+        not copied. A `BitPackedFrame` is queried on its packed words directly.
+
+        Parameters
+        ----------
+        df: pd DataFrame
+            DataFrame (or `BitPackedFrame`) from the `json_to_df` function
+        expression: str
+            Boolean expression, for example `"action.Hacking & victim.industry2.52 & !actor.Internal"`
+        count: bool, optional (default: False)
+            Return the number of matching rows rather than a row mask
+
+        Returns
+        -------
+        np ndarray or int
+            Boolean row mask (use `df[mask]` to select the rows), or the number of matching rows if `count` is True
+
+        """
+        if count:
+            return veris_query.query_count(df, expression)
+        return veris_query.query_mask(df, expression)
+
+
     def plot_barchart(self, enum_df, title=None, fill='darkred', use_top=-1, **kwargs):
         """ Produce a simple horizontal bar chart from an `enum_summary` DataFrame.
 
@@ -621,6 +1651,7 @@ class VERIS(object):
 
         enum_df = enum_df.iloc[:use_top]
 
+        import matplotlib.pyplot as plt  # slow to import: only when plotting
         fig, ax = plt.subplots()
         ax.barh(enum_df['enum'], enum_df['freq'], color=fill, **kwargs)
         for i, f in enumerate(enum_df['freq']):